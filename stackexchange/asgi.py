@@ -2,6 +2,8 @@
 ASGI config for stackexchange project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server for the live updates of question pages, whose
+event streams stay open (see stackexchangeapp/live.py).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
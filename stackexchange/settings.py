@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'stackexchangeapp.instrumentation.QueryInstrumentationMiddleware',
+    'stackexchangeapp.routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,6 +66,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'stackexchangeapp.notifications.unread_notifications',
             ],
         },
     },
@@ -86,8 +89,79 @@ DATABASES = {
     }
 }
 
+# Read replicas, see stackexchangeapp/routing.py. REPLICA_HOSTS is a comma
+# separated list of PostgreSQL hosts sharing the credentials of the primary.
+# SQLITE_REPLICA=True runs on two SQLite files instead, to try it locally;
+# `python manage.py sync_replica` copies the primary over the replica.
+if os.getenv('SQLITE_REPLICA') == 'True':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db-replica.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+else:
+    for number, host in enumerate(filter(None, os.getenv('REPLICA_HOSTS', '').split(',')), 1):
+        DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['stackexchangeapp.routing.PrimaryReplicaRouter']
+# Seconds a client keeps reading from the primary after a write, to see its own changes
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+# Replicas further behind than this, or failing, are left out for REPLICA_RETRY_SECONDS
+REPLICA_MAX_LAG_SECONDS = int(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_LAG_CHECK_SECONDS = 5
+REPLICA_RETRY_SECONDS = 30
+
 AUTH_USER_MODEL = 'stackexchangeapp.User'
 
+# Also holds the rendered question and answer fragments, see stackexchangeapp/fragments.py.
+# Set CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache and
+# CACHE_LOCATION to a directory to share them between processes on one host.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Question views are buffered by each web process, written to the database in
+# batches and flushed by flush_view_counts, see stackexchangeapp/viewcounts.py.
+# This cache deduplicates the views of a user: shared by the web workers (Redis,
+# Memcached), a user counts once in all.
+VIEW_COUNT_CACHE_ALIAS = 'default'
+# A user's views of a question count once per this many seconds
+VIEW_DEDUPE_SECONDS = 1800
+# A process writes its buffered views once it holds this many or they are this
+# many seconds old; the views it holds when it stops are lost
+VIEW_BUFFER_SIZE = 1000
+VIEW_BUFFER_SECONDS = 10
+# Off for synthetic traffic (the benchmark command), which must not count as views
+RECORD_VIEWS = True
+
+# Side effects of writes are queued in the database and run by the runworker
+# command, see stackexchangeapp/jobs.py. JOBS_EAGER=True runs them in-process
+# after each commit instead, for development without a worker.
+JOBS_EAGER = os.getenv('JOBS_EAGER') == 'True'
+# Retries wait this long, doubling with every attempt up to the max
+JOB_RETRY_DELAY_SECONDS = 10
+JOB_RETRY_MAX_DELAY_SECONDS = 3600
+# A job running longer than this is assumed to have lost its worker, and retried
+JOB_TIMEOUT_SECONDS = 600
+# Done jobs are kept this long for the latency metrics; failed ones until deleted
+JOB_RETENTION_SECONDS = 86400
+
+# Live updates of question pages, see stackexchangeapp/live.py. The default
+# broker only reaches pages streamed by the publishing process (one ASGI worker).
+LIVE_BROKER = 'stackexchangeapp.live.InProcessBroker'
+# Idle event streams get a comment this often, so proxies keep them open
+LIVE_HEARTBEAT_SECONDS = 15
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -128,4 +202,12 @@ STATIC_URL = 'static/'
 # you cane make it = '/' but as we name this path as 'home' in urls.py it is better to replace it with 'home'
 # as if you changed the path to '/index' for example the variable name 'home' would reference it and still be valid
 LOGIN_REDIRECT_URL = "home" 
-LOGOUT_REDIRECT_URL = "home" 
\ No newline at end of file
+LOGOUT_REDIRECT_URL = "home" 
+
+# Queries repeated this many times in one request are logged as possible N+1s,
+# see stackexchangeapp/instrumentation.py
+QUERY_REPEAT_THRESHOLD = 5
+# Requests over the query_budget of their view raise instead of logging a warning.
+# The test runner turns it on, so the test suite fails on them
+QUERY_BUDGET_STRICT = False
+TEST_RUNNER = 'stackexchangeapp.testing.TestRunner'
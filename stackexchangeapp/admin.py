@@ -1,4 +1,3 @@
-
 from django.contrib import admin
 from .models import User, Stack, StackMembership, Question, Answer, Vote, Tag
 
@@ -8,5 +7,10 @@ admin.site.register(Stack)
 admin.site.register(StackMembership)
 admin.site.register(Question)
 admin.site.register(Answer)
-admin.site.register(Vote)
 admin.site.register(Tag)
+
+
+@admin.register(Vote)
+class VoteAdmin(admin.ModelAdmin):
+    # Vote.__str__ touches the user, the question and the answer's author
+    list_select_related = ('user', 'question', 'answer__answered_by')
@@ -0,0 +1,268 @@
+"""
+Read-only JSON API over stacks, questions, answers, tags and memberships.
+
+Every resource declares its public fields as {name: ORM path}. Rows are read
+with .values() on the requested paths only (?fields=id,title) and serialized
+from those dicts, without model instances. Lists are keyset paginated
+(?cursor=, ?limit=) like the HTML listings. Related objects are embedded on
+request (?embed=asked_by,tags) with one query per embed for the whole page,
+so a page costs the same number of queries whatever its size.
+
+Errors are {"error": message} with a 400 (bad parameters), 403 (not logged
+in) or 404 (unknown object, or a stack the user isn't a member of).
+"""
+from collections import defaultdict
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import F
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views import View
+
+from .models import User, Stack, StackMembership, Tag, Question, QuestionTag, Answer
+from .pagination import KeysetPaginator, InvalidCursor
+from .views import StackDetailView, QuestionDetailView
+
+USER_FIELDS = ('id', 'username')
+
+
+class ApiError(Exception):
+    pass
+
+
+class RelatedEmbed:
+    """Replace a foreign key id with the fields of the related row"""
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+
+    def load(self, rows, name):
+        ids = {row[name] for row in rows if row[name] is not None}
+        related = {obj['id']: obj for obj in self.model.objects.filter(pk__in=ids).values(*self.fields)}
+        for row in rows:
+            row[name] = related.get(row[name])
+
+
+class TagsEmbed:
+    """Add the tags of each question"""
+
+    def load(self, rows, name):
+        tags = defaultdict(list)
+        links = QuestionTag.objects.filter(question_id__in=[row['id'] for row in rows]).order_by('tag__name')
+        for question_id, tag_id, tag_name in links.values_list('question_id', 'tag_id', 'tag__name'):
+            tags[question_id].append({'id': tag_id, 'name': tag_name})
+        for row in rows:
+            row[name] = tags[row['id']]
+
+
+class ResourceView(LoginRequiredMixin, View):
+    """Abstract: subclasses declare fields and implement get_queryset"""
+    raise_exception = True
+    # Session, user, membership, the page, and one query per embed
+    query_budget = 6
+    # {public name: ORM path}
+    fields = {}
+    # {public name: embed}; embeds named like a field replace it
+    embeds = {}
+    ordering = ('id',)
+    # URL kwarg of the detail view
+    lookup = None
+    per_page = 30
+    max_per_page = 100
+
+    def get_queryset(self):
+        """The rows of the resource the user may read, e.g. only from the stacks they joined"""
+        raise NotImplementedError(f"{type(self).__name__} must implement get_queryset()")
+
+    def handle_no_permission(self):
+        return JsonResponse({'error': "Authentication required"}, status=403)
+
+    def get(self, request, **kwargs):
+        try:
+            fields = self.parse_names('fields', self.fields) or list(self.fields)
+            embeds = self.parse_names('embed', self.embeds)
+            # Embeds need the id, and the foreign key of the field they replace
+            columns = set(fields) | {'id'} | {name for name in embeds if name in self.fields}
+            paths = {self.fields[name] for name in columns}
+            queryset = self.get_queryset()
+            if self.lookup in kwargs:
+                row = queryset.filter(pk=kwargs[self.lookup]).values(*paths).first()
+                if row is None:
+                    raise Http404
+                return JsonResponse(self.serialize([row], columns, 'id' in fields, embeds)[0])
+
+            paginator = KeysetPaginator(
+                queryset.values(*paths.union(name.lstrip('-') for name in self.ordering)),
+                self.ordering,
+                self.parse_limit(),
+            )
+            page = paginator.page(request.GET.get('cursor'))
+        except (ApiError, InvalidCursor) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Http404:
+            return JsonResponse({'error': "Not found"}, status=404)
+        return JsonResponse({
+            'results': self.serialize(page.object_list, columns, 'id' in fields, embeds),
+            'next_cursor': page.next_cursor,
+        })
+
+    def serialize(self, rows, columns, with_id, embeds):
+        results = [{name: row[path] for name, path in self.fields.items() if name in columns} for row in rows]
+        for name in embeds:
+            self.embeds[name].load(results, name)
+        if not with_id:
+            for result in results:
+                del result['id']
+        return results
+
+    def parse_names(self, param, allowed):
+        names = [name for name in self.request.GET.get(param, '').split(',') if name]
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise ApiError(f"Unknown {param}: {', '.join(unknown)}. Available: {', '.join(allowed)}")
+        return list(dict.fromkeys(names))
+
+    def parse_limit(self):
+        try:
+            limit = int(self.request.GET.get('limit', self.per_page))
+        except ValueError:
+            raise ApiError("limit must be a number")
+        if not 1 <= limit <= self.max_per_page:
+            raise ApiError(f"limit must be between 1 and {self.max_per_page}")
+        return limit
+
+    def get_membership(self):
+        try:
+            return get_object_or_404(StackMembership, user=self.request.user, stack_id=self.kwargs['stack_id'])
+        except Http404:
+            raise Http404("Not a member of this stack")
+
+
+class StackApiView(ResourceView):
+    query_budget = 5
+    fields = {
+        'id': 'id',
+        'title': 'title',
+        'slug': 'slug',
+        'description': 'description',
+        'created_by': 'created_by_id',
+        'created_at': 'created_at',
+        'last_activity_at': 'last_activity_at',
+    }
+    embeds = {'created_by': RelatedEmbed(User, USER_FIELDS)}
+    lookup = 'stack_id'
+
+    def get_queryset(self):
+        return Stack.objects.all()
+
+
+class QuestionApiView(ResourceView):
+    # One more for the tag filter
+    query_budget = 7
+    fields = {
+        'id': 'id',
+        'title': 'title',
+        'description': 'description',
+        'description_html': 'description_html',
+        'asked_by': 'asked_by_id',
+        'created_at': 'created_at',
+        'last_activity_at': 'last_activity_at',
+        'score': 'score',
+        'upvotes': 'upvotes',
+        'downvotes': 'downvotes',
+        'answer_count': 'answer_count',
+        'view_count': 'view_count',
+        'accepted_answer': 'accepted_answer_id',
+        'hot_score': 'hot_score',
+    }
+    embeds = {'asked_by': RelatedEmbed(User, USER_FIELDS), 'tags': TagsEmbed()}
+    lookup = 'question_id'
+    # Tag pages newest first, from the (tag, -created_at, -question) index of QuestionTag
+    tagged_ordering = ('-tagged_at', '-tagged_question')
+
+    def get(self, request, **kwargs):
+        sort = request.GET.get('sort', 'newest')
+        if sort not in StackDetailView.sort_orderings:
+            return JsonResponse({'error': f"Unknown sort. Available: {', '.join(StackDetailView.sort_orderings)}"}, status=400)
+        self.ordering = StackDetailView.sort_orderings[sort]
+        return super().get(request, **kwargs)
+
+    def get_queryset(self):
+        self.get_membership()
+        questions = Question.objects.filter(stack_id=self.kwargs['stack_id'])
+        if self.request.GET.get('sort') == 'unanswered':
+            questions = questions.filter(answer_count=0)
+        if 'tag' in self.request.GET:
+            tag = Tag.objects.filter(stack_id=self.kwargs['stack_id'], name=self.request.GET['tag']).first()
+            if tag is None:
+                raise Http404("Unknown tag")
+            # The annotations reuse the join of the filter, so paging on them doesn't join again
+            questions = questions.filter(questiontag__tag=tag).annotate(
+                tagged_at=F('questiontag__created_at'),
+                tagged_question=F('questiontag__question_id'),
+            )
+            if self.ordering == StackDetailView.sort_orderings['newest']:
+                self.ordering = self.tagged_ordering
+        return questions
+
+
+class AnswerApiView(ResourceView):
+    fields = {
+        'id': 'id',
+        'question': 'question_id',
+        'description': 'description',
+        'description_html': 'description_html',
+        'answered_by': 'answered_by_id',
+        'is_accepted': 'is_accepted',
+        'created_at': 'created_at',
+        'score': 'score',
+        'upvotes': 'upvotes',
+        'downvotes': 'downvotes',
+    }
+    embeds = {'answered_by': RelatedEmbed(User, USER_FIELDS)}
+    lookup = 'answer_id'
+
+    def get_queryset(self):
+        self.get_membership()
+        answers = Answer.objects.filter(question__stack_id=self.kwargs['stack_id'])
+        if 'question_id' in self.kwargs:
+            # Listed like on the question page, from the same index
+            self.ordering = QuestionDetailView.answer_ordering
+            answers = answers.filter(question_id=self.kwargs['question_id'])
+        return answers
+
+
+class TagApiView(ResourceView):
+    fields = {
+        'id': 'id',
+        'name': 'name',
+        'question_count': 'question_count',
+        'created_at': 'created_at',
+    }
+    ordering = ('-question_count', '-id')
+
+    def get_queryset(self):
+        self.get_membership()
+        return Tag.objects.filter(stack_id=self.kwargs['stack_id'])
+
+
+class MembershipApiView(ResourceView):
+    """The members of a stack, or the memberships of the current user"""
+    fields = {
+        'id': 'id',
+        'user': 'user_id',
+        'stack': 'stack_id',
+        'reputation': 'reputation',
+        'joined_at': 'joined_at',
+    }
+    embeds = {
+        'user': RelatedEmbed(User, USER_FIELDS),
+        'stack': RelatedEmbed(Stack, ('id', 'title', 'slug')),
+    }
+
+    def get_queryset(self):
+        if 'stack_id' in self.kwargs:
+            self.get_membership()
+            return StackMembership.objects.filter(stack_id=self.kwargs['stack_id'])
+        return StackMembership.objects.filter(user=self.request.user)
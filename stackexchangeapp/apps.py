@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class StackexchangeappConfig(AppConfig):
     name = 'stackexchangeapp'
+
+    def ready(self):
+        # Also imports the modules defining the tasks of the job queue, see jobs.py
+        from . import signals  # noqa: F401
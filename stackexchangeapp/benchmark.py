@@ -0,0 +1,266 @@
+"""
+In-process benchmark of the core views, driven through the Django test client.
+
+Used by the benchmark management command. Each scenario is run twice: once
+for latency and query counts, then for a few requests under tracemalloc for
+peak memory (tracemalloc slows Python down too much to time with it on).
+
+run_concurrent compares the WSGI and ASGI handlers under concurrent load on
+read scenarios: WSGIHandler from a thread pool, the way a threaded WSGI
+server runs it, and ASGIHandler from coroutines on one event loop, the way
+an ASGI server runs it.
+"""
+import asyncio
+import io
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.urls import reverse
+
+from .models import Stack, StackMembership, Question, Answer
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    url: str
+    data: dict = field(default_factory=dict)
+    # Write scenarios are rolled back so repeated runs see the same dataset
+    writes: bool = False
+
+
+def targets(stack_id):
+    """The stack, its most answered question, an answer and a member who can vote on both"""
+    if stack_id is not None:
+        stack = Stack.objects.filter(pk=stack_id).first()
+    else:
+        members = StackMembership.objects.values('stack_id').order_by().annotate(members=Count('pk'))
+        busiest = members.order_by('-members').first()
+        stack = Stack.objects.filter(pk=busiest['stack_id']).first() if busiest else None
+    if stack is None:
+        raise CommandError("No stack to benchmark, run seed_data first")
+    question = Question.objects.filter(stack=stack).order_by('-answer_count', '-pk').first()
+    if question is None:
+        raise CommandError("Nothing to benchmark, run seed_data first")
+    answer = Answer.objects.filter(question=question).exclude(answered_by=question.asked_by).first()
+    excluded = [question.asked_by_id, answer.answered_by_id if answer else None]
+    membership = StackMembership.objects.filter(stack=stack).exclude(user_id__in=[pk for pk in excluded if pk])
+    membership = membership.select_related('user').first()
+    if membership is None:
+        raise CommandError("The stack needs a member who didn't write the benchmarked posts")
+    return stack, question, answer, membership.user
+
+
+def core_scenarios(stack, question, answer):
+    stack_url = reverse('stack', args=[stack.id, stack.slug])
+    scenarios = [
+        Scenario('home', 'GET', reverse('home')),
+        Scenario('stack_newest', 'GET', stack_url),
+        Scenario('stack_votes', 'GET', stack_url, {'sort': 'votes'}),
+        Scenario('question_detail', 'GET', reverse('question_detail', args=[stack.id, question.id])),
+        Scenario('question_vote', 'POST', reverse('question_vote', args=[stack.id, question.id, 'up']), writes=True),
+        Scenario('ask_question', 'POST', reverse('ask_question', args=[stack.id]), {
+            'title': 'Benchmark question',
+            'description': 'How fast is asking a question?',
+            'tag_names': 'benchmark,performance',
+        }, writes=True),
+    ]
+    if answer:
+        scenarios.insert(5, Scenario(
+            'answer_vote', 'POST', reverse('answer_vote', args=[stack.id, question.id, answer.id, 'down']), writes=True,
+        ))
+    return scenarios
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def request(client, scenario):
+    if scenario.method == 'POST':
+        return client.post(scenario.url, scenario.data)
+    return client.get(scenario.url, scenario.data)
+
+
+def run_scenario(client, scenario, requests=200, warmup=10, memory_requests=10):
+    with transaction.atomic():
+        for _ in range(warmup):
+            request(client, scenario)
+
+        latencies = []
+        queries = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = request(client, scenario)
+            latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(getattr(response, 'query_count', 0))
+            if response.status_code >= 400:
+                raise RuntimeError(f"{scenario.name}: {scenario.method} {scenario.url} returned {response.status_code}")
+
+        tracemalloc.start()
+        peak = 0
+        for _ in range(memory_requests):
+            tracemalloc.reset_peak()
+            request(client, scenario)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        if scenario.writes:
+            transaction.set_rollback(True)
+
+    return summarize(latencies, queries, peak)
+
+
+def wsgi_request(handler, scenario, cookie):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': scenario.url,
+        'QUERY_STRING': urlencode(scenario.data),
+        'HTTP_COOKIE': cookie,
+        'HTTP_HOST': 'testserver',
+        'SERVER_NAME': 'testserver',
+        'wsgi.input': io.BytesIO(),
+    }
+    setup_testing_defaults(environ)
+    status = []
+    response = handler(environ, lambda code, headers: status.append(int(code.split()[0])))
+    try:
+        b''.join(response)
+    finally:
+        response.close()
+    return status[0]
+
+
+async def asgi_request(handler, scenario, cookie):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': scenario.url,
+        'raw_path': scenario.url.encode(),
+        'query_string': urlencode(scenario.data).encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client never disconnects; the handler cancels this when done
+        await asyncio.Event().wait()
+
+    status = []
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler(scope, receive, send)
+    return status[0]
+
+
+def run_concurrent(scenario, cookie, concurrency=8, requests=200, warmup=10):
+    """Throughput and latency of a GET scenario through both handlers, concurrency requests at a time"""
+    return {
+        'wsgi': run_wsgi(scenario, cookie, concurrency, requests, warmup),
+        'asgi': asyncio.run(run_asgi(scenario, cookie, concurrency, requests, warmup)),
+    }
+
+
+def run_wsgi(scenario, cookie, concurrency, requests, warmup):
+    handler = WSGIHandler()
+
+    def timed(_):
+        start = time.perf_counter()
+        status = wsgi_request(handler, scenario, cookie)
+        return (time.perf_counter() - start) * 1000, status
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(timed, range(warmup)))
+        start = time.perf_counter()
+        timings = list(pool.map(timed, range(requests)))
+        elapsed = time.perf_counter() - start
+    return summarize_concurrent(scenario, timings, elapsed)
+
+
+async def run_asgi(scenario, cookie, concurrency, requests, warmup):
+    handler = ASGIHandler()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def timed():
+        async with slots:
+            start = time.perf_counter()
+            status = await asgi_request(handler, scenario, cookie)
+            return (time.perf_counter() - start) * 1000, status
+
+    await asyncio.gather(*(timed() for _ in range(warmup)))
+    start = time.perf_counter()
+    timings = await asyncio.gather(*(timed() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    return summarize_concurrent(scenario, timings, elapsed)
+
+
+def summarize_concurrent(scenario, timings, elapsed):
+    failed = [status for _, status in timings if status >= 400]
+    if failed:
+        raise RuntimeError(f"{scenario.name}: GET {scenario.url} returned {failed[0]}")
+    return dict(
+        summarize_latencies([latency for latency, _ in timings]),
+        throughput_rps=round(len(timings) / elapsed, 1),
+    )
+
+
+def summarize(latencies, queries, peak_memory=0):
+    return dict(
+        summarize_latencies(latencies),
+        queries_per_request=round(sum(queries) / len(queries), 2) if queries else None,
+        max_queries=max(queries) if queries else None,
+        peak_memory_kb=round(peak_memory / 1024, 1),
+    )
+
+
+def summarize_latencies(latencies):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+    }
+
+
+def compare(results, baseline, threshold=0.2):
+    """Return human readable regressions of results against a baseline run"""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'peak_memory_kb'):
+            if previous.get(metric) and current[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f"{name}: {metric} {previous[metric]} -> {current[metric]}")
+        if previous.get('max_queries') is not None and current['max_queries'] > previous['max_queries']:
+            regressions.append(f"{name}: max_queries {previous['max_queries']} -> {current['max_queries']}")
+    return regressions
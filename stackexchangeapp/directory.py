@@ -0,0 +1,82 @@
+"""
+The stack directory of the home page.
+
+Stack.member_count, question_count and answer_count are denormalized: the
+join, leave, create, ask and answer paths keep them up to date with F()
+updates, and recount_stacks recomputes them. Every sort is served by one of
+the Stack indexes, so a page of the directory costs one query however many
+stacks there are.
+
+The ids of the stacks a user joined are cached per user and version of their
+memberships (User.memberships_version, read with the user on every request),
+which joins and leaves bump in their transaction: every process sees the new
+version once it commits, whatever cache it uses. Titles are searched with the
+full-text index of search.py.
+"""
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import User, Stack, StackMembership, Question, Answer
+from .search import matching_stacks
+
+# Each ordering is served by one of the Stack indexes, see Stack.Meta
+DIRECTORY_SORTS = {
+    'active': ('-last_activity_at', '-id'),
+    'size': ('-member_count', '-id'),
+    'newest': ('-created_at', '-id'),
+}
+JOINED_STACKS_TIMEOUT = 3600
+
+
+def joined_stacks_key(user):
+    return f'joined-stacks:{user.pk}:{user.memberships_version}'
+
+
+async def ajoined_stack_ids(user):
+    """The ids of the stacks a user is a member of, from the cache when possible"""
+    key = joined_stacks_key(user)
+    ids = await cache.aget(key)
+    if ids is None:
+        memberships = StackMembership.objects.filter(user_id=user.pk).values_list('stack_id', flat=True)
+        ids = [stack_id async for stack_id in memberships]
+        await cache.aset(key, ids, JOINED_STACKS_TIMEOUT)
+    return set(ids)
+
+
+def invalidate_joined_stacks(user_id):
+    """Bump the memberships version of a user, in the transaction of the join or leave"""
+    User.objects.filter(pk=user_id).update(memberships_version=F('memberships_version') + 1)
+
+
+def directory_queryset(query=''):
+    stacks = Stack.objects.all()
+    if query:
+        matching = matching_stacks(query)
+        stacks = stacks.none() if matching is None else stacks.filter(pk__in=matching)
+    return stacks
+
+
+def stack_counts():
+    """Subqueries counting the members, questions and answers of the outer stack"""
+    def total(queryset, field):
+        counts = queryset.order_by().values(field).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(counts), Value(0))
+
+    return {
+        'member_count': total(StackMembership.objects.filter(stack=OuterRef('pk')), 'stack'),
+        'question_count': total(Question.objects.filter(stack=OuterRef('pk')), 'stack'),
+        'answer_count': total(Answer.objects.filter(question__stack=OuterRef('pk')), 'question__stack'),
+    }
+
+
+def recount_stacks(stack_id=None, check=False):
+    """Recompute the counters of every stack (or one). Returns the number of stacks that had drifted."""
+    stacks = Stack.objects.all() if stack_id is None else Stack.objects.filter(pk=stack_id)
+    counts = stack_counts()
+    drifted = stacks.annotate(**{f'real_{name}': count for name, count in counts.items()}).filter(
+        Q(*[~Q(**{name: F(f'real_{name}')}) for name in counts], _connector=Q.OR)
+    )
+    if check:
+        return drifted.count()
+    return Stack.objects.filter(pk__in=list(drifted.values_list('pk', flat=True))).update(**stack_counts())
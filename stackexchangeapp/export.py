@@ -0,0 +1,117 @@
+"""
+Streaming export of a stack: questions, answers, votes, tags and memberships.
+
+Rows are read with values_list().iterator(chunk_size), which uses server-side
+cursors on PostgreSQL, and written out a chunk at a time, so memory use
+doesn't depend on the size of the stack and the first bytes go out right
+away. JSONL exports hold every table, one object per line with its "table";
+CSV exports hold one table each. Both can be gzipped on the fly.
+"""
+import csv
+import io
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import StackMembership, Tag, Question, QuestionTag, Answer, Vote
+from .utils import batched
+
+FORMATS = ('jsonl', 'csv')
+
+# {table: [(queryset factory, columns)]}; a table can be read from several querysets
+TABLES = {
+    'questions': [(
+        lambda stack_id: Question.objects.filter(stack_id=stack_id),
+        ('id', 'title', 'description', 'asked_by_id', 'created_at', 'edited_by_id', 'edited_at',
+         'score', 'upvotes', 'downvotes', 'answer_count', 'view_count', 'accepted_answer_id', 'last_activity_at'),
+    )],
+    'answers': [(
+        lambda stack_id: Answer.objects.filter(question__stack_id=stack_id),
+        ('id', 'question_id', 'description', 'answered_by_id', 'is_accepted', 'created_at', 'score', 'upvotes', 'downvotes'),
+    )],
+    'votes': [
+        (lambda stack_id: Vote.objects.filter(question__stack_id=stack_id), ('id', 'user_id', 'question_id', 'answer_id', 'vote_type', 'created_at')),
+        (lambda stack_id: Vote.objects.filter(answer__question__stack_id=stack_id), ('id', 'user_id', 'question_id', 'answer_id', 'vote_type', 'created_at')),
+    ],
+    'tags': [(
+        lambda stack_id: Tag.objects.filter(stack_id=stack_id),
+        ('id', 'name', 'question_count', 'created_at'),
+    )],
+    'question_tags': [(
+        lambda stack_id: QuestionTag.objects.filter(tag__stack_id=stack_id),
+        ('question_id', 'tag_id'),
+    )],
+    'memberships': [(
+        lambda stack_id: StackMembership.objects.filter(stack_id=stack_id),
+        ('user_id', 'user__username', 'reputation', 'joined_at'),
+    )],
+}
+
+
+def columns(table):
+    return TABLES[table][0][1]
+
+
+def iter_rows(stack_id, table, chunk_size=2000):
+    """Tuples of the columns of a table, in constant memory"""
+    for queryset, fields in TABLES[table]:
+        yield from queryset(stack_id).order_by('pk').values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def export_jsonl(stack_id, tables=None, chunk_size=2000):
+    """Text chunks of JSON lines, about chunk_size rows each"""
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for table in tables or TABLES:
+        names = columns(table)
+        for batch in batched(iter_rows(stack_id, table, chunk_size), chunk_size):
+            yield ''.join(encoder.encode({'table': table, **dict(zip(names, row))}) + '\n' for row in batch)
+
+
+def export_csv(stack_id, table, chunk_size=2000):
+    """Text chunks of the CSV of one table, header first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow(columns(table))
+    yield flush()
+    for batch in batched(iter_rows(stack_id, table, chunk_size), chunk_size):
+        writer.writerows([value.isoformat() if hasattr(value, 'isoformat') else value for value in row] for row in batch)
+        yield flush()
+
+
+def export_stack(stack_id, format='jsonl', table=None, chunk_size=2000):
+    if format == 'csv':
+        return export_csv(stack_id, table, chunk_size)
+    return export_jsonl(stack_id, [table] if table else None, chunk_size)
+
+
+def encode(chunks, compress=False):
+    """UTF-8 bytes of text chunks, gzipped as they go if compress"""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode()
+        return
+    gzip = zlib.compressobj(wbits=31)  # 31: gzip container
+    for chunk in chunks:
+        # Flushed at every chunk, so compressed output doesn't stall in zlib's buffer
+        yield gzip.compress(chunk.encode()) + gzip.flush(zlib.Z_SYNC_FLUSH)
+    yield gzip.flush()
+
+
+async def aiterate(iterator):
+    """
+    Serve a sync iterator to an async consumer one item at a time. ASGI would
+    otherwise read a sync streaming response into memory in full. The
+    iterator stays on one thread, as its database cursor requires.
+    """
+    iterator = iter(iterator)
+    done = object()
+    while (item := await sync_to_async(next, thread_sensitive=True)(iterator, done)) is not done:
+        yield item
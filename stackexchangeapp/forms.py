@@ -1,6 +1,12 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
-from .models import User, Stack, Question, Tag, Answer
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import F
+from .models import User, Stack, Question, Answer, record_activity
+from .fragments import invalidate_fragments
+from .ranking import HOT_WEIGHTS
+from .tags import TAG_MAX_LENGTH, normalize_tag_names, resolve_tags, tag_question
 
 class UserCreationFormStackApp(UserCreationForm):
     email = forms.EmailField(required=True)
@@ -24,20 +30,30 @@ class QuestionForm(forms.ModelForm):
         self.stack = kwargs.pop('stack', None)
         super().__init__(*args, **kwargs)
 
+    def clean_tag_names(self):
+        names = normalize_tag_names(self.cleaned_data['tag_names'])
+        if not names:
+            raise forms.ValidationError("Enter at least one tag.")
+        too_long = [name for name in names if len(name) > TAG_MAX_LENGTH]
+        if too_long:
+            raise forms.ValidationError(f"Tags can be at most {TAG_MAX_LENGTH} characters: {', '.join(too_long)}")
+        return names
+
     def save(self, commit=True):
         question = super().save(commit=False)
+        question.last_activity_at = timezone.now()
+        question.hot_score = HOT_WEIGHTS['question']
 
         if commit:
-            question.save()
-
-            tag_names = self.cleaned_data['tag_names'].split(',')
-            for tag_name in tag_names:
-                if tag_name:
-                    tag, created = Tag.objects.get_or_create(
-                        name=tag_name,
-                        stack=self.stack
-                    )
-                    question.tags.add(tag)
+            # The question, its tags and the stack and tag counters all or none
+            with transaction.atomic():
+                question.save()
+                record_activity(question.stack_id, when=question.last_activity_at,
+                                stack_changes={'question_count': F('question_count') + 1})
+
+                tag_question(question, resolve_tags(question.stack_id, self.cleaned_data['tag_names']))
+                # Once committed, see invalidate_fragments
+                invalidate_fragments('question', question.pk)
         return question
 
 class AnswerForm(forms.ModelForm):
@@ -0,0 +1,98 @@
+"""
+Versioned cache of rendered HTML fragments (question cards, question and
+answer bodies).
+
+Every question and answer has a version token in the cache, replaced with a
+new random one on every write to it (see invalidate_fragments), and its
+fragments are cached under that version. Stale fragments are never deleted,
+they just stop being looked up and expire. Tokens are random rather than
+counters so a version that was evicted can't come back and serve an old
+fragment, and no atomic incr is needed, which the file backend lacks.
+Versions also record when the write happened: right after it, fragments
+rendered from rows read on a replica may predate it and aren't cached.
+
+Fragments only hold what is the same for every user. Per-user bits (the
+user's vote, the accept button) and relative dates are rendered around them.
+"""
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .routing import may_be_behind
+
+# Stale versions are never looked up again, so this only bounds how long they linger
+FRAGMENT_CACHE_TIMEOUT = 24 * 3600
+
+
+def get_cache():
+    return caches[getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default')]
+
+
+def version_key(kind, pk):
+    return f'fragment-version:{kind}:{pk}'
+
+
+def fragment_key(kind, pk, version, name):
+    return f'fragment:{kind}:{pk}:{name}:{version}'
+
+
+def new_version(written_at=None):
+    return f'{int(written_at or 0)}-{uuid4().hex}'
+
+
+def version_written_at(version):
+    written_at, _, _ = version.partition('-')
+    return int(written_at) if written_at.isdigit() else 0
+
+
+def load_fragments(objects, kind, names):
+    """
+    Look up the current version and the cached fragments of objects, two cache
+    round trips for a whole page. Returns the objects with fragments missing,
+    which are rendered (and cached) by the {% fragment %} tag.
+    """
+    cache = get_cache()
+    objects = list(objects)
+    keys = {obj.pk: version_key(kind, obj.pk) for obj in objects}
+    versions = cache.get_many(keys.values())
+    for key in set(keys.values()) - versions.keys():
+        version = new_version()
+        # add, not set: a version bumped meanwhile must win
+        versions[key] = version if cache.add(key, version, None) else cache.get(key, version)
+
+    wanted = {}
+    for obj in objects:
+        obj.fragment_kind = kind
+        obj.fragment_version = versions[keys[obj.pk]]
+        obj.fragments = {}
+        for name in names:
+            wanted[fragment_key(kind, obj.pk, obj.fragment_version, name)] = (obj, name)
+    for key, html in cache.get_many(wanted).items():
+        obj, name = wanted[key]
+        obj.fragments[name] = html
+    return [obj for obj in objects if len(obj.fragments) < len(names)]
+
+
+def render_fragment(obj, name, render):
+    """Return the cached fragment of obj, or render and cache it"""
+    fragments = getattr(obj, 'fragments', None)
+    if fragments is None:
+        # Not loaded by the view: render without caching
+        return render()
+    if name not in fragments:
+        fragments[name] = render()
+        if may_be_behind(obj, version_written_at(obj.fragment_version)):
+            return fragments[name]
+        key = fragment_key(obj.fragment_kind, obj.pk, obj.fragment_version, name)
+        get_cache().set(key, str(fragments[name]), FRAGMENT_CACHE_TIMEOUT)
+    return fragments[name]
+
+
+def invalidate_fragments(kind, *pks):
+    """Give the objects a new version once the current transaction commits"""
+    keys = [version_key(kind, pk) for pk in pks if pk]
+    if keys:
+        transaction.on_commit(lambda: get_cache().set_many({key: new_version(time.time()) for key in keys}, None))
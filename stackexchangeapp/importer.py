@@ -0,0 +1,354 @@
+"""
+Streaming importer for the public Stack Exchange data dump format.
+
+The dump files (Tags.xml, Users.xml, Posts.xml, Votes.xml) are read with
+iterparse, clearing every row once handled, so memory stays flat whatever the
+dump size. Rows are written in large bulk_create batches; each batch commits
+together with ImportRun.position (the last dump Id imported), so an
+interrupted import resumes after its last committed batch. Dump Ids are
+mapped to our primary keys through ImportedRow.
+
+Scores, answer and tag counts, activity dates and reputation are not maintained per
+row but derived in set-based passes once every row is in (the finalize phase).
+
+Votes in the public dumps are anonymous, and a user may vote on a post only
+once, so the n-th vote on a post is attributed to the n-th of a pool of
+placeholder voter accounts of the stack.
+"""
+import html
+import os
+import re
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from xml.etree.ElementTree import iterparse
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Count, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.html import strip_tags
+from django.utils.text import slugify
+
+from .models import User, StackMembership, Tag, Question, QuestionTag, Answer, Vote, ImportRun, ImportedRow, record_activity
+from .ranking import rebuild_hot_scores, reconcile
+from .rendering import render_description
+from .reputation import replay_votes
+from .search import index_questions
+from .tags import recount_tags
+from .directory import recount_stacks
+from .utils import batched, explicit_timestamps
+
+QUESTION_POST, ANSWER_POST = '1', '2'
+VOTE_TYPES = {'2': 'up', '3': 'down'}
+TAG_NAMES = re.compile(r'[^<>|]+')
+CODE_BLOCK = re.compile(r'<pre[^>]*>\s*<code[^>]*>(.*?)</code>\s*</pre>', re.DOTALL | re.IGNORECASE)
+INLINE_CODE = re.compile(r'<code[^>]*>(.*?)</code>', re.DOTALL | re.IGNORECASE)
+BACKTICKS = re.compile(r'`+')
+# Code set aside by post_text, as control characters XML can't contain; blocks take the blank lines around them
+PLACEHOLDER = re.compile(r'\x00(\d+)\x00|\s*\x01(\d+)\x01\s*')
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value).replace(tzinfo=dt_timezone.utc)
+
+
+def longest_backticks(code):
+    return max((len(run) for run in BACKTICKS.findall(code)), default=0)
+
+
+def post_text(body):
+    """
+    Markdown source of a dump post body (HTML). Code blocks and inline code
+    become Markdown code, fenced with more backticks than they contain; any
+    other markup is dropped.
+    """
+    code = []
+
+    def code_block(match):
+        text = html.unescape(strip_tags(match.group(1))).strip('\n')
+        fence = '`' * max(3, longest_backticks(text) + 1)
+        code.append(f'{fence}\n{text}\n{fence}')
+        return f'\x01{len(code) - 1}\x01'
+
+    def inline_code(match):
+        text = html.unescape(strip_tags(match.group(1)))
+        ticks = '`' * (longest_backticks(text) + 1)
+        padding = ' ' if text.startswith('`') or text.endswith('`') else ''
+        code.append(f'{ticks}{padding}{text}{padding}{ticks}')
+        return f'\x00{len(code) - 1}\x00'
+
+    # Code is set aside first, so unescaping the rest can't turn it into markup
+    body = INLINE_CODE.sub(inline_code, CODE_BLOCK.sub(code_block, body or ''))
+    text = html.unescape(strip_tags(body))
+
+    def restore(match):
+        if match.group(1):
+            return code[int(match.group(1))]
+        return f'\n\n{code[int(match.group(2))]}\n\n'
+
+    return PLACEHOLDER.sub(restore, text).strip()
+
+
+def iter_rows(path, after=None):
+    """Yield the attributes of every <row> with an Id above after, in constant memory"""
+    context = iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event == 'end' and element.tag == 'row':
+            if after is None or int(element.get('Id')) > after:
+                yield dict(element.attrib)
+            root.clear()
+
+
+class DumpImporter:
+    def __init__(self, run, directory, batch_size=5000, build_search_index=True, stdout=None):
+        self.run = run
+        self.stack = run.stack
+        self.directory = directory
+        self.batch_size = batch_size
+        self.build_search_index = build_search_index
+        self.stdout = stdout
+        self.tag_ids = None
+        self.voters = None
+
+    def log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+
+    def run_all(self):
+        while self.run.phase != 'done':
+            phase = self.run.phase
+            self.log(f"{phase}: resuming after Id {self.run.position}" if self.run.position is not None else f"{phase}...")
+            getattr(self, f'import_{phase}')()
+            self.advance()
+
+    def advance(self):
+        phases = ImportRun.PHASES
+        self.run.phase = phases[phases.index(self.run.phase) + 1]
+        self.run.position = None
+        self.run.save(update_fields=['phase', 'position', 'updated_at'])
+
+    def batches(self, filename):
+        path = os.path.join(self.directory, filename)
+        if not os.path.exists(path):
+            self.log(f"{filename} not found, skipping")
+            return
+        yield from batched(iter_rows(path, after=self.run.position), self.batch_size)
+
+    @contextmanager
+    def atomic_batch(self, batch):
+        """Write a batch in one transaction, committed with the position after it"""
+        with transaction.atomic():
+            self.tune_transaction()
+            yield
+            self.run.position = int(batch[-1]['Id'])
+            self.run.save(update_fields=['position', 'updated_at'])
+
+    def tune_transaction(self):
+        # Foreign keys are already DEFERRABLE INITIALLY DEFERRED on PostgreSQL; check them
+        # once per batch at commit, and don't wait for the WAL flush of every batch
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+                cursor.execute("SET LOCAL synchronous_commit TO OFF")
+
+    def remember(self, kind, pairs, accepted=None):
+        accepted = accepted or {}
+        ImportedRow.objects.bulk_create(
+            [
+                ImportedRow(run=self.run, kind=kind, source_id=source_id, target_id=target_id,
+                            accepted_source_id=accepted.get(source_id))
+                for source_id, target_id in pairs
+            ],
+            batch_size=self.batch_size,
+        )
+
+    def lookup(self, kinds, source_ids):
+        rows = ImportedRow.objects.filter(run=self.run, kind__in=kinds, source_id__in=set(source_ids))
+        return {row.source_id: row for row in rows.only('kind', 'source_id', 'target_id', 'accepted_source_id')}
+
+    # Phases
+
+    def import_tags(self):
+        for batch in self.batches('Tags.xml'):
+            with self.atomic_batch(batch):
+                Tag.objects.bulk_create(
+                    [Tag(name=row['TagName'][:35], stack=self.stack) for row in batch],
+                    ignore_conflicts=True,
+                )
+
+    def import_users(self):
+        for batch in self.batches('Users.xml'):
+            with self.atomic_batch(batch):
+                users = [
+                    User(
+                        username=f"{slugify(row.get('DisplayName', ''))[:100] or 'user'}_{self.stack.pk}_{row['Id']}",
+                        first_name=row.get('DisplayName', '')[:150],
+                        password=make_password(None),
+                        date_joined=parse_date(row['CreationDate']),
+                    )
+                    for row in batch
+                ]
+                User.objects.bulk_create(users)
+                StackMembership.objects.bulk_create(
+                    [StackMembership(user=user, stack=self.stack) for user in users],
+                    ignore_conflicts=True,
+                )
+                self.remember('user', [(int(row['Id']), user.pk) for row, user in zip(batch, users)])
+
+    def import_posts(self):
+        self.ghost = User.objects.get_or_create(
+            username=f'ghost_{self.stack.pk}',
+            defaults={'first_name': 'Deleted user', 'password': make_password(None)},
+        )[0]
+        for batch in self.batches('Posts.xml'):
+            with self.atomic_batch(batch):
+                questions = [row for row in batch if row.get('PostTypeId') == QUESTION_POST]
+                answers = [row for row in batch if row.get('PostTypeId') == ANSWER_POST]
+                owners = self.lookup(['user'], [int(row['OwnerUserId']) for row in batch if row.get('OwnerUserId')])
+                self.import_questions(questions, owners)
+                self.import_answers(answers, owners)
+
+    def owner_id(self, row, owners):
+        owner = owners.get(int(row['OwnerUserId'])) if row.get('OwnerUserId') else None
+        return owner.target_id if owner else None
+
+    def import_questions(self, rows, owners):
+        if not rows:
+            return
+        questions = []
+        for row in rows:
+            created_at = parse_date(row['CreationDate'])
+            questions.append(Question(
+                title=html.unescape(row.get('Title', ''))[:150],
+                description=post_text(row.get('Body')),
+                asked_by_id=self.owner_id(row, owners),
+                stack=self.stack,
+                created_at=created_at,
+                last_activity_at=created_at,
+            ))
+        for question in questions:
+            render_description(question)
+        with explicit_timestamps(Question._meta.get_field('created_at')):
+            Question.objects.bulk_create(questions)
+
+        tag_names = [TAG_NAMES.findall(row.get('Tags', '')) for row in rows]
+        tag_ids = self.resolve_tags({name[:35] for names in tag_names for name in names})
+        QuestionTag.objects.bulk_create(
+            [
+                QuestionTag(question_id=question.pk, tag_id=tag_ids[name[:35]], created_at=question.created_at)
+                for question, names in zip(questions, tag_names)
+                for name in set(names)
+            ],
+            ignore_conflicts=True,
+        )
+        accepted = {int(row['Id']): int(row['AcceptedAnswerId']) for row in rows if row.get('AcceptedAnswerId')}
+        self.remember('question', [(int(row['Id']), question.pk) for row, question in zip(rows, questions)], accepted)
+
+    def resolve_tags(self, names):
+        if self.tag_ids is None:
+            self.tag_ids = dict(Tag.objects.filter(stack=self.stack).values_list('name', 'pk'))
+        missing = names - self.tag_ids.keys()
+        if missing:
+            Tag.objects.bulk_create([Tag(name=name, stack=self.stack) for name in missing], ignore_conflicts=True)
+            self.tag_ids.update(Tag.objects.filter(stack=self.stack, name__in=missing).values_list('name', 'pk'))
+        return self.tag_ids
+
+    def import_answers(self, rows, owners):
+        parents = self.lookup(['question'], [int(row['ParentId']) for row in rows if row.get('ParentId')])
+        answers = []
+        sources = []
+        for row in rows:
+            parent = parents.get(int(row.get('ParentId') or 0))
+            if parent is None:
+                continue  # The question was deleted from the dump
+            answers.append(Answer(
+                description=post_text(row.get('Body')),
+                question_id=parent.target_id,
+                answered_by_id=self.owner_id(row, owners) or self.ghost.pk,
+                is_accepted=parent.accepted_source_id == int(row['Id']),
+                created_at=parse_date(row['CreationDate']),
+            ))
+            sources.append(int(row['Id']))
+        for answer in answers:
+            render_description(answer)
+        with explicit_timestamps(Answer._meta.get_field('created_at')):
+            Answer.objects.bulk_create(answers)
+        self.remember('answer', [(source_id, answer.pk) for source_id, answer in zip(sources, answers)])
+
+    def import_votes(self):
+        for batch in self.batches('Votes.xml'):
+            with self.atomic_batch(batch):
+                rows = [row for row in batch if row.get('VoteTypeId') in VOTE_TYPES]
+                posts = self.lookup(['question', 'answer'], [int(row['PostId']) for row in rows])
+
+                # Number the votes of every post, continuing after the votes already imported
+                ordinals = {}
+                for kind in ('question', 'answer'):
+                    ids = [post.target_id for post in posts.values() if post.kind == kind]
+                    counts = Vote.objects.filter(**{f'{kind}_id__in': ids}).values(kind).order_by().annotate(total=Count('pk'))
+                    ordinals.update({(kind, count[kind]): count['total'] for count in counts})
+
+                votes = []
+                for row in rows:
+                    post = posts.get(int(row['PostId']))
+                    if post is None:
+                        continue
+                    key = (post.kind, post.target_id)
+                    ordinal = ordinals.get(key, 0)
+                    ordinals[key] = ordinal + 1
+                    votes.append(Vote(
+                        user_id=self.voter(ordinal),
+                        vote_type=VOTE_TYPES[row['VoteTypeId']],
+                        created_at=parse_date(row['CreationDate']),
+                        **{f'{post.kind}_id': post.target_id},
+                    ))
+                with explicit_timestamps(Vote._meta.get_field('created_at')):
+                    Vote.objects.bulk_create(votes)
+
+    def voter(self, ordinal):
+        """Primary key of the ordinal-th placeholder voter of the stack, creating more as needed"""
+        prefix = f'voter_{self.stack.pk}_'
+        if self.voters is None:
+            self.voters = list(User.objects.filter(username__startswith=prefix).order_by('pk').values_list('pk', flat=True))
+        if ordinal >= len(self.voters):
+            new = [
+                User(username=f'{prefix}{n}', first_name='Anonymous voter', password=make_password(None))
+                for n in range(len(self.voters), max(ordinal + 1, len(self.voters) * 2))
+            ]
+            self.voters.extend(user.pk for user in User.objects.bulk_create(new))
+        return self.voters[ordinal]
+
+    def import_finalize(self):
+        stack_id = self.stack.pk
+        self.log("Recomputing scores")
+        for model, target in ((Question, 'question'), (Answer, 'answer')):
+            reconcile(model, target, chunk_size=self.batch_size, stack_id=stack_id)
+
+        self.log("Recomputing answer counts, accepted answers and activity")
+        answers = Answer.objects.filter(question=OuterRef('pk')).order_by().values('question')
+        Question.objects.filter(stack_id=stack_id).update(
+            answer_count=Coalesce(Subquery(answers.annotate(total=Count('pk')).values('total')), Value(0)),
+            accepted_answer=Subquery(answers.filter(is_accepted=True).values('pk')[:1]),
+            last_activity_at=Greatest(
+                'created_at',
+                Coalesce(Subquery(answers.annotate(latest=Max('created_at')).values('latest')), 'created_at'),
+            ),
+        )
+
+        record_activity(stack_id)
+        recount_tags(stack_id)
+        recount_stacks(stack_id)
+
+        self.log("Replaying reputation")
+        replay_votes(stack_id, chunk_size=self.batch_size)
+
+        self.log("Ranking hot questions")
+        rebuild_hot_scores(stack_id, chunk_size=self.batch_size)
+
+        if self.build_search_index:
+            self.log("Building the search index")
+            question_ids = Question.objects.filter(stack_id=stack_id).order_by('pk').values_list('pk', flat=True)
+            for batch in batched(question_ids.iterator(chunk_size=self.batch_size), 500):
+                index_questions(batch)
+
@@ -0,0 +1,222 @@
+"""
+Per-request SQL instrumentation.
+
+QueryInstrumentationMiddleware records every query a request runs on every
+database connection: how many, how long they took in total, and which ones
+were repeated. Queries are grouped by fingerprint (the SQL with its parameters
+and IN lists collapsed), so an N+1 pattern shows up as one fingerprint run N
+times. Results are exposed as response headers (Server-Timing and X-DB-*) to
+staff and in DEBUG, and aggregated per endpoint for QueryReportView.
+
+Views can declare a query_budget; exceeding it is logged, and raises
+QueryBudgetExceeded with QUERY_BUDGET_STRICT. The test runner (see
+testing.py) and QueryBudgetTestMixin turn it on, so the requests of the test
+suite are held to their budget; the mixin also checks a response against a
+tighter one.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.test import override_settings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+IN_LIST = re.compile(r'\bIN\s*\((?:\s*%s\s*,?)+\)', re.IGNORECASE)
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Normalize SQL so queries that only differ by parameters group together"""
+    sql = IN_LIST.sub('IN (...)', sql)
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Database execute wrapper collecting the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, threshold=2):
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+
+class EndpointStats:
+    """In-process aggregate of the recorded requests, per endpoint"""
+
+    def __init__(self, max_fingerprints=20):
+        self.max_fingerprints = max_fingerprints
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def add(self, endpoint, recorder):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'endpoint': endpoint,
+                'requests': 0,
+                'queries': 0,
+                'max_queries': 0,
+                'db_time': 0.0,
+                'max_db_time': 0.0,
+                'repeated': Counter(),
+            })
+            stats['requests'] += 1
+            stats['queries'] += recorder.count
+            stats['max_queries'] = max(stats['max_queries'], recorder.count)
+            stats['db_time'] += recorder.duration
+            stats['max_db_time'] = max(stats['max_db_time'], recorder.duration)
+            for sql, count in recorder.repeated():
+                stats['repeated'][sql] = max(stats['repeated'][sql], count)
+            if len(stats['repeated']) > self.max_fingerprints:
+                stats['repeated'] = Counter(dict(stats['repeated'].most_common(self.max_fingerprints)))
+
+    def report(self, limit=50):
+        """Endpoints ordered by average queries per request, worst first"""
+        with self.lock:
+            rows = [
+                dict(
+                    stats,
+                    avg_queries=stats['queries'] / stats['requests'],
+                    avg_db_time=stats['db_time'] / stats['requests'],
+                    repeated=stats['repeated'].most_common(5),
+                )
+                for stats in self.endpoints.values()
+            ]
+        rows.sort(key=lambda row: (row['avg_queries'], row['avg_db_time']), reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Should come first in MIDDLEWARE so session and auth queries are counted too.
+
+    Supports both WSGI and ASGI. Under ASGI the ORM runs in the request's
+    thread-sensitive worker thread, whose connections are the ones wrapped.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.repeat_threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        request.query_budget = None
+        with self.record(recorder):
+            response = self.get_response(request)
+        return self.finish(request, response, recorder)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        request.query_budget = None
+        stack = await sync_to_async(self.record, thread_sensitive=True)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close, thread_sensitive=True)()
+        # finish() may load request.user from the database
+        return await sync_to_async(self.finish, thread_sensitive=True)(request, response, recorder)
+
+    def record(self, recorder):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        return stack
+
+    def finish(self, request, response, recorder):
+        endpoint = self.endpoint(request)
+        endpoint_stats.add(endpoint, recorder)
+        self.check(endpoint, request, recorder)
+
+        response.query_count = recorder.count
+        response.query_budget = request.query_budget
+        response.repeated_queries = recorder.repeated()
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            duration_ms = recorder.duration * 1000
+            response['Server-Timing'] = f'db;dur={duration_ms:.1f};desc="{recorder.count} queries"'
+            response['X-DB-Query-Count'] = str(recorder.count)
+            response['X-DB-Time-Ms'] = f'{duration_ms:.1f}'
+            response['X-DB-Repeated-Queries'] = str(len(recorder.repeated()))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        budget = getattr(view_class, 'query_budget', None)
+        if budget is not None and request.query_budget is not None:
+            # The view runs again, e.g. on the primary after a 404 on a replica (see routing.py)
+            budget += request.query_budget
+        request.query_budget = budget
+
+    def endpoint(self, request):
+        match = request.resolver_match
+        if match is None:
+            return f'{request.method} <unresolved>'
+        return f'{request.method} {match.view_name}'
+
+    def check(self, endpoint, request, recorder):
+        if request.query_budget is not None and recorder.count > request.query_budget:
+            message = "%s ran %d queries, over its budget of %d" % (endpoint, recorder.count, request.query_budget)
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded("%s. Repeated: %s" % (message, recorder.repeated()))
+            logger.warning(message)
+        for sql, count in recorder.repeated(self.repeat_threshold):
+            logger.warning("%s repeated a query %d times (possible N+1): %s", endpoint, count, sql)
+
+
+class QueryBudgetTestMixin:
+    """TestCase mixin: fail when a response ran more queries than its view declared"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(override_settings(QUERY_BUDGET_STRICT=True))
+
+    def assertWithinQueryBudget(self, response, budget=None):
+        if budget is None:
+            budget = getattr(response, 'query_budget', None)
+        self.assertIsNotNone(budget, "The view declares no query_budget")
+        self.assertLessEqual(
+            response.query_count,
+            budget,
+            "%d queries over a budget of %d. Repeated: %s" % (response.query_count, budget, response.repeated_queries),
+        )
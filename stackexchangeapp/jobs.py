@@ -0,0 +1,284 @@
+"""
+Background jobs, queued in the database.
+
+Side effects of a write that its response doesn't need (search indexing...)
+are queued as Job rows by enqueue, in the transaction of the write: a write
+rolled back queues nothing and a committed one can't lose its jobs, with no
+broker to run. The runworker command runs them, on --concurrency threads.
+
+Workers claim due jobs with SELECT ... FOR UPDATE SKIP LOCKED where the
+database has it (PostgreSQL), so they never wait on each other; elsewhere
+(SQLite, which serializes writes anyway) with a conditional UPDATE from
+queued to running, which only one worker can win. A failing job is retried
+after a backoff doubling with every attempt, up to its max_attempts, then
+left failed with its traceback. A claim is a lease: a job running for longer
+than JOB_TIMEOUT_SECONDS, its worker presumably dead, is requeued by the
+housekeeping of any worker and retried, so jobs must be safe to run twice.
+Workers outlive database errors (a restart, SQLite's "database is locked"):
+they back off and try again, and retry recording the outcome of a job they
+ran rather than leave it to the timeout.
+
+A job with a dedupe_key is queued at most once until a worker starts it, so a
+burst of writes to a question reindexes it once. Jobs are functions
+registered with @task, called with the JSON kwargs they were queued with;
+workers know the tasks of the modules imported at startup, see apps.py.
+With JOBS_EAGER they run in-process once the write commits instead, for
+development without a worker.
+"""
+import logging
+import random
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Min
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Registered tasks by name, see task
+tasks = {}
+# Longest wait of a worker between two attempts through database errors
+DATABASE_RETRY_MAX_DELAY = 30
+
+
+def task(name, max_attempts=5):
+    """Register a function as the task name. Renaming a task strands its queued jobs."""
+    def register(func):
+        func.task_name = name
+        func.max_attempts = max_attempts
+        tasks[name] = func
+        return func
+    return register
+
+
+def enqueue(func, *, dedupe_key=None, delay=0, **kwargs):
+    """Queue a call of a task with kwargs, in the current transaction if any"""
+    if getattr(settings, 'JOBS_EAGER', False):
+        transaction.on_commit(lambda: func(**kwargs))
+        return
+    now = timezone.now()
+    job = Job(
+        name=func.task_name,
+        kwargs=kwargs,
+        dedupe_key=dedupe_key,
+        max_attempts=func.max_attempts,
+        created_at=now,
+        run_at=now + timedelta(seconds=delay),
+    )
+    # A no-op against the partial unique index when the same key is already queued
+    Job.objects.bulk_create([job], ignore_conflicts=dedupe_key is not None)
+
+
+def backoff(attempts):
+    """Seconds before retrying a job that failed its attempts-th attempt"""
+    delay = getattr(settings, 'JOB_RETRY_DELAY_SECONDS', 10) * 2 ** (attempts - 1)
+    delay = min(delay, getattr(settings, 'JOB_RETRY_MAX_DELAY_SECONDS', 3600))
+    # Jittered, so jobs failing together don't all retry together
+    return delay * random.uniform(0.5, 1)
+
+
+def claim(limit=1):
+    """Mark up to limit due jobs as running for this worker, and return them"""
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_at__lte=now).order_by('run_at')
+    start = {'status': 'running', 'started_at': now, 'finished_at': None, 'attempts': F('attempts') + 1}
+    # Claimed and read back together: a database error in between leaves the jobs queued
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            pks = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Job.objects.filter(pk__in=pks).update(**start)
+        else:
+            # Another worker may have started a candidate since: only claim the ones still queued
+            pks = [pk for pk in due.values_list('pk', flat=True)[:limit] if Job.objects.filter(pk=pk, status='queued').update(**start)]
+        return list(Job.objects.filter(pk__in=pks).order_by('run_at')) if pks else []
+
+
+def finish(job, error=None):
+    """Record the outcome of an attempt: done, queued again after a backoff, or failed for good"""
+    now = timezone.now()
+    changes = {'status': 'done', 'finished_at': now, 'last_error': error or ''}
+    if error is not None:
+        if job.attempts < job.max_attempts:
+            changes.update(status='queued', run_at=now + timedelta(seconds=backoff(job.attempts)), finished_at=None)
+        else:
+            changes['status'] = 'failed'
+    # Unless the job timed out and another worker claimed it meanwhile
+    attempt = Job.objects.filter(pk=job.pk, status='running', started_at=job.started_at)
+    try:
+        with transaction.atomic():
+            attempt.update(**changes)
+    except IntegrityError:
+        # Queued again meanwhile: that job does the work
+        attempt.update(status='done', finished_at=now, last_error=f'{error}\nSuperseded by a job queued with the same key')
+
+
+def run_task(job):
+    """Call the task of a claimed job. Returns the traceback of its error, None if it succeeded."""
+    try:
+        tasks[job.name](**job.kwargs)
+    except Exception as e:
+        logger.exception("Job %s failed (attempt %d of %d)", job, job.attempts, job.max_attempts)
+        return ''.join(traceback.format_exception(e))
+    return None
+
+
+def run_job(job):
+    finish(job, run_task(job))
+
+
+def requeue_stale():
+    """Retry the jobs running for longer than JOB_TIMEOUT_SECONDS. Returns their number."""
+    timeout = getattr(settings, 'JOB_TIMEOUT_SECONDS', 600)
+    stale = list(Job.objects.filter(status='running', started_at__lt=timezone.now() - timedelta(seconds=timeout)))
+    for job in stale:
+        logger.warning("Job %s timed out", job)
+        finish(job, f'Timed out after {timeout}s')
+    return len(stale)
+
+
+def prune(retention=None):
+    """Delete the jobs done for longer than JOB_RETENTION_SECONDS; failed ones are kept. Returns their number."""
+    retention = retention or getattr(settings, 'JOB_RETENTION_SECONDS', 86400)
+    deleted, _ = Job.objects.filter(status='done', finished_at__lt=timezone.now() - timedelta(seconds=retention)).delete()
+    return deleted
+
+
+def run_jobs(limit=None):
+    """Run due jobs in this thread until there are none left (or limit ran). Returns how many ran."""
+    ran = 0
+    while limit is None or ran < limit:
+        jobs = claim()
+        if not jobs:
+            break
+        for job in jobs:
+            run_job(job)
+        ran += len(jobs)
+    return ran
+
+
+class Worker:
+    """Runs jobs on concurrency threads until stopped, or until none are due with burst"""
+
+    def __init__(self, concurrency=1, poll_interval=1.0, burst=False):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.stopping = threading.Event()
+
+    def run(self):
+        housekeeping = getattr(settings, 'JOB_HOUSEKEEPING_SECONDS', 60)
+        # First of all, requeue the jobs of a worker that died
+        self.housekeep()
+        next_housekeeping = time.monotonic() + housekeeping
+        threads = [threading.Thread(target=self.loop, name=f'jobs-{n}') for n in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                if time.monotonic() >= next_housekeeping:
+                    self.housekeep()
+                    next_housekeeping = time.monotonic() + housekeeping
+                self.stopping.wait(self.poll_interval)
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+            connections.close_all()
+
+    def stop(self):
+        """Let the running jobs finish, and claim no more"""
+        self.stopping.set()
+
+    def housekeep(self):
+        """Requeue the timed out jobs and prune the old ones, or try again next time"""
+        try:
+            requeue_stale()
+            prune()
+        except DatabaseError:
+            logger.warning("Job housekeeping failed", exc_info=True)
+            connection.close_if_unusable_or_obsolete()
+
+    def loop(self):
+        failures = 0
+        try:
+            while not self.stopping.is_set():
+                try:
+                    jobs = claim()
+                except DatabaseError:
+                    failures += 1
+                    self.back_off(failures)
+                    continue
+                failures = 0
+                if not jobs:
+                    if self.burst:
+                        break
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                for job in jobs:
+                    self.finish(job, run_task(job))
+        finally:
+            connections.close_all()
+
+    def finish(self, job, error):
+        """Record the outcome of a job that ran, through database errors until it's recorded or the worker stops"""
+        failures = 0
+        while True:
+            try:
+                return finish(job, error)
+            except DatabaseError:
+                failures += 1
+                # Still running if it gives up: requeue_stale retries it once timed out
+                if self.back_off(failures):
+                    logger.error("Stopped before recording the outcome of job %s", job)
+                    return
+
+    def back_off(self, failures):
+        """Wait after the failures-th database error in a row, longer every time. Returns whether the worker is stopping."""
+        delay = min(self.poll_interval * 2 ** (failures - 1), DATABASE_RETRY_MAX_DELAY)
+        # Jittered, so threads failing on the same lock don't all retry together
+        delay *= random.uniform(0.5, 1)
+        logger.warning("Database error in the job worker, retrying in %.2fs", delay, exc_info=True)
+        # A connection the error broke is replaced by the next query
+        connection.close_if_unusable_or_obsolete()
+        return self.stopping.wait(delay)
+
+
+def duration(end, start):
+    return ExpressionWrapper(F(end) - F(start), output_field=DurationField())
+
+
+def queue_metrics(window=3600):
+    """
+    Queue depth per status, the age of the oldest due job, and the latency
+    (seconds waited for a worker once due, and run) of the jobs done in the
+    last window seconds per task.
+    """
+    now = timezone.now()
+    depth = dict(Job.objects.order_by().values_list('status').annotate(Count('pk')))
+    oldest = Job.objects.filter(status='queued', run_at__lte=now).aggregate(oldest=Min('run_at'))['oldest']
+    recent = (
+        Job.objects.filter(status='done', finished_at__gte=now - timedelta(seconds=window))
+        .values('name')
+        .annotate(
+            done=Count('pk'),
+            wait=Avg(duration('started_at', 'run_at')),
+            max_wait=Max(duration('started_at', 'run_at')),
+            run=Avg(duration('finished_at', 'started_at')),
+            max_run=Max(duration('finished_at', 'started_at')),
+        )
+        .order_by('name')
+    )
+    return {
+        'depth': {status: depth.get(status, 0) for status, _ in Job.STATUS_CHOICES},
+        'oldest_due_seconds': (now - oldest).total_seconds() if oldest else 0,
+        'tasks': {
+            row.pop('name'): {key: value.total_seconds() if isinstance(value, timedelta) else value for key, value in row.items()}
+            for row in recent
+        },
+    }
@@ -0,0 +1,121 @@
+"""
+Live updates of question pages, over Server-Sent Events.
+
+Writes publish events about a question (new scores, answers, accepts) to its
+channel once they commit, see publish_on_commit. Every open question page
+subscribes to its channel with an EventSource on QuestionEventsView, whose
+response is an async generator awaiting the subscription's queue: an idle
+subscriber costs a small asyncio.Queue, no thread and no database connection.
+That takes the ASGI server (stackexchange/asgi.py): under WSGI every stream
+would hold a worker thread, so there the pages don't subscribe and
+QuestionEventsView answers 404, see live_updates.
+
+The broker is pluggable with the LIVE_BROKER setting (a dotted path). The
+default InProcessBroker only reaches the pages streamed by the process that
+published, which is enough for a single ASGI worker, development and the
+tests; a broker over e.g. Redis pub/sub implements the same publish and
+subscribe for several.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import cache
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Events are snapshots (a new score...), so a reader this far behind only loses stale ones
+QUEUE_SIZE = 100
+
+
+def live_updates(request):
+    """Whether question pages get live updates: only when served by the ASGI server"""
+    return isinstance(request, ASGIRequest)
+
+
+def question_channel(question_id):
+    return f'question:{question_id}'
+
+
+class BaseBroker:
+    def publish(self, channel, event):
+        """Send an event (a JSON-serializable dict) to the subscribers of channel. Called from any thread."""
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        """An async context manager yielding an asyncio.Queue that receives the events of channel"""
+        raise NotImplementedError
+
+
+def deliver(queue, event):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+class InProcessBroker(BaseBroker):
+    """Subscribers of this process, each a queue on the event loop it was created on"""
+
+    def __init__(self):
+        self.channels = defaultdict(set)
+        # Published from the threads running sync views, subscribed from the event loop
+        self.lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(deliver, queue, event)
+            except RuntimeError:
+                pass  # Its loop is closed
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE))
+        with self.lock:
+            self.channels[channel].add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self.lock:
+                self.channels[channel].discard(subscriber)
+                if not self.channels[channel]:
+                    del self.channels[channel]
+
+    def subscriber_count(self, channel):
+        with self.lock:
+            return len(self.channels.get(channel, ()))
+
+
+@cache
+def get_broker():
+    return import_string(getattr(settings, 'LIVE_BROKER', 'stackexchangeapp.live.InProcessBroker'))()
+
+
+def publish_on_commit(question_id, event):
+    """Publish an event to the pages of a question once the current transaction commits"""
+    transaction.on_commit(lambda: get_broker().publish(question_channel(question_id), event))
+
+
+def format_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def event_stream(channel):
+    """The SSE body of a subscription to channel, with a comment every LIVE_HEARTBEAT_SECONDS to keep it open"""
+    heartbeat = getattr(settings, 'LIVE_HEARTBEAT_SECONDS', 15)
+    async with get_broker().subscribe(channel) as queue:
+        # Reconnect after 5s when the connection drops
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield format_event(event)
@@ -0,0 +1,87 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection
+from django.test import Client, override_settings
+
+from stackexchangeapp.benchmark import run_scenario, run_concurrent, compare, targets, core_scenarios
+
+
+class Command(BaseCommand):
+    help = "Benchmark the core views in-process and save p50/p95/p99 latency, queries and peak memory as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per scenario")
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--stack', type=int, help="Stack to benchmark, defaults to the one with the most members")
+        parser.add_argument('--scenario', action='append', help="Only run these scenarios (repeatable)")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--baseline', help="Compare with a previous JSON result and flag regressions")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown against the baseline (0.2 = 20%%)")
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--concurrency', type=int, default=0,
+                            help="Also compare WSGI and ASGI throughput on the read scenarios with this many requests in flight")
+
+    def handle(self, *args, **options):
+        stack, question, answer, user = targets(options['stack'])
+        scenarios = core_scenarios(stack, question, answer)
+        if options['scenario']:
+            scenarios = [s for s in scenarios if s.name in options['scenario']]
+
+        client = Client()
+        client.force_login(user)
+        results = {
+            'meta': {
+                'started_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'stack_id': stack.id,
+                'stack_questions': stack.questions.count(),
+                'question_answers': question.answer_count,
+            },
+            'scenarios': {},
+        }
+        # Benchmark requests are not real views of the question
+        with override_settings(ALLOWED_HOSTS=['testserver'], RECORD_VIEWS=False):
+            for scenario in scenarios:
+                result = run_scenario(client, scenario, options['requests'], options['warmup'])
+                results['scenarios'][scenario.name] = result
+                self.stdout.write(
+                    f"{scenario.name:<20} p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  "
+                    f"p99 {result['p99_ms']:>8.2f}ms  {result['queries_per_request']:>6} queries  "
+                    f"{result['peak_memory_kb']:>9.1f}KB peak"
+                )
+            if options['concurrency']:
+                results['concurrent'] = self.run_concurrent(scenarios, client, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = compare(results, json.load(f), options['threshold'])
+            for regression in regressions:
+                self.stdout.write(self.style.WARNING(f"REGRESSION {regression}"))
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}")
+
+    def run_concurrent(self, scenarios, client, options):
+        cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        results = {}
+        self.stdout.write(f"\nWSGI vs ASGI, {options['concurrency']} concurrent requests")
+        for scenario in scenarios:
+            if scenario.method != 'GET':
+                continue
+            results[scenario.name] = run_concurrent(scenario, cookie, options['concurrency'], options['requests'], options['warmup'])
+            for handler, result in results[scenario.name].items():
+                self.stdout.write(
+                    f"{scenario.name:<20} {handler}  {result['throughput_rps']:>8.1f} req/s  "
+                    f"p50 {result['p50_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms"
+                )
+        return results
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from stackexchangeapp.benchmark import targets
+from stackexchangeapp.queryplans import check_plans, plan_scenarios
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the queries of every view and fail on full table scans and sorts that an index should avoid"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stack', type=int, help="Stack to check, defaults to the one with the most members")
+        parser.add_argument('--scenario', action='append', help="Only check these scenarios (repeatable)")
+        parser.add_argument('--min-rows', type=int, default=1000, help="Ignore scans and sorts of tables smaller than this")
+        parser.add_argument('--strict', action='store_true',
+                            help="On PostgreSQL, avoid scans and sorts whenever an index allows it, for small databases")
+        parser.add_argument('--verbose', action='store_true', help="Print the plans of the issues")
+
+    def handle(self, *args, **options):
+        stack, question, answer, user = targets(options['stack'])
+        scenarios = plan_scenarios(stack, question, answer)
+        if options['scenario']:
+            scenarios = [s for s in scenarios if s.name in options['scenario']]
+
+        client = Client()
+        client.force_login(user)
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            results = check_plans(client, scenarios, options['min_rows'], options['strict'])
+
+        failures = 0
+        for name, issues in results.items():
+            status = self.style.SUCCESS("ok") if not issues else self.style.ERROR(f"{len(issues)} issue(s)")
+            self.stdout.write(f"{name:<20} {status}")
+            for issue in issues:
+                failures += 1
+                self.stdout.write(f"  {issue.kind} of {issue.table}: {issue.sql}")
+                if options['verbose']:
+                    self.stdout.write('    ' + issue.plan.replace('\n', '\n    '))
+        if failures:
+            raise CommandError(f"{failures} query plan issue(s) on {connection.vendor}")
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stackexchangeapp.models import Stack
+from stackexchangeapp.ranking import decay_hot_scores, rebuild_hot_scores
+
+
+class Command(BaseCommand):
+    help = "Decay the hot scores of the questions to now; run it periodically, e.g. hourly"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stack', type=int, help="Only decay this stack id")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help="Recompute the scores from the answers and votes instead (done anyway for stacks never decayed)",
+        )
+
+    def handle(self, *args, **options):
+        stacks = Stack.objects.order_by('pk').values_list('pk', flat=True)
+        if options['stack'] is not None:
+            stacks = stacks.filter(pk=options['stack'])
+
+        for stack_id in stacks:
+            start = time.perf_counter()
+            updated = None if options['rebuild'] else decay_hot_scores(stack_id)
+            if updated is None:
+                rebuild_hot_scores(stack_id, chunk_size=options['chunk_size'])
+                self.stdout.write(f"Stack {stack_id}: rebuilt in {time.perf_counter() - start:.2f}s")
+            else:
+                self.stdout.write(f"Stack {stack_id}: {updated} question(s) decayed in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,53 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stackexchangeapp.export import FORMATS, TABLES, encode, export_stack
+from stackexchangeapp.models import Stack
+
+
+class Command(BaseCommand):
+    help = "Stream the questions, answers, votes, tags and memberships of a stack to JSONL or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('stack', type=int)
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument('--table', choices=list(TABLES), help="Only export this table")
+        parser.add_argument(
+            '--output',
+            help="File to write, or with --format csv and no --table, a directory to write one file per table to. "
+                 "Defaults to standard output.",
+        )
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not Stack.objects.filter(pk=options['stack']).exists():
+            raise CommandError(f"Stack {options['stack']} does not exist")
+        fmt = options['format']
+        output = options['output']
+        if fmt == 'csv' and not options['table']:
+            if not output:
+                raise CommandError("CSV exports one file per table: pass --table or an --output directory")
+            os.makedirs(output, exist_ok=True)
+            for table in TABLES:
+                path = os.path.join(output, f"{table}.csv" + ('.gz' if options['gzip'] else ''))
+                self.write(path, export_stack(options['stack'], fmt, table, options['chunk_size']), options['gzip'])
+            return
+
+        chunks = export_stack(options['stack'], fmt, options['table'], options['chunk_size'])
+        if output:
+            self.write(output, chunks, options['gzip'])
+        elif options['gzip']:
+            raise CommandError("Pass --output to write a gzipped export")
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+
+    def write(self, path, chunks, compress):
+        size = 0
+        with open(path, 'wb') as f:
+            for data in encode(chunks, compress):
+                f.write(data)
+                size += len(data)
+        self.stderr.write(f"{path}: {size} bytes")
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stackexchangeapp.viewcounts import flush_views
+
+
+class Command(BaseCommand):
+    help = "Add the buffered question views to the view counts; run it periodically, e.g. every minute"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Pending views applied per transaction")
+        parser.add_argument('--every', type=float, help="Keep flushing every this many seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            applied = flush_views(options['chunk_size'])
+            self.stdout.write(f"Applied {applied} view(s)")
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,57 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stackexchangeapp.importer import DumpImporter
+from stackexchangeapp.models import User, Stack, ImportRun
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a Stack Exchange data dump directory (Tags.xml, Users.xml, Posts.xml, Votes.xml) into a stack. "
+        "An interrupted import of the same directory resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dump_dir')
+        parser.add_argument('--stack', type=int, help="Import into this existing stack id")
+        parser.add_argument('--stack-title', help="Title of the stack to create (default: the directory name)")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--restart', action='store_true', help="Start a new import instead of resuming")
+        parser.add_argument('--no-search-index', action='store_true')
+
+    def handle(self, *args, **options):
+        source = os.path.abspath(options['dump_dir'])
+        if not os.path.isdir(source):
+            raise CommandError(f"{source} is not a directory")
+
+        run = None
+        if not options['restart']:
+            run = ImportRun.objects.filter(source=source).select_related('stack').order_by('pk').last()
+            if run is not None and run.phase == 'done':
+                raise CommandError(f"{source} was already imported into {run.stack}, pass --restart to import it again")
+        if run is None:
+            run = ImportRun.objects.create(source=source, stack=self.get_stack(source, options))
+        self.stdout.write(f"Importing {source} into {run.stack}")
+
+        importer = DumpImporter(
+            run,
+            source,
+            batch_size=options['batch_size'],
+            build_search_index=not options['no_search_index'],
+            stdout=self.stdout,
+        )
+        importer.run_all()
+        self.stdout.write(self.style.SUCCESS(f"Imported {source} into {run.stack}"))
+
+    def get_stack(self, source, options):
+        if options['stack'] is not None:
+            try:
+                return Stack.objects.get(pk=options['stack'])
+            except Stack.DoesNotExist:
+                raise CommandError(f"No stack with id {options['stack']}")
+        creator = User.objects.filter(is_superuser=True).order_by('pk').first()
+        if creator is None:
+            raise CommandError("Create a superuser first, or pass --stack")
+        title = options['stack_title'] or os.path.basename(source)
+        return Stack.objects.create(title=title[:30], created_by=creator)
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stackexchangeapp.models import Stack
+from stackexchangeapp.reputation import rebuild_reputation, replay_votes
+
+
+class Command(BaseCommand):
+    help = "Recompute reputation totals and daily rollups from the reputation ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stack', type=int, help="Only rebuild this stack id")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--check', action='store_true', help="Report drifted totals without fixing them")
+        parser.add_argument(
+            '--from-votes', action='store_true',
+            help="First regenerate the ledger from the votes and accepted answers (for data that predates it)",
+        )
+
+    def handle(self, *args, **options):
+        stacks = Stack.objects.order_by('pk').values_list('pk', flat=True)
+        if options['stack'] is not None:
+            stacks = stacks.filter(pk=options['stack'])
+
+        for stack_id in stacks:
+            start = time.perf_counter()
+            if options['from_votes'] and not options['check']:
+                drifted = replay_votes(stack_id, chunk_size=options['chunk_size'])
+            else:
+                drifted = rebuild_reputation(stack_id, chunk_size=options['chunk_size'], check=options['check'])
+            verb = "drifted" if options['check'] else "fixed"
+            self.stdout.write(f"Stack {stack_id}: {drifted} membership(s) {verb} in {time.perf_counter() - start:.2f}s")
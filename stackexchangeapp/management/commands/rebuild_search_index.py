@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from stackexchangeapp.models import Question
+from stackexchangeapp.search import index_questions
+
+
+class Command(BaseCommand):
+    help = "Build the search documents of every question, e.g. after upgrading an existing database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stack', type=int, help="Only index the questions of this stack id")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        questions = Question.objects.order_by('pk')
+        if options['stack'] is not None:
+            questions = questions.filter(stack_id=options['stack'])
+
+        indexed = 0
+        last_pk = 0
+        while True:
+            chunk = list(questions.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['chunk_size']])
+            if not chunk:
+                break
+            last_pk = chunk[-1]
+            indexed += index_questions(chunk)
+        self.stdout.write(f"Indexed {indexed} question(s)")
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from stackexchangeapp.models import Question, Answer
+from stackexchangeapp.ranking import reconcile
+from stackexchangeapp.tags import recount_tags
+from stackexchangeapp.directory import recount_stacks
+
+
+class Command(BaseCommand):
+    help = "Backfill and reconcile the stored vote counters on questions and answers, the answer counts of questions, the question counts of tags and the counters of stacks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stack', type=int, help="Only reconcile this stack and its questions, answers and tags")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--check', action='store_true', help="Report drifted rows without fixing them")
+
+    def handle(self, *args, **options):
+        for model, target in ((Question, 'question'), (Answer, 'answer')):
+            drifted = reconcile(
+                model,
+                target,
+                chunk_size=options['chunk_size'],
+                stack_id=options['stack'],
+                check=options['check'],
+            )
+            verb = "drifted" if options['check'] else "fixed"
+            self.stdout.write(f"{model.__name__}: {drifted} row(s) {verb}")
+        drifted = recount_tags(options['stack'], check=options['check'])
+        self.stdout.write(f"Tag: {drifted} row(s) {verb}")
+        drifted = recount_stacks(options['stack'], check=options['check'])
+        self.stdout.write(f"Stack: {drifted} row(s) {verb}")
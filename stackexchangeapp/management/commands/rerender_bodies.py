@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from stackexchangeapp.models import Question, Answer
+from stackexchangeapp.rendering import RENDERER_VERSION, rerender
+
+
+class Command(BaseCommand):
+    help = "Render the Markdown of the questions and answers not rendered by the current renderer, e.g. after upgrading it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--force', action='store_true', help="Render every row again, whatever its renderer version")
+        parser.add_argument('--check', action='store_true', help="Report the rows to render without rendering them")
+
+    def handle(self, *args, **options):
+        verb = "to render" if options['check'] else "rendered"
+        for model in (Question, Answer):
+            count = rerender(model, chunk_size=options['chunk_size'], force=options['force'], check=options['check'])
+            self.stdout.write(f"{model.__name__}: {count} row(s) {verb} (renderer version {RENDERER_VERSION})")
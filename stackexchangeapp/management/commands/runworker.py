@@ -0,0 +1,34 @@
+import json
+import signal
+
+from django.core.management.base import BaseCommand
+
+from stackexchangeapp.jobs import Worker, queue_metrics
+
+
+class Command(BaseCommand):
+    help = "Run the background jobs queued in the database, see stackexchangeapp/jobs.py"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Jobs run at once, one thread each")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds an idle worker waits before looking for due jobs again")
+        parser.add_argument('--burst', action='store_true', help="Exit once no job is due, instead of waiting for more")
+        parser.add_argument('--stats', action='store_true',
+                            help="Print the queue depth and the latency of the last hour's jobs, and exit")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(queue_metrics(), indent=2))
+            return
+        worker = Worker(options['concurrency'], options['poll_interval'], options['burst'])
+        # Jobs running when stopped are finished first
+        previous = signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+        self.stdout.write(f"Running jobs on {options['concurrency']} thread(s)")
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        self.stdout.write("Stopped")
@@ -0,0 +1,202 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from stackexchangeapp.models import User, Stack, StackMembership, Tag, Question, QuestionTag, Answer, Vote
+from stackexchangeapp.ranking import rebuild_hot_scores
+from stackexchangeapp.rendering import render_description
+from stackexchangeapp.reputation import replay_votes
+from stackexchangeapp.search import index_questions
+from stackexchangeapp.tags import recount_tags
+from stackexchangeapp.directory import recount_stacks
+from stackexchangeapp.utils import explicit_timestamps
+
+WORDS = (
+    "python django query index cache vote answer question stack tag model view template "
+    "database postgres sqlite async thread memory list dict string error exception test "
+    "performance server request response form field migration admin user session".split()
+)
+
+
+class SkewedChoice:
+    """Zipf-like picker: a few items (users, questions) get most of the activity"""
+
+    def __init__(self, items, rng, exponent=1.1):
+        self.items = items
+        self.rng = rng
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** exponent for rank in range(len(items))))
+
+    def pick(self):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights)[0]
+
+    def sample(self, k):
+        # Distinct items, preferring the popular ones
+        k = min(k, len(self.items))
+        picked = set()
+        while len(picked) < k:
+            picked.add(self.pick())
+        return list(picked)
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic dataset (stacks, users, questions, answers, votes) with bulk_create"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stacks', type=int, default=3)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--memberships', type=int, default=2, help="Average number of stacks joined per user")
+        parser.add_argument('--questions', type=int, default=2000, help="Questions per stack")
+        parser.add_argument('--tags', type=int, default=50, help="Tags per stack")
+        parser.add_argument('--answers', type=float, default=2.0, help="Average answers per question")
+        parser.add_argument('--votes', type=float, default=5.0, help="Average votes per question or answer")
+        parser.add_argument('--days', type=int, default=365, help="Spread creation dates over this many days")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-search-index', action='store_true')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.now = timezone.now()
+        batch_size = options['batch_size']
+
+        users = self.create_users()
+        self.stdout.write(f"{len(users)} users")
+        offset = Stack.objects.count()
+        popularity = [1 / (n + 1) for n in range(options['stacks'])]
+        for n in range(options['stacks']):
+            with transaction.atomic():
+                stack = Stack.objects.create(title=f"Stack {offset + n + 1}", created_by=users[0])
+                # Popular stacks attract more members
+                share = options['memberships'] * popularity[n] / sum(popularity)
+                members = self.create_memberships(stack, users, share)
+                counts = self.create_posts(stack, members, batch_size)
+            self.stdout.write(f"{stack}: {len(members)} members, " + ', '.join(f'{v} {k}' for k, v in counts.items()))
+            if not options['no_search_index']:
+                self.index(stack)
+
+    def create_users(self):
+        password = make_password('password')
+        offset = User.objects.count()
+        users = [
+            User(username=f'seed{offset + i}', email=f'seed{offset + i}@example.com', password=password)
+            for i in range(self.options['users'])
+        ]
+        return User.objects.bulk_create(users, batch_size=self.options['batch_size'])
+
+    def create_memberships(self, stack, users, share):
+        members = [user for user in users if self.rng.random() < share] or users[:2]
+        StackMembership.objects.bulk_create(
+            [StackMembership(user=user, stack=stack) for user in members],
+            batch_size=self.options['batch_size'],
+            ignore_conflicts=True,
+        )
+        return members
+
+    def random_time(self, after=None):
+        start = after or self.now - timedelta(days=self.options['days'])
+        span = (self.now - start).total_seconds()
+        return start + timedelta(seconds=span * self.rng.random() ** 2)
+
+    def create_posts(self, stack, members, batch_size):
+        rng = self.rng
+        authors = SkewedChoice(members, rng)
+        tags = Tag.objects.bulk_create([Tag(name=f'{rng.choice(WORDS)}-{i}', stack=stack) for i in range(self.options['tags'])])
+        tag_picker = SkewedChoice(tags, rng)
+        counts = {'questions': 0, 'answers': 0, 'votes': 0}
+
+        remaining = self.options['questions']
+        while remaining > 0:
+            size = min(batch_size, remaining)
+            remaining -= size
+            questions = [
+                Question(
+                    title=sentence(rng, 4)[:30],
+                    description=sentence(rng, rng.randint(20, 120)),
+                    asked_by=authors.pick(),
+                    stack=stack,
+                    created_at=self.random_time(),
+                )
+                for _ in range(size)
+            ]
+            for question in questions:
+                question.last_activity_at = question.created_at
+
+            answers = []
+            for question in questions:
+                for _ in range(int(rng.expovariate(1 / self.options['answers'])) if self.options['answers'] else 0):
+                    answer = Answer(
+                        description=sentence(rng, rng.randint(10, 80)),
+                        question=question,
+                        answered_by=authors.pick(),
+                        created_at=self.random_time(after=question.created_at),
+                    )
+                    answers.append(answer)
+                    question.answer_count += 1
+                    question.last_activity_at = max(question.last_activity_at, answer.created_at)
+
+            for post in questions + answers:
+                render_description(post)
+            # Counters are filled in before the rows are written, so no second pass is needed
+            votes = self.votes_for(questions, 'question', members) + self.votes_for(answers, 'answer', members)
+            timestamps = [model._meta.get_field('created_at') for model in (Question, Answer, Vote)]
+            with explicit_timestamps(*timestamps):
+                Question.objects.bulk_create(questions, batch_size=batch_size)
+                Answer.objects.bulk_create(answers, batch_size=batch_size)
+                Vote.objects.bulk_create(votes, batch_size=batch_size)
+            QuestionTag.objects.bulk_create(
+                [
+                    QuestionTag(question_id=q.pk, tag_id=tag.pk, created_at=q.created_at)
+                    for q in questions for tag in tag_picker.sample(rng.randint(1, 4))
+                ],
+                batch_size=batch_size,
+            )
+            counts['questions'] += len(questions)
+            counts['answers'] += len(answers)
+            counts['votes'] += len(votes)
+
+        # Reputation events for the votes, and the totals from them
+        replay_votes(stack.pk, chunk_size=batch_size)
+        rebuild_hot_scores(stack.pk, chunk_size=batch_size)
+        recount_tags(stack.pk)
+        recount_stacks(stack.pk)
+        return counts
+
+    def votes_for(self, posts, target, members):
+        """Votes for posts, skewed so few posts get most of them. Updates the counters in place."""
+        if not posts or not self.options['votes']:
+            return []
+        rng = self.rng
+        voters = SkewedChoice(members, rng)
+        popular = SkewedChoice(posts, rng)
+        votes = []
+        voted = set()
+        for _ in range(int(len(posts) * self.options['votes'])):
+            post = popular.pick()
+            owner_id = post.asked_by_id if target == 'question' else post.answered_by_id
+            voter = voters.pick()
+            if voter.pk == owner_id or (id(post), voter.pk) in voted:
+                continue
+            voted.add((id(post), voter.pk))
+            vote_type = 'up' if rng.random() < 0.8 else 'down'
+            votes.append(Vote(user=voter, vote_type=vote_type, created_at=self.random_time(after=post.created_at), **{target: post}))
+            if vote_type == 'up':
+                post.upvotes += 1
+            else:
+                post.downvotes += 1
+            post.score = post.upvotes - post.downvotes
+        return votes
+
+    def index(self, stack):
+        ids = list(Question.objects.filter(stack=stack).values_list('pk', flat=True))
+        for start in range(0, len(ids), 500):
+            index_questions(ids[start:start + 500])
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from stackexchangeapp.routing import PRIMARY, copy_sqlite_database, replica_aliases
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database over the SQLite replicas, to try replica routing locally (SQLITE_REPLICA=True)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float,
+                            help="Keep copying every this many seconds, like a replica lagging that much")
+
+    def handle(self, *args, **options):
+        aliases = replica_aliases()
+        if not aliases:
+            raise CommandError("No REPLICA_DATABASES configured")
+        for alias in [PRIMARY, *aliases]:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f"{alias} isn't a SQLite database; PostgreSQL replicas replicate on their own")
+
+        while True:
+            for alias in aliases:
+                copy_sqlite_database(alias)
+                self.stdout.write(f"Copied {PRIMARY} to {alias}")
+            if not options['every']:
+                break
+            time.sleep(options['every'])
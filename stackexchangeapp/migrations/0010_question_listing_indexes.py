@@ -0,0 +1,57 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:16
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_listing_columns(apps, schema_editor):
+    Question = apps.get_model('stackexchangeapp', 'Question')
+    Answer = apps.get_model('stackexchangeapp', 'Answer')
+    answers = Answer.objects.filter(question=OuterRef('pk')).order_by().values('question')
+    Question.objects.update(
+        answer_count=Coalesce(Subquery(answers.annotate(total=Count('pk')).values('total')), Value(0)),
+        last_activity_at=Greatest(
+            'created_at',
+            Coalesce('edited_at', 'created_at'),
+            Coalesce(Subquery(answers.annotate(latest=Max('created_at')).values('latest')), 'created_at'),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0009_question_answer_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='answer_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_listing_columns, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['stack', '-created_at', '-id'], name='question_stack_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['stack', '-score', '-id'], name='question_stack_votes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['stack', '-last_activity_at', '-id'], name='question_stack_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(('answer_count', 0)), fields=['stack', '-created_at', '-id'], name='question_stack_unanswered_idx'),
+        ),
+    ]
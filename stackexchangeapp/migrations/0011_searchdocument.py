@@ -0,0 +1,88 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+POSTGRES_INDEX = [
+    """
+    ALTER TABLE stackexchangeapp_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A') ||
+        setweight(to_tsvector('english', tags), 'B') ||
+        setweight(to_tsvector('english', body), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX searchdocument_vector_idx ON stackexchangeapp_searchdocument USING GIN (search_vector)",
+]
+
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE stackexchangeapp_searchdocument_fts USING fts5(
+        title, tags, body,
+        content='stackexchangeapp_searchdocument', content_rowid='question_id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER searchdocument_fts_insert AFTER INSERT ON stackexchangeapp_searchdocument BEGIN
+        INSERT INTO stackexchangeapp_searchdocument_fts(rowid, title, tags, body)
+        VALUES (new.question_id, new.title, new.tags, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER searchdocument_fts_delete AFTER DELETE ON stackexchangeapp_searchdocument BEGIN
+        INSERT INTO stackexchangeapp_searchdocument_fts(stackexchangeapp_searchdocument_fts, rowid, title, tags, body)
+        VALUES ('delete', old.question_id, old.title, old.tags, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER searchdocument_fts_update AFTER UPDATE ON stackexchangeapp_searchdocument BEGIN
+        INSERT INTO stackexchangeapp_searchdocument_fts(stackexchangeapp_searchdocument_fts, rowid, title, tags, body)
+        VALUES ('delete', old.question_id, old.title, old.tags, old.body);
+        INSERT INTO stackexchangeapp_searchdocument_fts(rowid, title, tags, body)
+        VALUES (new.question_id, new.title, new.tags, new.body);
+    END
+    """,
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS searchdocument_fts_insert",
+    "DROP TRIGGER IF EXISTS searchdocument_fts_delete",
+    "DROP TRIGGER IF EXISTS searchdocument_fts_update",
+    "DROP TABLE IF EXISTS stackexchangeapp_searchdocument_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {'postgresql': POSTGRES_INDEX, 'sqlite': SQLITE_INDEX}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    # The PostgreSQL column and index go away with the table
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0010_question_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='stackexchangeapp.question')),
+                ('title', models.TextField()),
+                ('tags', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('stack', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.stack')),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0011_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='question',
+            name='title',
+            field=models.CharField(max_length=150),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=35),
+        ),
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500)),
+                ('phase', models.CharField(choices=[('tags', 'Tags'), ('users', 'Users'), ('posts', 'Posts'), ('votes', 'Votes'), ('finalize', 'Finalize'), ('done', 'Done')], default='tags', max_length=10)),
+                ('position', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('stack', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.stack')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImportedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('source_id', models.BigIntegerField()),
+                ('target_id', models.BigIntegerField()),
+                ('accepted_source_id', models.BigIntegerField(blank=True, null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.importrun')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('run', 'kind', 'source_id'), name='unique_imported_row')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:37
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_stack_activity(apps, schema_editor):
+    Stack = apps.get_model('stackexchangeapp', 'Stack')
+    Question = apps.get_model('stackexchangeapp', 'Question')
+    latest = Question.objects.filter(stack=OuterRef('pk')).order_by().values('stack').annotate(latest=Max('last_activity_at'))
+    Stack.objects.update(last_activity_at=Coalesce(Subquery(latest.values('latest')), 'created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0012_stackexchange_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stack',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_stack_activity, migrations.RunPython.noop),
+    ]
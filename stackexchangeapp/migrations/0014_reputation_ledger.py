@@ -0,0 +1,45 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0013_stack_last_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReputationDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('delta', models.IntegerField(default=0)),
+                ('stack', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.stack')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('stack', 'user', 'day'), name='unique_reputation_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReputationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('reason', models.CharField(choices=[('upvote', 'Post upvoted'), ('downvote', 'Post downvoted'), ('downvote_cast', 'Downvoted an answer'), ('accepted', 'Answer accepted'), ('accept', 'Accepted an answer')], max_length=15)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('answer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='stackexchangeapp.answer')),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='stackexchangeapp.question')),
+                ('stack', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.stack')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stack', 'user', 'delta'], name='repevent_stack_user_idx')],
+            },
+        ),
+    ]
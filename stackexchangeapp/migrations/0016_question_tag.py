@@ -0,0 +1,69 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill(apps, schema_editor):
+    Question = apps.get_model('stackexchangeapp', 'Question')
+    QuestionTag = apps.get_model('stackexchangeapp', 'QuestionTag')
+    Tag = apps.get_model('stackexchangeapp', 'Tag')
+    created_at = Question.objects.filter(pk=OuterRef('question_id')).values('created_at')
+    QuestionTag.objects.update(created_at=Subquery(created_at))
+    counts = QuestionTag.objects.filter(tag=OuterRef('pk')).order_by().values('tag').annotate(total=Count('pk'))
+    Tag.objects.update(question_count=Coalesce(Subquery(counts.values('total')), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0015_hot_score'),
+    ]
+
+    operations = [
+        # Take over the table of the auto-created through model of Question.tags as is
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='QuestionTag',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.question')),
+                        ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.tag')),
+                    ],
+                    options={
+                        'db_table': 'stackexchangeapp_question_tags',
+                        'unique_together': {('question', 'tag')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='question',
+                    name='tags',
+                    field=models.ManyToManyField(through='stackexchangeapp.QuestionTag', to='stackexchangeapp.tag'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='questiontag',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='question_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='questiontag',
+            index=models.Index(fields=['tag', '-created_at', '-question'], name='questiontag_tag_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['stack', '-question_count'], name='tag_stack_count_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill(apps, schema_editor):
+    Stack = apps.get_model('stackexchangeapp', 'Stack')
+    StackMembership = apps.get_model('stackexchangeapp', 'StackMembership')
+    Question = apps.get_model('stackexchangeapp', 'Question')
+    Answer = apps.get_model('stackexchangeapp', 'Answer')
+
+    def total(queryset, field):
+        return Coalesce(Subquery(queryset.order_by().values(field).annotate(total=Count('pk')).values('total')), Value(0))
+
+    Stack.objects.update(
+        member_count=total(StackMembership.objects.filter(stack=OuterRef('pk')), 'stack'),
+        question_count=total(Question.objects.filter(stack=OuterRef('pk')), 'stack'),
+        answer_count=total(Answer.objects.filter(question__stack=OuterRef('pk')), 'question__stack'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0016_question_tag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stack',
+            name='answer_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='stack',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='stack',
+            name='question_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='stack',
+            index=models.Index(fields=['-last_activity_at', '-id'], name='stack_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stack',
+            index=models.Index(fields=['-member_count', '-id'], name='stack_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stack',
+            index=models.Index(fields=['-created_at', '-id'], name='stack_newest_idx'),
+        ),
+    ]
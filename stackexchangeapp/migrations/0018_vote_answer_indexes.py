@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0017_stack_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(condition=models.Q(('is_accepted', True)), fields=['question'], name='answer_accepted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['question', 'vote_type'], name='vote_question_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['answer', 'vote_type'], name='vote_answer_type_idx'),
+        ),
+        # Dropped once the composite indexes that start with them exist
+        migrations.AlterField(
+            model_name='vote',
+            name='answer',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.answer'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.question'),
+        ),
+    ]
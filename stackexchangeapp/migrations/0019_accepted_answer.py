@@ -0,0 +1,49 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery
+
+
+def backfill(apps, schema_editor):
+    Question = apps.get_model('stackexchangeapp', 'Question')
+    Answer = apps.get_model('stackexchangeapp', 'Answer')
+    accepted = Answer.objects.filter(question=OuterRef('pk'), is_accepted=True)
+    # Concurrent accepts could leave several accepted answers: the first one stays accepted
+    Question.objects.filter(Exists(accepted)).update(accepted_answer=Subquery(accepted.order_by('pk').values('pk')[:1]))
+    pointed = Question.objects.filter(accepted_answer__isnull=False).values('accepted_answer')
+    Answer.objects.filter(is_accepted=True).exclude(pk__in=pointed).update(is_accepted=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0018_vote_answer_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='accepted_answer',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='stackexchangeapp.answer'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='answer',
+            name='answer_accepted_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_accepted', True)), fields=('question',), name='unique_accepted_answer'),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', '-is_accepted', '-score', 'created_at', 'id'], name='answer_question_order_idx'),
+        ),
+        # Dropped once answer_question_order_idx, which starts with it, exists
+        migrations.AlterField(
+            model_name='answer',
+            name='question',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.question'),
+        ),
+    ]
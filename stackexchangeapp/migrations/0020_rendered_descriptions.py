@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0019_accepted_answer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='description_html',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='render_version',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='description_html',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='description_preview',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='render_version',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
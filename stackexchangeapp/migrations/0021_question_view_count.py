@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0020_rendered_descriptions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='view_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['stack', '-view_count', '-id'], name='question_stack_views_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0022_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('answer', 'New answer'), ('accepted', 'Answer accepted'), ('milestone', 'Reputation milestone')], max_length=10)),
+                ('reputation', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('answer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.answer')),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.question')),
+                ('recipient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL)),
+                ('stack', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stackexchangeapp.stack')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recipient', '-created_at', '-id'], name='notification_inbox_idx'), models.Index(condition=models.Q(('read_at__isnull', True)), fields=['recipient'], name='notification_unread_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('kind', 'answer')), fields=('recipient', 'answer'), name='unique_answer_notification'), models.UniqueConstraint(condition=models.Q(('kind', 'milestone')), fields=('recipient', 'stack', 'reputation'), name='unique_milestone_notification')],
+            },
+        ),
+    ]
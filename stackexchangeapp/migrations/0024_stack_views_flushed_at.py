@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0023_notification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stack',
+            name='views_flushed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:35
+
+from django.db import migrations, models
+
+
+POSTGRES_INDEX = [
+    "CREATE INDEX stack_title_search_idx ON stackexchangeapp_stack USING GIN (to_tsvector('english', title))",
+]
+
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE stackexchangeapp_stack_fts USING fts5(
+        title,
+        content='stackexchangeapp_stack', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    "INSERT INTO stackexchangeapp_stack_fts(stackexchangeapp_stack_fts) VALUES ('rebuild')",
+    """
+    CREATE TRIGGER stack_fts_insert AFTER INSERT ON stackexchangeapp_stack BEGIN
+        INSERT INTO stackexchangeapp_stack_fts(rowid, title) VALUES (new.id, new.title);
+    END
+    """,
+    """
+    CREATE TRIGGER stack_fts_delete AFTER DELETE ON stackexchangeapp_stack BEGIN
+        INSERT INTO stackexchangeapp_stack_fts(stackexchangeapp_stack_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    END
+    """,
+    # Only on title changes: the counters and activity of a stack are updated all the time
+    """
+    CREATE TRIGGER stack_fts_update AFTER UPDATE OF title ON stackexchangeapp_stack BEGIN
+        INSERT INTO stackexchangeapp_stack_fts(stackexchangeapp_stack_fts, rowid, title) VALUES ('delete', old.id, old.title);
+        INSERT INTO stackexchangeapp_stack_fts(rowid, title) VALUES (new.id, new.title);
+    END
+    """,
+]
+
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS stack_title_search_idx",
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS stack_fts_insert",
+    "DROP TRIGGER IF EXISTS stack_fts_delete",
+    "DROP TRIGGER IF EXISTS stack_fts_update",
+    "DROP TABLE IF EXISTS stackexchangeapp_stack_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {'postgresql': POSTGRES_INDEX, 'sqlite': SQLITE_INDEX}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    statements = {'postgresql': POSTGRES_DROP, 'sqlite': SQLITE_DROP}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0024_stack_views_flushed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='memberships_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0026_pendingview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='notifications_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0027_user_notifications_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reputationevent',
+            name='reason',
+            field=models.CharField(choices=[('upvote', 'Post upvoted'), ('downvote', 'Post downvoted'), ('downvote_cast', 'Downvoted an answer')], max_length=15),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stackexchangeapp', '0028_reputationevent_reasons'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingview',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -2,9 +2,16 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.utils.text import slugify
+from django.utils import timezone
+
+from .rendering import render_description
 
 class User(AbstractUser):
     email = models.EmailField(blank=False)
+    # Bumped by joins and leaves, versions the cached ids of the joined stacks, see directory.py
+    memberships_version = models.PositiveIntegerField(default=0)
+    # Bumped by new notifications and mark_read, versions the cached unread count, see notifications.py
+    notifications_version = models.PositiveIntegerField(default=0)
 
 class Stack(models.Model):
     title = models.CharField(max_length=30)
@@ -12,6 +19,24 @@ class Stack(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # Last write to anything shown on the stack page, see record_activity
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # Time the hot scores of the questions were last decayed to, see ranking.py
+    hot_decayed_at = models.DateTimeField(null=True, blank=True)
+    # Last flush of view counts to the questions, see viewcounts.py
+    views_flushed_at = models.DateTimeField(null=True, blank=True)
+    # Denormalized for the home page, see directory.py; recount with reconcile_scores
+    member_count = models.PositiveIntegerField(default=0)
+    question_count = models.PositiveIntegerField(default=0)
+    answer_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # One per sort of the stack directory on the home page
+        indexes = [
+            models.Index(fields=['-last_activity_at', '-id'], name='stack_active_idx'),
+            models.Index(fields=['-member_count', '-id'], name='stack_size_idx'),
+            models.Index(fields=['-created_at', '-id'], name='stack_newest_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -32,61 +57,162 @@ class StackMembership(models.Model):
 
 
 class Tag(models.Model):
-    name = models.CharField(max_length=30)
+    name = models.CharField(max_length=35)
     stack = models.ForeignKey(Stack, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized, maintained by QuestionForm.save; recount with reconcile_scores
+    question_count = models.PositiveIntegerField(default=0)
     
     class Meta:
         unique_together = ('name', 'stack')
+        indexes = [
+            # The tag cloud of a stack
+            models.Index(fields=['stack', '-question_count'], name='tag_stack_count_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Question(models.Model):
-    title = models.CharField(max_length=30)
+class RenderedDescription:
+    """Renders the Markdown description into the stored HTML when saved, see rendering.py"""
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'description' in update_fields:
+            rendered = render_description(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = [*update_fields, *rendered]
+        super().save(*args, **kwargs)
+
+
+class Question(RenderedDescription, models.Model):
+    title = models.CharField(max_length=150)
+    # Markdown, rendered into description_html and description_preview
     description = models.TextField()
+    description_html = models.TextField(blank=True)
+    description_preview = models.TextField(blank=True)
+    # RENDERER_VERSION of description_html, 0 if not rendered yet
+    render_version = models.PositiveSmallIntegerField(default=0)
     asked_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="questions")
     stack = models.ForeignKey(Stack, on_delete=models.CASCADE, related_name="questions")
     created_at = models.DateTimeField(auto_now_add=True)
     edited_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="edited_questions")
     edited_at = models.DateTimeField(null=True, blank=True)
-    tags = models.ManyToManyField(Tag)
+    tags = models.ManyToManyField(Tag, through='QuestionTag')
+    score = models.IntegerField(default=0)
+    upvotes = models.PositiveIntegerField(default=0)
+    downvotes = models.PositiveIntegerField(default=0)
+    answer_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    hot_score = models.FloatField(default=0)
+    # Buffered in PendingView and flushed periodically, see viewcounts.py
+    view_count = models.PositiveIntegerField(default=0)
+    # Mirrors Answer.is_accepted, switched together by AcceptAnswerView.toggle_accept
+    accepted_answer = models.OneToOneField('Answer', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        # One index per sort mode of the stack listing, ending in id for keyset pagination
+        indexes = [
+            models.Index(fields=['stack', '-created_at', '-id'], name='question_stack_newest_idx'),
+            models.Index(fields=['stack', '-score', '-id'], name='question_stack_votes_idx'),
+            models.Index(fields=['stack', '-last_activity_at', '-id'], name='question_stack_active_idx'),
+            models.Index(fields=['stack', '-hot_score', '-id'], name='question_stack_hot_idx'),
+            models.Index(fields=['stack', '-view_count', '-id'], name='question_stack_views_idx'),
+            models.Index(
+                fields=['stack', '-created_at', '-id'],
+                condition=models.Q(answer_count=0),
+                name='question_stack_unanswered_idx',
+            ),
+        ]
 
     @property
     def vote_count(self):
-        upvotes = self.vote_set.filter(vote_type='up').count()
-        downvotes = self.vote_set.filter(vote_type='down').count()
-        return upvotes - downvotes
+        return self.score
     
     def __str__(self):
         return self.title
 
-class Answer(models.Model):
+class QuestionTag(models.Model):
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    # Copy of question.created_at, so the newest questions with a tag are one index range scan
+    created_at = models.DateTimeField()
+
+    class Meta:
+        # The table of the former auto-created through model
+        db_table = 'stackexchangeapp_question_tags'
+        unique_together = ('question', 'tag')
+        indexes = [
+            models.Index(fields=['tag', '-created_at', '-question'], name='questiontag_tag_newest_idx'),
+        ]
+
+class Answer(RenderedDescription, models.Model):
+    # Markdown, rendered into description_html
     description = models.TextField()
+    description_html = models.TextField(blank=True)
+    render_version = models.PositiveSmallIntegerField(default=0)
     is_accepted = models.BooleanField(default=False)
-    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    # Indexed by answer_question_order_idx
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_index=False)
     answered_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    score = models.IntegerField(default=0)
+    upvotes = models.PositiveIntegerField(default=0)
+    downvotes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # The answers of a question as listed: accepted first, then by score, oldest first
+            models.Index(fields=['question', '-is_accepted', '-score', 'created_at', 'id'], name='answer_question_order_idx'),
+        ]
+        constraints = [
+            # Also the index of the accepted answer of a question
+            models.UniqueConstraint(fields=['question'], condition=models.Q(is_accepted=True), name='unique_accepted_answer'),
+        ]
 
     @property
     def vote_count(self):
-        upvotes = self.vote_set.filter(vote_type='up').count()
-        downvotes = self.vote_set.filter(vote_type='down').count()
-        return upvotes - downvotes
+        return self.score
     def __str__(self):
         return str(self.answered_by) + ' ' + str(self.created_at) 
 
+class SearchDocument(models.Model):
+    """
+    Denormalized text of a question, its tags and its answers. The full-text
+    index over it is database specific and created in the migrations, see search.py.
+    """
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True)
+    stack = models.ForeignKey(Stack, on_delete=models.CASCADE)
+    title = models.TextField()
+    tags = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.title
+
+class PendingView(models.Model):
+    """Views of a question not yet added to its view_count, written in batches, see viewcounts.py"""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=1)
+
 class Vote(models.Model):
     VOTE_CHOICES = [('up', 'Upvote'), ('down', 'Downvote')]
     
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    question = models.ForeignKey(Question, on_delete=models.CASCADE, null=True, blank=True)
-    answer = models.ForeignKey(Answer, on_delete=models.CASCADE, null=True, blank=True)
+    # Indexed by the (question, vote_type) and (answer, vote_type) indexes
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    answer = models.ForeignKey(Answer, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
     vote_type = models.CharField(max_length=4, choices=VOTE_CHOICES, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
+        # Vote counts per post and type (reconcile_scores, hot ranking) are index-only scans
+        indexes = [
+            models.Index(fields=['question', 'vote_type'], name='vote_question_type_idx'),
+            models.Index(fields=['answer', 'vote_type'], name='vote_answer_type_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'question'],
@@ -104,4 +230,178 @@ class Vote(models.Model):
             raise ValidationError("Vote must be on either question or answer")
         
     def __str__(self):
-        return self.vote_type + ' ' + str(self.user) + ' ' + str(self.question) + ' ' + str(self.answer)
\ No newline at end of file
+        return self.vote_type + ' ' + str(self.user) + ' ' + str(self.question) + ' ' + str(self.answer)
+
+
+class ReputationEvent(models.Model):
+    """
+    Append-only ledger of reputation changes, see reputation.py. A retracted
+    vote is a new event with the opposite delta.
+    """
+    REASON_CHOICES = [
+        ('upvote', 'Post upvoted'),
+        ('downvote', 'Post downvoted'),
+        ('downvote_cast', 'Downvoted an answer'),
+    ]
+
+    stack = models.ForeignKey(Stack, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=15, choices=REASON_CHOICES)
+    # Kept when the post is deleted: the ledger is never rewritten
+    question = models.ForeignKey(Question, on_delete=models.SET_NULL, null=True, blank=True)
+    answer = models.ForeignKey(Answer, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Summing a member's events is an index-only scan
+            models.Index(fields=['stack', 'user', 'delta'], name='repevent_stack_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.delta:+d} ({self.reason})'
+
+
+class ReputationDaily(models.Model):
+    """Sum of a member's reputation events per day, for reputation over time"""
+    stack = models.ForeignKey(Stack, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()
+    delta = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stack', 'user', 'day'], name='unique_reputation_day'),
+        ]
+
+
+class ImportRun(models.Model):
+    """Progress of a Stack Exchange dump import, so an interrupted import can resume"""
+    PHASES = ['tags', 'users', 'posts', 'votes', 'finalize', 'done']
+    PHASE_CHOICES = [(phase, phase.capitalize()) for phase in PHASES]
+
+    stack = models.ForeignKey(Stack, on_delete=models.CASCADE)
+    source = models.CharField(max_length=500)
+    phase = models.CharField(max_length=10, choices=PHASE_CHOICES, default='tags')
+    # Last dump row Id fully imported in the current phase, null before the first batch
+    position = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.source} -> {self.stack} ({self.phase})'
+
+
+class ImportedRow(models.Model):
+    """Maps the Id of a dump row to the primary key of the row it was imported as"""
+    run = models.ForeignKey(ImportRun, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10)
+    source_id = models.BigIntegerField()
+    target_id = models.BigIntegerField()
+    # Questions only: the dump Id of the accepted answer
+    accepted_source_id = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'kind', 'source_id'], name='unique_imported_row'),
+        ]
+
+
+class Notification(models.Model):
+    """An entry of a user's inbox, see notifications.py"""
+    KIND_CHOICES = [
+        ('answer', 'New answer'),
+        ('accepted', 'Answer accepted'),
+        ('milestone', 'Reputation milestone'),
+    ]
+
+    # Indexed by the inbox indexes
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications', db_index=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    stack = models.ForeignKey(Stack, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, null=True, blank=True)
+    answer = models.ForeignKey(Answer, on_delete=models.CASCADE, null=True, blank=True)
+    # Who answered or accepted
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # Milestones only: the reputation reached
+    reputation = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notification_inbox_idx'),
+            # Counting the unread ones only reads those
+            models.Index(fields=['recipient'], condition=models.Q(read_at__isnull=True), name='notification_unread_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'answer'],
+                condition=models.Q(kind='answer'),
+                name='unique_answer_notification'
+            ),
+            models.UniqueConstraint(
+                fields=['recipient', 'stack', 'reputation'],
+                condition=models.Q(kind='milestone'),
+                name='unique_milestone_notification'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} for {self.recipient}'
+
+
+class Job(models.Model):
+    """A side effect of a write, run later by the runworker command, see jobs.py"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default='queued')
+    # At most one queued job per key: enqueuing it again is a no-op until a worker starts it
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Not before this, pushed back after a failed attempt
+    run_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Claiming the next due jobs, and the queue depth per status
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+            # Latency of the recent jobs, and pruning the old ones
+            models.Index(fields=['status', 'finished_at'], name='job_status_finished_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=models.Q(status='queued'),
+                name='unique_queued_job'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+
+def record_activity(stack_id, question_id=None, when=None, stack_changes=None, **question_changes):
+    """
+    Bump last_activity_at of a stack and optionally one of its questions, with
+    any other stack_changes and question_changes in the same UPDATEs. These are
+    the validators of the conditional GETs of their pages, so every write shown
+    there calls this.
+    """
+    when = when or timezone.now()
+    if question_id is not None:
+        Question.objects.filter(pk=question_id).update(last_activity_at=when, **question_changes)
+    Stack.objects.filter(pk=stack_id).update(last_activity_at=when, **(stack_changes or {}))
@@ -0,0 +1,138 @@
+"""
+Per-user inbox.
+
+Notifications are fanned out on write: every event inserts one row per
+recipient, so reading an inbox is one index range scan of the recipient's
+rows. A new answer notifies the asker and the other answerers of the
+question, from a job (see jobs.py) inserting BATCH_SIZE rows per INSERT; an
+accept notifies the answerer, and reaching one of REPUTATION_MILESTONES in a
+stack the member, in the transaction of the write.
+
+The unread count shown on every page comes from the cache, keyed by
+User.notifications_version: the writes changing the count bump it in their
+transaction, so every process (the job workers included) moves to a new key
+without deleting anything, whatever the cache, and pages only count unread
+notifications (with notification_unread_idx) after that. The version is also
+part of the ETags of the pages, see ConditionalGetMixin.
+"""
+from itertools import islice
+
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .jobs import task
+from .models import Answer, Notification, User
+from .routing import PRIMARY
+
+REPUTATION_MILESTONES = (10, 50, 100, 500, 1000, 2000, 5000, 10000, 25000, 100000)
+BATCH_SIZE = 1000
+# Counts of older versions are never read again, they only wait to expire
+UNREAD_COUNT_TIMEOUT = 3600
+REPLICA_COUNT_TIMEOUT = 10
+
+
+def unread_count_key(user):
+    return f'unread-notifications:{user.pk}:{user.notifications_version}'
+
+
+def unread_count(user):
+    """The number of unread notifications of a user, from the cache when possible"""
+    key = unread_count_key(user)
+    count = cache.get(key)
+    if count is None:
+        db = router.db_for_read(Notification)
+        count = Notification.objects.using(db).filter(recipient_id=user.pk, read_at__isnull=True).count()
+        # A replica may miss the latest notifications: recounted once it caught up
+        cache.set(key, count, UNREAD_COUNT_TIMEOUT if db == PRIMARY else REPLICA_COUNT_TIMEOUT)
+    return count
+
+
+def bump_notifications_version(user_ids):
+    """Move users to new unread count keys, in the transaction changing their count"""
+    User.objects.filter(pk__in=set(user_ids)).update(notifications_version=F('notifications_version') + 1)
+
+
+def notify(notifications):
+    """
+    Insert notifications, BATCH_SIZE per INSERT, inside the transaction of
+    the caller. Duplicates of the ones that can only happen once (see
+    Notification.Meta) are skipped, so the jobs notifying can run twice.
+    """
+    Notification.objects.bulk_create(notifications, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    bump_notifications_version(notification.recipient_id for notification in notifications)
+
+
+def mark_read(user_id):
+    """Mark all notifications of a user as read. Returns their number."""
+    with transaction.atomic():
+        marked = Notification.objects.filter(recipient_id=user_id, read_at__isnull=True).update(read_at=timezone.now())
+        if marked:
+            bump_notifications_version([user_id])
+    return marked
+
+
+@task('notify_answer')
+def notify_answer(answer_id):
+    """Notify the asker and the earlier answerers of a question of a new answer"""
+    answer = Answer.objects.select_related('question').filter(pk=answer_id).first()
+    if answer is None:
+        # Deleted before the job ran
+        return
+    question = answer.question
+    answerers = (
+        Answer.objects.filter(question_id=question.pk, pk__lt=answer.pk)
+        .values_list('answered_by_id', flat=True)
+        .order_by('answered_by_id')
+        .distinct()
+    )
+
+    def recipients():
+        if question.asked_by_id not in (answer.answered_by_id, None):
+            yield question.asked_by_id
+        for user_id in answerers.iterator(chunk_size=BATCH_SIZE):
+            if user_id not in (answer.answered_by_id, question.asked_by_id, None):
+                yield user_id
+
+    fields = {'kind': 'answer', 'stack_id': question.stack_id, 'question_id': question.pk,
+              'answer_id': answer.pk, 'actor_id': answer.answered_by_id, 'created_at': answer.created_at}
+    # All or none, so a retried job doesn't skip anyone
+    with transaction.atomic():
+        pending = recipients()
+        while batch := list(islice(pending, BATCH_SIZE)):
+            notify([Notification(recipient_id=user_id, **fields) for user_id in batch])
+
+
+def notify_accepted(answer, asker_id):
+    """Notify the author of an answer that it was accepted. Call it inside the transaction of the accept."""
+    if answer.answered_by_id in (asker_id, None):
+        return
+    notify([Notification(
+        recipient_id=answer.answered_by_id,
+        kind='accepted',
+        stack_id=answer.question.stack_id,
+        question_id=answer.question_id,
+        answer_id=answer.pk,
+        actor_id=asker_id,
+    )])
+
+
+def notify_milestones(stack_id, totals, reputations):
+    """Notify the members whose reputation went past a milestone, given their changes and their reputation after them"""
+    notifications = [
+        Notification(recipient_id=user_id, kind='milestone', stack_id=stack_id, reputation=milestone)
+        for user_id, reputation in reputations.items()
+        for milestone in REPUTATION_MILESTONES
+        if reputation - totals[user_id] < milestone <= reputation
+    ]
+    if notifications:
+        notify(notifications)
+
+
+def unread_notifications(request):
+    """Context processor of the unread count shown in base.html"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_notifications': unread_count(user)}
@@ -0,0 +1,118 @@
+import base64
+import datetime
+import json
+from functools import reduce
+from operator import and_, or_
+
+from django.core.paginator import InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keeps the microseconds of datetimes, which DjangoJSONEncoder truncates, so ties on them break right"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination on an ordering such as ('-score', '-id').
+
+    Instead of OFFSET, every page is fetched with a WHERE clause that starts right
+    after the last row of the previous page, so page 1000 costs the same index range
+    scan as page 1. The ordering must end with a unique column and its fields
+    must not be nullable.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        return self._page(list(self._slice(cursor)))
+
+    async def apage(self, cursor=None):
+        return self._page([row async for row in self._slice(cursor)])
+
+    def _slice(self, cursor):
+        queryset = self.queryset.order_by(*self._order_by())
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode(cursor)))
+        return queryset[:self.per_page + 1]
+
+    def _page(self, rows):
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self.encode(rows[-1])
+        return KeysetPage(rows, next_cursor)
+
+    def encode(self, row):
+        values = [self._value(row, name) for name, _ in self.ordering]
+        data = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [self._field(name).to_python(value) for (name, _), value in zip(self.ordering, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor("Invalid cursor")
+
+    def _order_by(self):
+        return [('-' if descending else '') + name for name, descending in self.ordering]
+
+    def _after(self, values):
+        # (a, b, c) after (x, y, z)  <=>  a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        clauses = []
+        for i, (name, descending) in enumerate(self.ordering):
+            equal = [Q(**{field: values[j]}) for j, (field, _) in enumerate(self.ordering[:i])]
+            lookup = '__lt' if descending else '__gt'
+            clauses.append(reduce(and_, equal + [Q(**{name + lookup: values[i]})]))
+        return reduce(or_, clauses)
+
+    def _field(self, name):
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        model = self.queryset.model
+        *relations, field_name = name.split('__')
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(field_name)
+
+    def _value(self, row, name):
+        if isinstance(row, dict):
+            return row[name]
+        for attr in name.split('__'):
+            row = getattr(row, attr)
+        return row
@@ -0,0 +1,285 @@
+"""
+Query plan regression checks.
+
+capture_queries records the SQL and parameters of everything a block of code
+runs, e.g. a request through the test client. plan_issues EXPLAINs each
+SELECT, UPDATE and DELETE of it and reports:
+
+- scan: a full scan of a table, where an index should have narrowed it down;
+- sort: a sort of rows read from a table, where an index should have
+  returned them in order. Sorts of a single row (a unique lookup) are free.
+
+Plans are read from EXPLAIN QUERY PLAN on SQLite and EXPLAIN (FORMAT JSON)
+on PostgreSQL. Planners rightly scan and sort small tables, so only tables
+of at least min_rows rows count. With strict=True, PostgreSQL is told to
+avoid sequential scans and sorts whenever it can, so a plan issue means
+there is no index for the query whatever the size of the tables: use it on
+small (test) databases. SQLite plans don't depend on table sizes until
+ANALYZE is run.
+"""
+import json
+import re
+from dataclasses import dataclass
+
+from django.db import connections, transaction
+from django.urls import reverse
+
+from .benchmark import Scenario, core_scenarios, request
+from .models import Tag
+
+EXPLAINED = re.compile(r'^\s*(SELECT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+# Django's subquery and join aliases (U0, T3...), as SQLite reports them instead of the table
+TABLE_ALIAS = re.compile(r'(?:FROM|JOIN)\s+"(\w+)"(?:\s+(?:AS\s+)?"?([A-Z]\d+)\b)?', re.IGNORECASE)
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+SQLITE_TABLE = re.compile(r'^(?:SCAN|SEARCH) (\w+)')
+SQLITE_SEARCH = re.compile(r'^SEARCH \w+ USING (?:(?:COVERING )?INDEX (\w+)|INTEGER PRIMARY KEY) \(([^)]*)\)')
+SQLITE_EQUAL = re.compile(r'(\w+)=\?')
+
+# {(scenario, kind, table): why the plan is as good as it gets}
+ALLOWED_ISSUES = {
+    ('api_stacks', 'scan', 'stackexchangeapp_stack'): "Primary key order: the scan stops after one page",
+    ('api_questions', 'sort', 'stackexchangeapp_question_tags'): "The few tags of a page of questions, by name",
+}
+
+
+@dataclass(frozen=True)
+class PlanIssue:
+    kind: str
+    table: str
+    sql: str
+    plan: str
+
+    def __str__(self):
+        return f'{self.kind} of {self.table}: {self.sql}\n{self.plan}'
+
+
+class QueryCapture:
+    """Database execute wrapper keeping (alias, sql, params) of the queries run"""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many:
+            self.queries.append((self.alias, sql, params))
+        return execute(sql, params, many, context)
+
+
+class capture_queries:
+    """with capture_queries() as queries: ... -> [(alias, sql, params)] on every database (or aliases)"""
+
+    def __init__(self, aliases=None):
+        self.aliases = aliases
+
+    def __enter__(self):
+        self.captures = [QueryCapture(alias) for alias in self.aliases or connections]
+        self.wrappers = [connections[c.alias].execute_wrapper(c) for c in self.captures]
+        for wrapper in self.wrappers:
+            wrapper.__enter__()
+        self.queries = []
+        return self.queries
+
+    def __exit__(self, *exc_info):
+        for wrapper in reversed(self.wrappers):
+            wrapper.__exit__(*exc_info)
+        for capture in self.captures:
+            self.queries.extend(capture.queries)
+
+
+def explain(connection, sql, params, strict=False):
+    """The plan of a query: EXPLAIN QUERY PLAN rows on SQLite, the JSON plan on PostgreSQL"""
+    prefix = connection.ops.explain_query_prefix('JSON' if connection.vendor == 'postgresql' else None)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if strict and connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan TO off')
+            cursor.execute('SET LOCAL enable_sort TO off')
+        cursor.execute(f'{prefix} {sql}', params)
+        rows = cursor.fetchall()
+        if strict and connection.vendor == 'postgresql':
+            # SET LOCAL only ends with the transaction, which may be the caller's
+            cursor.execute('RESET enable_seqscan')
+            cursor.execute('RESET enable_sort')
+    if connection.vendor == 'postgresql':
+        plan = rows[0][0]
+        return json.loads(plan) if isinstance(plan, str) else plan
+    return rows
+
+
+def table_aliases(sql):
+    aliases = {}
+    for table, alias in TABLE_ALIAS.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def sqlite_single_row(detail, unique_indexes):
+    """Whether a SEARCH step looks up at most one row: equality on every column of a unique index"""
+    search = SQLITE_SEARCH.match(detail)
+    if search is None:
+        return False
+    equal = set(SQLITE_EQUAL.findall(search.group(2)))
+    if search.group(1) is None:
+        return 'rowid' in equal
+    return search.group(1) in unique_indexes and unique_indexes[search.group(1)] <= equal
+
+
+def sqlite_issues(rows, sql, unique_indexes=None):
+    """
+    (kind, table) of the issues of an EXPLAIN QUERY PLAN. unique_indexes,
+    {name: columns}, tells which sorts are of a single row.
+    """
+    aliases = table_aliases(sql)
+    unique_indexes = unique_indexes or {}
+    children = {}
+    for node_id, parent, _, detail in rows:
+        children.setdefault(parent, []).append((node_id, detail))
+
+    def walk(parent):
+        # A sort is charged to the first table of its (sub)query, the one the rows are read from
+        issues, tables, single_row = [], [], True
+        for node_id, detail in children.get(parent, []):
+            table = SQLITE_TABLE.match(detail)
+            if table and table.group(1) in aliases:
+                tables.append(aliases[table.group(1)])
+                single_row = single_row and sqlite_single_row(detail, unique_indexes)
+                scan = SQLITE_SCAN.match(detail)
+                if scan:
+                    issues.append(('scan', aliases[scan.group(1)]))
+            elif detail == 'USE TEMP B-TREE FOR ORDER BY' and tables and not single_row:
+                issues.append(('sort', tables[0]))
+            issues.extend(walk(node_id))
+        return issues
+
+    return walk(0)
+
+
+def postgresql_issues(plan):
+    """(kind, table) of the issues of an EXPLAIN (FORMAT JSON)"""
+    issues = []
+
+    def walk(node):
+        # Like on SQLite, a sort is charged to the first table under it: the outer side of its joins
+        tables = [node['Relation Name']] if 'Relation Name' in node else []
+        for child in node.get('Plans', []):
+            tables += walk(child)
+        if node['Node Type'] == 'Seq Scan':
+            issues.append(('scan', node['Relation Name']))
+        elif node['Node Type'] == 'Sort' and tables and node['Plan Rows'] > 1:
+            issues.append(('sort', tables[0]))
+        return tables
+
+    walk(plan[0]['Plan'])
+    return issues
+
+
+def table_rows(connection, table):
+    """Estimated number of rows of a table on PostgreSQL, exact on SQLite"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            # -1 until the table is first analyzed
+            if row is not None and row[0] >= 0:
+                return row[0]
+        cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        return cursor.fetchone()[0]
+
+
+def unique_indexes(connection, tables):
+    """{index name: columns} of the unique indexes of tables"""
+    indexes = {}
+    with connection.cursor() as cursor:
+        for table in tables:
+            for name, constraint in connection.introspection.get_constraints(cursor, table).items():
+                if constraint['unique']:
+                    indexes[name] = set(constraint['columns'])
+    return indexes
+
+
+def plan_issues(queries, min_rows=1000, strict=False):
+    """PlanIssues of captured queries, each (kind, table, sql) once"""
+    issues = {}
+    sizes = {}
+    indexes = {}
+    for alias, sql, params in queries:
+        if not EXPLAINED.match(sql):
+            continue
+        connection = connections[alias]
+        plan = explain(connection, sql, params, strict)
+        if connection.vendor == 'postgresql':
+            found, text = postgresql_issues(plan), json.dumps(plan, indent=1)
+        elif connection.vendor == 'sqlite':
+            unique = {}
+            for table in set(table_aliases(sql).values()):
+                if (alias, table) not in indexes:
+                    indexes[alias, table] = unique_indexes(connection, [table])
+                unique.update(indexes[alias, table])
+            found, text = sqlite_issues(plan, sql, unique), '\n'.join(row[3] for row in plan)
+        else:
+            continue
+        for kind, table in found:
+            if (alias, table) not in sizes:
+                sizes[alias, table] = table_rows(connection, table)
+            if (kind, table, sql) not in issues and sizes[alias, table] >= min_rows:
+                issues[kind, table, sql] = PlanIssue(kind, table, sql, text)
+    return list(issues.values())
+
+
+def plan_scenarios(stack, question, answer):
+    """The benchmark scenarios plus the other sorts, filters and endpoints of every view"""
+    stack_url = reverse('stack', args=[stack.id, stack.slug])
+    question_url = reverse('question_detail', args=[stack.id, question.id])
+    tag = Tag.objects.filter(stack=stack).order_by('-question_count').first()
+    scenarios = core_scenarios(stack, question, answer) + [
+        Scenario('home_size', 'GET', reverse('home'), {'sort': 'size'}),
+        Scenario('home_newest', 'GET', reverse('home'), {'sort': 'newest', 'q': stack.title[:3]}),
+        Scenario('stack_active', 'GET', stack_url, {'sort': 'active'}),
+        Scenario('stack_hot', 'GET', stack_url, {'sort': 'hot'}),
+        Scenario('stack_views', 'GET', stack_url, {'sort': 'views'}),
+        Scenario('stack_unanswered', 'GET', stack_url, {'sort': 'unanswered'}),
+        Scenario('search', 'GET', reverse('search', args=[stack.id]), {'q': question.title.split()[0]}),
+        Scenario('reputation_history', 'GET', reverse('reputation_history', args=[stack.id])),
+        Scenario('inbox', 'GET', reverse('inbox')),
+        Scenario('answer_question', 'POST', question_url, {'description': 'Query plan check'}, writes=True),
+        Scenario('join_stack', 'POST', reverse('join_stack', args=[stack.id]), writes=True),
+        Scenario('leave_stack', 'POST', reverse('leave_stack', args=[stack.id]), writes=True),
+        Scenario('api_stacks', 'GET', reverse('api_stacks')),
+        Scenario('api_questions', 'GET', reverse('api_questions', args=[stack.id]), {'embed': 'asked_by,tags'}),
+        Scenario('api_answers', 'GET', reverse('api_question_answers', args=[stack.id, question.id])),
+        Scenario('api_tags', 'GET', reverse('api_tags', args=[stack.id])),
+        Scenario('api_members', 'GET', reverse('api_members', args=[stack.id]), {'embed': 'user'}),
+        Scenario('api_memberships', 'GET', reverse('api_memberships')),
+    ]
+    if tag is not None:
+        scenarios += [
+            Scenario('stack_tag', 'GET', stack_url, {'tag': tag.name}),
+            Scenario('stack_tag_votes', 'GET', stack_url, {'tag': tag.name, 'sort': 'votes'}),
+            Scenario('api_questions_tag', 'GET', reverse('api_questions', args=[stack.id]), {'tag': tag.name}),
+        ]
+    if answer is not None:
+        scenarios += [
+            Scenario('accept_answer', 'POST', reverse('accept_answer', args=[stack.id, question.id, answer.id]), writes=True),
+            Scenario('answer_vote_json', 'POST', reverse('answer_vote_json', args=[stack.id, question.id, answer.id, 'up']), writes=True),
+        ]
+    return scenarios
+
+
+def check_plans(client, scenarios, min_rows=1000, strict=False):
+    """{scenario name: [PlanIssue]} of the queries each scenario runs, not counting ALLOWED_ISSUES"""
+    results = {}
+    for scenario in scenarios:
+        # Everything is rolled back, so repeated runs see the same dataset
+        with transaction.atomic():
+            with capture_queries() as queries:
+                response = request(client, scenario)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{scenario.name}: {scenario.method} {scenario.url} returned {response.status_code}")
+            issues = plan_issues(queries, min_rows, strict)
+            transaction.set_rollback(True)
+        results[scenario.name] = [
+            issue for issue in issues if (scenario.name, issue.kind, issue.table) not in ALLOWED_ISSUES
+        ]
+    return results
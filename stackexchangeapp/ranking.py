@@ -0,0 +1,158 @@
+"""
+Hot ranking of the questions of a stack.
+
+Question.hot_score is a sum of points (for asking, answers and votes) that
+decay exponentially with a half-life of HOT_HALF_LIFE_HOURS. It's never
+recomputed on read: the vote and answer write paths add the points of an
+event at full weight in the UPDATE they already run, and decay_hot_scores
+periodically multiplies the scores of a stack by the decay since its last
+run (Stack.hot_decayed_at). So between two runs a score is at most one
+interval stale, which doesn't change the ranking much as long as the command
+runs well within a half-life, e.g. hourly.
+
+Scores that decayed to nearly nothing are floored to 0, so every run only
+rewrites the questions that are still warm. The listing is served from the
+(stack, -hot_score, -id) index.
+
+The vote counters behind the votes sort (score, upvotes, downvotes) and the
+answer counts are kept up to date the same way, by the write paths; reconcile
+recomputes them from the votes and answers.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Stack, Question, Answer, Vote
+
+HOT_WEIGHTS = {
+    'question': 1.0,
+    'answer': 2.0,
+    'up': 1.0,
+    'down': -1.0,
+}
+# Scores closer to 0 than this are set to 0 and left alone by the next decays
+HOT_FLOOR = 0.01
+
+
+def half_life():
+    return getattr(settings, 'HOT_HALF_LIFE_HOURS', 24) * 3600
+
+
+def decay(seconds):
+    """Factor by which points shrink over a number of seconds"""
+    return 0.5 ** (max(seconds, 0) / half_life())
+
+
+def hot_vote_change(old_vote_type, new_vote_type):
+    """F() expression adding the points of changing a vote on a question"""
+    points = HOT_WEIGHTS.get(new_vote_type, 0) - HOT_WEIGHTS.get(old_vote_type, 0)
+    return F('hot_score') + points
+
+
+def decay_hot_scores(stack_id, now=None):
+    """
+    Decay the scores of a stack to now in one UPDATE of its nonzero scores.
+    Returns the number of questions rewritten, or None when the stack has
+    never been decayed (rebuild_hot_scores it first).
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        decayed_at = Stack.objects.select_for_update().filter(pk=stack_id).values_list('hot_decayed_at', flat=True).first()
+        if decayed_at is None:
+            return None
+        # Bounded so long idle stacks don't divide by zero below; all their scores are floored anyway
+        factor = max(decay((now - decayed_at).total_seconds()), 1e-9)
+        cold = Q(hot_score__gt=-HOT_FLOOR / factor, hot_score__lt=HOT_FLOOR / factor)
+        updated = Question.objects.filter(stack_id=stack_id).exclude(hot_score=0).update(
+            hot_score=Case(When(cold, then=Value(0.0)), default=F('hot_score') * factor),
+        )
+        Stack.objects.filter(pk=stack_id).update(hot_decayed_at=now)
+    return updated
+
+
+def rebuild_hot_scores(stack_id, chunk_size=5000, now=None):
+    """
+    Recompute the scores of a stack from its questions, answers and votes,
+    decayed to now, one chunk of questions at a time. Points added by writes
+    during the rebuild may be overwritten; run it after imports or to recover
+    from drift, and decay_hot_scores otherwise.
+    """
+    now = now or timezone.now()
+    questions = Question.objects.filter(stack_id=stack_id).order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(questions.filter(pk__gt=last_pk).values_list('pk', 'created_at')[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        scores = {pk: HOT_WEIGHTS['question'] * decay((now - created_at).total_seconds()) for pk, created_at in chunk}
+        answers = Answer.objects.filter(question_id__in=scores).values_list('question_id', 'created_at')
+        for question_id, created_at in answers:
+            scores[question_id] += HOT_WEIGHTS['answer'] * decay((now - created_at).total_seconds())
+        votes = Vote.objects.filter(question_id__in=scores, vote_type__in=['up', 'down'])
+        for question_id, vote_type, created_at in votes.values_list('question_id', 'vote_type', 'created_at'):
+            scores[question_id] += HOT_WEIGHTS[vote_type] * decay((now - created_at).total_seconds())
+
+        Question.objects.bulk_update(
+            [Question(pk=pk, hot_score=score if abs(score) >= HOT_FLOOR else 0.0) for pk, score in scores.items()],
+            ['hot_score'],
+            batch_size=1000,
+        )
+    Stack.objects.filter(pk=stack_id).update(hot_decayed_at=now)
+
+
+def vote_total(target, vote_type):
+    """Subquery counting the votes of vote_type on the outer question/answer"""
+    votes = Vote.objects.filter(**{target: OuterRef('pk'), 'vote_type': vote_type})
+    votes = votes.order_by().values(target).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(votes, output_field=IntegerField()), Value(0))
+
+
+def answer_total():
+    """Subquery counting the answers of the outer question"""
+    answers = Answer.objects.filter(question=OuterRef('pk')).order_by().values('question').annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(answers, output_field=IntegerField()), Value(0))
+
+
+def real_counters(model, target):
+    """The stored counters of model, with the expressions recomputing them"""
+    counters = {'upvotes': vote_total(target, 'up'), 'downvotes': vote_total(target, 'down')}
+    counters['score'] = vote_total(target, 'up') - vote_total(target, 'down')
+    if model is Question:
+        counters['answer_count'] = answer_total()
+    return counters
+
+
+def reconcile(model, target, chunk_size=1000, stack_id=None, check=False):
+    """
+    Recompute upvotes/downvotes/score of every row of model from the Vote table,
+    and answer_count of questions, walking the primary key in chunks. Returns
+    the number of rows that had drifted.
+    """
+    queryset = model.objects.order_by('pk')
+    if stack_id is not None:
+        stack_lookup = 'stack_id' if model is Question else 'question__stack_id'
+        queryset = queryset.filter(**{stack_lookup: stack_id})
+
+    drifted = 0
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1]
+
+        counters = real_counters(model, target)
+        drifted_pks = list(
+            model.objects.filter(pk__in=chunk)
+            .annotate(**{f'real_{name}': counter for name, counter in counters.items()})
+            .filter(Q(*[~Q(**{name: F(f'real_{name}')}) for name in counters], _connector=Q.OR))
+            .values_list('pk', flat=True)
+        )
+        drifted += len(drifted_pks)
+        if drifted_pks and not check:
+            with transaction.atomic():
+                model.objects.filter(pk__in=drifted_pks).update(**real_counters(model, target))
+    return drifted
@@ -0,0 +1,109 @@
+"""
+Markdown bodies, rendered once when written.
+
+Questions and answers keep their Markdown source in description, and the
+sanitized HTML next to it in description_html, rendered by Question.save and
+Answer.save; bulk writers call render_description themselves. Pages show the
+stored HTML, and question cards the stored plain text description_preview,
+so views never render Markdown.
+
+render_version records the RENDERER_VERSION a row was rendered with. Bump it
+whenever the output changes (extensions, allowed tags...) and run
+rerender_bodies, which re-renders the older rows a chunk at a time. Rows
+never rendered (0) are shown from their source meanwhile.
+"""
+import html
+from functools import lru_cache
+
+import markdown
+import nh3
+from django.db import transaction
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+from .fragments import invalidate_fragments
+
+RENDERER_VERSION = 1
+PREVIEW_WORDS = 30
+# Sources rendered per process, for saves that don't change the text and repeated bodies
+RENDER_CACHE_SIZE = 512
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'sane_lists', 'nl2br']
+ALLOWED_TAGS = {
+    'p', 'br', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'code',
+    'em', 'strong', 'del', 'a', 'img', 'ul', 'ol', 'li',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'title'},
+    # fenced_code's language-* class, for highlighting client side
+    'code': {'class'},
+    'th': {'align'},
+    'td': {'align'},
+}
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_markdown(source):
+    """Sanitized HTML of Markdown: raw HTML and unsafe URLs are dropped, links get rel=nofollow"""
+    rendered = markdown.markdown(
+        source,
+        extensions=MARKDOWN_EXTENSIONS,
+        extension_configs={'tables': {'use_align_attribute': True}},
+    )
+    return nh3.clean(
+        rendered,
+        tags=ALLOWED_TAGS,
+        attributes=ALLOWED_ATTRIBUTES,
+        url_schemes={'http', 'https', 'mailto'},
+        link_rel='nofollow noopener',
+    )
+
+
+def make_preview(body_html, words=PREVIEW_WORDS):
+    """The first words of rendered HTML, as plain text"""
+    text = ' '.join(html.unescape(strip_tags(body_html)).split())
+    return Truncator(text).words(words, truncate=' …')
+
+
+def render_description(obj):
+    """Render the description of a question or answer into its other fields. Returns their names."""
+    obj.description_html = render_markdown(obj.description)
+    obj.render_version = RENDERER_VERSION
+    fields = ['description_html', 'render_version']
+    # On the class: a deferred field would be loaded to test the instance
+    if hasattr(type(obj), 'description_preview'):
+        obj.description_preview = make_preview(obj.description_html)
+        fields.append('description_preview')
+    return fields
+
+
+def rerender(model, chunk_size=500, force=False, check=False):
+    """
+    Re-render the rows of model (Question or Answer) rendered by an older
+    renderer, or all of them if force, walking the primary key in chunks.
+    Returns the number of rows rendered, or to render if check.
+    """
+    queryset = model.objects.order_by('pk')
+    if not force:
+        queryset = queryset.filter(render_version__lt=RENDERER_VERSION)
+    if check:
+        return queryset.count()
+
+    fields = render_description(model(description=''))
+    rendered = 0
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).only('pk', 'description')[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        for obj in chunk:
+            render_description(obj)
+        with transaction.atomic():
+            model.objects.bulk_update(chunk, fields)
+            # Cached fragments hold the previous HTML
+            invalidate_fragments(model._meta.model_name, *[obj.pk for obj in chunk])
+        rendered += len(chunk)
+    return rendered
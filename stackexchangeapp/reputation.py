@@ -0,0 +1,189 @@
+"""
+Reputation ledger.
+
+Every reputation change is appended to ReputationEvent in the transaction of
+the vote that caused it, and added incrementally to two aggregates:
+StackMembership.reputation (the total) and ReputationDaily (one row per member
+and day, for reputation over time). Both aggregates can be recomputed from the
+ledger at any time with rebuild_reputation, and the ledger itself from the
+votes with replay_votes. Only members of the stack earn reputation in it, e.g.
+not the author of a post who left the stack, in the ledger as in the totals.
+Members going past a reputation milestone are notified, see notifications.py.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import StackMembership, Vote, ReputationEvent, ReputationDaily
+from .notifications import notify_milestones
+
+# (owner delta, voter delta) for a vote, keyed by (vote_type, is_answer)
+VOTE_DELTAS = {
+    ('up', False): (10, 0),
+    ('down', False): (-2, 0),
+    ('up', True): (10, 0),
+    ('down', True): (-2, -1),  # Cost to downvote answer
+}
+
+UPSERT_DAILY = '''
+    INSERT INTO {table} (stack_id, user_id, day, delta) VALUES {rows}
+    ON CONFLICT (stack_id, user_id, day) DO UPDATE SET delta = {table}.delta + excluded.delta
+'''
+# RETURNING the new totals, for the milestones
+ADD_TOTALS = '''
+    UPDATE {table} SET reputation = reputation + CASE user_id {cases} ELSE 0 END
+    WHERE stack_id = %s AND user_id IN ({user_ids})
+    RETURNING user_id, reputation
+'''
+
+
+def record_events(stack_id, events):
+    """
+    Add ReputationEvents (without their stack) to the members' totals, append
+    the ones of members and add them to their daily rollups, in three
+    statements, and notify the members reaching a milestone. Call it inside
+    the transaction of the write that caused them.
+    """
+    events = [event for event in events if event.delta]
+    if not events:
+        return
+    totals = defaultdict(int)
+    for event in events:
+        event.stack_id = stack_id
+        totals[event.user_id] += event.delta
+    params = []
+    for user_id, delta in totals.items():
+        params += [user_id, delta]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            ADD_TOTALS.format(
+                table=StackMembership._meta.db_table,
+                cases=' '.join(['WHEN %s THEN %s'] * len(totals)),
+                user_ids=', '.join(['%s'] * len(totals)),
+            ),
+            params + [stack_id, *totals],
+        )
+        # Only members are updated
+        reputations = dict(cursor.fetchall())
+    notify_milestones(stack_id, totals, reputations)
+    events = [event for event in events if event.user_id in reputations]
+    if not events:
+        return
+    ReputationEvent.objects.bulk_create(events)
+
+    totals = {user_id: delta for user_id, delta in totals.items() if delta and user_id in reputations}
+    if not totals:
+        return
+    # An upsert, so the first events of the day of two concurrent requests can't collide
+    day = connection.ops.adapt_datefield_value(timezone.localdate(events[0].created_at))
+    params = []
+    for user_id, delta in totals.items():
+        params += [stack_id, user_id, day, delta]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPSERT_DAILY.format(table=ReputationDaily._meta.db_table, rows=', '.join(['(%s, %s, %s, %s)'] * len(totals))),
+            params,
+        )
+
+
+def rebuild_reputation(stack_id, chunk_size=5000, check=False):
+    """
+    Recompute the totals and daily rollups of every member of a stack from the
+    ledger, one chunk of memberships per transaction, with one UPDATE and one
+    grouped SELECT per chunk. Returns the number of totals that had drifted.
+    """
+    events = ReputationEvent.objects.filter(stack_id=stack_id).order_by()
+    total = Coalesce(
+        Subquery(events.filter(user_id=OuterRef('user_id')).values('user_id').annotate(total=Sum('delta')).values('total')),
+        Value(0),
+    )
+    memberships = StackMembership.objects.filter(stack_id=stack_id).order_by('pk')
+    drifted = 0
+    last_pk = 0
+    while True:
+        chunk = list(memberships.filter(pk__gt=last_pk).values_list('pk', 'user_id')[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        pks = [pk for pk, _ in chunk]
+        users = [user_id for _, user_id in chunk]
+        drifted_rows = StackMembership.objects.filter(pk__in=pks).exclude(reputation=total)
+        if check:
+            drifted += drifted_rows.count()
+            continue
+
+        with transaction.atomic():
+            drifted += drifted_rows.update(reputation=total)
+            days = (
+                events.filter(user_id__in=users)
+                .annotate(day=TruncDate('created_at'))
+                .values('user_id', 'day')
+                .annotate(total=Sum('delta'))
+            )
+            ReputationDaily.objects.filter(stack_id=stack_id, user_id__in=users).delete()
+            ReputationDaily.objects.bulk_create(
+                [ReputationDaily(stack_id=stack_id, user_id=row['user_id'], day=row['day'], delta=row['total']) for row in days],
+                batch_size=chunk_size,
+            )
+    return drifted
+
+
+def vote_events(vote_type, is_answer, owner_id, voter_id, sign=1, **fields):
+    """The ReputationEvents of casting (sign=1) or retracting (sign=-1) a vote"""
+    owner_delta, voter_delta = VOTE_DELTAS[(vote_type, is_answer)]
+    return [
+        ReputationEvent(user_id=owner_id, delta=sign * owner_delta, reason=f'{vote_type}vote', **fields),
+        ReputationEvent(user_id=voter_id, delta=sign * voter_delta, reason='downvote_cast', **fields),
+    ]
+
+
+def replay_votes(stack_id, chunk_size=5000):
+    """
+    Regenerate the ledger of a stack from its votes, e.g. after an import or
+    for data that predates the ledger, then rebuild the aggregates. The
+    replayed events are dated like the votes.
+    """
+    with transaction.atomic():
+        ReputationEvent.objects.filter(stack_id=stack_id).delete()
+        members = set(StackMembership.objects.filter(stack_id=stack_id).values_list('user_id', flat=True))
+        sources = (
+            (Vote.objects.filter(question__stack_id=stack_id), 'question__asked_by_id', 'question_id', False),
+            (Vote.objects.filter(answer__question__stack_id=stack_id), 'answer__answered_by_id', 'answer__question_id', True),
+        )
+        for votes, owner, question, is_answer in sources:
+            votes = votes.filter(vote_type__in=['up', 'down']).order_by('pk').values_list('pk', 'vote_type', 'user_id', owner, question, 'answer_id', 'created_at')
+            last_pk = 0
+            while True:
+                chunk = list(votes.filter(pk__gt=last_pk)[:chunk_size])
+                if not chunk:
+                    break
+                last_pk = chunk[-1][0]
+                events = []
+                for _, vote_type, voter_id, owner_id, question_id, answer_id, created_at in chunk:
+                    if owner_id is not None:
+                        events += vote_events(vote_type, is_answer, owner_id, voter_id, stack_id=stack_id,
+                                              question_id=question_id, answer_id=answer_id, created_at=created_at)
+                ReputationEvent.objects.bulk_create(
+                    [event for event in events if event.delta and event.user_id in members], batch_size=chunk_size,
+                )
+
+    return rebuild_reputation(stack_id, chunk_size)
+
+
+def reputation_history(stack_id, user_id, days=None):
+    """[(day, change, reputation at the end of the day)] of a member, from the daily rollups"""
+    rollups = ReputationDaily.objects.filter(stack_id=stack_id, user_id=user_id).exclude(delta=0).order_by('day')
+    reputation = 0
+    if days is not None:
+        since = timezone.localdate() - timedelta(days=days)
+        reputation = rollups.filter(day__lt=since).aggregate(total=Sum('delta'))['total'] or 0
+        rollups = rollups.filter(day__gte=since)
+    history = []
+    for day, delta in rollups.values_list('day', 'delta'):
+        reputation += delta
+        history.append((day, delta, reputation))
+    return history
@@ -0,0 +1,242 @@
+"""
+Primary/replica database routing with read-your-writes.
+
+Writes go to the primary, the 'default' database. The reads of a request go
+to one of settings.REPLICA_DATABASES, the same one for the whole request,
+unless the request is pinned to the primary:
+
+- requests with an unsafe method (POST...) read from the primary, so the
+  checks they make before writing see current data;
+- a request that wrote sets a cookie pinning the client to the primary for
+  REPLICA_PIN_SECONDS, so users see their own votes, answers, questions and
+  joined stacks however far behind the replicas are. A cookie rather than
+  the session, since loading the session is itself a read.
+
+Replicas more than REPLICA_MAX_LAG_SECONDS behind, or failing with an
+OperationalError, are left out for REPLICA_RETRY_SECONDS. A GET that 404s or
+fails on a replica, e.g. for a question someone asked a moment ago, is run
+again on the primary. Code running outside of a request (commands, the
+shell) reads from the primary, as it usually writes what it read.
+"""
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = DEFAULT_DB_ALIAS
+PIN_COOKIE = 'db_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+@dataclass
+class RoutingState:
+    """How the reads of the current request are routed"""
+    pinned: bool = False
+    # The replica read from, picked on the first read; PRIMARY when none was usable
+    replica: str | None = None
+    wrote: bool = False
+    failed: bool = False
+
+    @property
+    def read_from_replica(self):
+        return self.replica not in (None, PRIMARY)
+
+
+# Mutated in place, so sync_to_async threads (which get a copy of the context) share it
+routing_state = ContextVar('routing_state', default=None)
+
+
+def replica_aliases():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def replica_lag(alias):
+    """Seconds a replica is behind the primary, 0 when unknown"""
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            # 0 once everything received is replayed, so an idle primary doesn't look like lag
+            cursor.execute(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+            )
+            return float(cursor.fetchone()[0] or 0)
+    if connection.vendor == 'sqlite':
+        # Copied by sync_replica: behind by the writes made to the primary since
+        try:
+            primary = os.path.getmtime(connections[PRIMARY].settings_dict['NAME'])
+            return max(0.0, primary - os.path.getmtime(connection.settings_dict['NAME']))
+        except (OSError, TypeError):
+            return 0.0
+    return 0.0
+
+
+def copy_sqlite_database(alias, source=PRIMARY):
+    """Copy a SQLite database over another, with SQLite's online backup"""
+    for connection in (connections[source], connections[alias]):
+        connection.ensure_connection()
+    connections[source].connection.backup(connections[alias].connection)
+
+
+def may_be_behind(obj, written_at):
+    """Whether obj was read from a replica that may not have a write made at written_at (a timestamp) yet"""
+    if obj._state.db in (None, PRIMARY):
+        return False
+    # Replicas further behind are left out, though only noticed at the next check
+    window = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5) + getattr(settings, 'REPLICA_LAG_CHECK_SECONDS', 5)
+    return time.time() - written_at < window
+
+
+class ReplicaHealth:
+    """Which replicas are fit to read from. Per process, checked at most every REPLICA_LAG_CHECK_SECONDS."""
+
+    def __init__(self):
+        self.checked_at = {}
+        self.down_until = {}
+
+    def available(self):
+        now = time.monotonic()
+        return [alias for alias in replica_aliases() if self.usable(alias, now)]
+
+    def usable(self, alias, now):
+        if self.down_until.get(alias, 0) > now:
+            return False
+        if alias in self.checked_at and now - self.checked_at[alias] < getattr(settings, 'REPLICA_LAG_CHECK_SECONDS', 5):
+            return True
+        self.checked_at[alias] = now
+        try:
+            lag = replica_lag(alias)
+        except OperationalError as e:
+            self.mark_down(alias, f"unreachable ({e})")
+            return False
+        if lag > getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5):
+            self.mark_down(alias, f"{lag:.1f}s behind")
+            return False
+        return True
+
+    def mark_down(self, alias, reason):
+        retry = getattr(settings, 'REPLICA_RETRY_SECONDS', 30)
+        logger.warning("Replica %s is %s, reading from the primary for %ds", alias, reason, retry)
+        self.down_until[alias] = time.monotonic() + retry
+        # Checked again when it comes back
+        self.checked_at.pop(alias, None)
+
+    def reset(self):
+        self.checked_at.clear()
+        self.down_until.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or state.pinned:
+            return PRIMARY
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related objects come from where the instance came from
+            return instance._state.db
+        if state.replica is None:
+            replicas = replica_health.available()
+            state.replica = random.choice(replicas) if replicas else PRIMARY
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db not in replica_aliases()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Should come before SessionMiddleware, so loading the session and the user
+    is routed too, and saving the session counts as a write.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = self.start(request)
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+            if self.should_retry(request, response, state):
+                state.pinned = True
+                response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        token = routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+            if self.should_retry(request, response, state):
+                state.pinned = True
+                response = await self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        return self.finish(request, response, state)
+
+    def process_exception(self, request, exception):
+        state = routing_state.get()
+        if state is not None and state.read_from_replica and isinstance(exception, OperationalError):
+            state.failed = True
+            replica_health.mark_down(state.replica, f"failing ({exception})")
+
+    def start(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        return RoutingState(pinned=request.method not in SAFE_METHODS or pinned_until > time.time())
+
+    def should_retry(self, request, response, state):
+        """Whether a read-only request may have missed rows the replica doesn't have yet"""
+        return (
+            request.method in ('GET', 'HEAD')
+            and state.read_from_replica
+            and not state.wrote
+            and (response.status_code == 404 or state.failed)
+        )
+
+    def finish(self, request, response, state):
+        if state.wrote:
+            pin = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+            response.set_cookie(
+                PIN_COOKIE,
+                f'{time.time() + pin:.3f}',
+                max_age=pin,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
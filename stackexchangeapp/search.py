@@ -0,0 +1,165 @@
+"""
+Full-text search over questions, their tags and their answers.
+
+Every question has one SearchDocument row holding its denormalized text. The
+full-text index over that table is maintained by the database itself, see
+migration 0011_searchdocument: a generated tsvector column with a GIN index on
+PostgreSQL, an FTS5 external-content table kept in sync by triggers on SQLite.
+Backends only differ in how they query it, and are chosen with the
+SEARCH_BACKEND setting (a dotted path) or by the database vendor.
+
+Stack titles have their own full-text index, for the search of the stack
+directory, see migration 0025_directory_search.
+"""
+import math
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Prefetch
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .jobs import task
+from .models import Question, Answer, SearchDocument
+
+# Questions with a high score are boosted, downvoted ones sink
+SCORE_WEIGHT = 0.1
+# Candidates fetched by relevance before re-ranking with the score
+CANDIDATE_FACTOR = 3
+
+
+def words(query):
+    return re.findall(r'\w+', query)
+
+
+class BaseSearchBackend:
+    def search(self, stack_id, query, limit):
+        """Return up to limit (question_id, relevance, score) tuples, best match first"""
+        raise NotImplementedError
+
+    def matching_stacks(self, query):
+        """RawSQL selecting the ids of the stacks whose title has words starting with every word of query"""
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    sql = '''
+        SELECT d.question_id, ts_rank_cd(d.search_vector, query) AS relevance, q.score
+        FROM stackexchangeapp_searchdocument d
+        JOIN stackexchangeapp_question q ON q.id = d.question_id,
+             websearch_to_tsquery('english', %s) query
+        WHERE d.stack_id = %s AND d.search_vector @@ query
+        ORDER BY relevance DESC
+        LIMIT %s
+    '''
+
+    def search(self, stack_id, query, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql, [query, stack_id, limit])
+            return cursor.fetchall()
+
+    def matching_stacks(self, query):
+        # The expression of the stack_title_search_idx index; words only, so no tsquery syntax gets through
+        terms = ' & '.join('%s:*' % word for word in words(query))
+        return RawSQL(
+            "SELECT id FROM stackexchangeapp_stack WHERE to_tsvector('english', title) @@ to_tsquery('english', %s)",
+            [terms],
+        )
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    # Column weights for bm25(): title, tags, body
+    sql = '''
+        SELECT d.question_id, -bm25(stackexchangeapp_searchdocument_fts, 10.0, 5.0, 1.0) AS relevance, q.score
+        FROM stackexchangeapp_searchdocument_fts
+        JOIN stackexchangeapp_searchdocument d ON d.question_id = stackexchangeapp_searchdocument_fts.rowid
+        JOIN stackexchangeapp_question q ON q.id = d.question_id
+        WHERE stackexchangeapp_searchdocument_fts MATCH %s AND d.stack_id = %s
+        ORDER BY relevance DESC
+        LIMIT %s
+    '''
+
+    def terms(self, query):
+        # Quote every word so user input can't use (or break) the FTS5 query syntax
+        return ' '.join('"%s"*' % word for word in words(query))
+
+    def search(self, stack_id, query, limit):
+        terms = self.terms(query)
+        if not terms:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql, [terms, stack_id, limit])
+            return cursor.fetchall()
+
+    def matching_stacks(self, query):
+        return RawSQL(
+            "SELECT rowid FROM stackexchangeapp_stack_fts WHERE stackexchangeapp_stack_fts MATCH %s",
+            [self.terms(query)],
+        )
+
+
+DEFAULT_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_backend():
+    backend_path = getattr(settings, 'SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    return DEFAULT_BACKENDS[connection.vendor]()
+
+
+def score_boost(score):
+    if score >= 0:
+        return 1 + SCORE_WEIGHT * math.log1p(score)
+    return 1 / (1 + SCORE_WEIGHT * math.log1p(-score))
+
+
+def search_questions(stack_id, query, limit=50):
+    """Return the question ids of a stack matching query, ranked by relevance and score"""
+    query = query.strip()
+    if not query:
+        return []
+    rows = get_backend().search(stack_id, query, limit * CANDIDATE_FACTOR)
+    rows = sorted(rows, key=lambda row: row[1] * score_boost(row[2]), reverse=True)
+    return [question_id for question_id, _, _ in rows[:limit]]
+
+
+def matching_stacks(query):
+    """Filter of Stack.pk for the stacks whose title matches query, None when it has no words to search for"""
+    if not words(query):
+        return None
+    return get_backend().matching_stacks(query)
+
+
+def index_questions(question_ids):
+    """(Re)build the search documents of the given questions in three queries"""
+    questions = Question.objects.filter(pk__in=question_ids).prefetch_related(
+        'tags',
+        Prefetch('answer_set', queryset=Answer.objects.only('question_id', 'description')),
+    )
+    documents = [
+        SearchDocument(
+            question=question,
+            stack_id=question.stack_id,
+            title=question.title,
+            tags=' '.join(tag.name for tag in question.tags.all()),
+            body='\n'.join([question.description] + [answer.description for answer in question.answer_set.all()]),
+        )
+        for question in questions
+    ]
+    SearchDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=['question'],
+        update_fields=['stack', 'title', 'tags', 'body', 'updated_at'],
+    )
+    return len(documents)
+
+
+@task('index_question')
+def index_question(question_id):
+    index_questions([question_id])
@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .jobs import enqueue
+from .live import publish_on_commit
+from .models import Question, Answer
+from .notifications import notify_answer
+from .search import index_question
+
+
+def reindex_later(question_id):
+    # Queued with the write, indexed by a worker: see jobs.py and search.index_question
+    enqueue(index_question, dedupe_key=f'index_question:{question_id}', question_id=question_id)
+
+
+@receiver(post_save, sender=Question)
+def index_saved_question(sender, instance, **kwargs):
+    reindex_later(instance.pk)
+
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def index_retagged_question(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Question):
+        reindex_later(instance.pk)
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def index_answered_question(sender, instance, **kwargs):
+    reindex_later(instance.question_id)
+
+
+@receiver(post_save, sender=Answer)
+def announce_answer(sender, instance, created, **kwargs):
+    if created:
+        enqueue(notify_answer, answer_id=instance.pk)
+        publish_on_commit(instance.question_id, {'type': 'answer', 'id': instance.pk})
@@ -0,0 +1,74 @@
+"""
+Tags: name normalization, batched resolution and the per-stack tag cloud.
+
+Tag.question_count is denormalized: QuestionForm.save increments it for the
+tags of a new question, and recount_tags recomputes it from QuestionTag.
+"""
+import math
+import re
+
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Tag, QuestionTag
+
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_tag_names(value):
+    """'Python, django  orm,python,' -> ['python', 'django-orm'], in order of first appearance"""
+    names = []
+    for name in value.split(','):
+        name = WHITESPACE.sub('-', name.strip().lower())
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def resolve_tags(stack_id, names):
+    """
+    The Tags of a stack with these (normalized) names, creating the missing
+    ones: one SELECT, plus an INSERT and a SELECT of what it created when some
+    are new. Tags created concurrently by another request are picked up, not
+    duplicated.
+    """
+    tags = {tag.name: tag for tag in Tag.objects.filter(stack_id=stack_id, name__in=names)}
+    missing = [name for name in names if name not in tags]
+    if missing:
+        Tag.objects.bulk_create([Tag(stack_id=stack_id, name=name) for name in missing], ignore_conflicts=True)
+        tags.update((tag.name, tag) for tag in Tag.objects.filter(stack_id=stack_id, name__in=missing))
+    return [tags[name] for name in names]
+
+
+def tag_question(question, tags):
+    """Tag a new question with resolved tags and count it in their question_count"""
+    question.tags.add(*tags, through_defaults={'created_at': question.created_at})
+    Tag.objects.filter(pk__in=[tag.pk for tag in tags]).update(question_count=F('question_count') + 1)
+
+
+def recount_tags(stack_id=None, check=False):
+    """Recompute question_count of every tag (of a stack). Returns the number of tags that had drifted."""
+    counts = QuestionTag.objects.filter(tag=OuterRef('pk')).order_by().values('tag').annotate(total=Count('pk'))
+    total = Coalesce(Subquery(counts.values('total')), Value(0))
+    tags = Tag.objects.all() if stack_id is None else Tag.objects.filter(stack_id=stack_id)
+    drifted = tags.annotate(total=total).filter(~Q(question_count=F('total')))
+    if check:
+        return drifted.count()
+    return Tag.objects.filter(pk__in=list(drifted.values_list('pk', flat=True))).update(question_count=total)
+
+
+def tag_cloud_queryset(stack_id, limit=40):
+    """The most used tags of a stack, from the (stack, -question_count) index"""
+    return Tag.objects.filter(stack_id=stack_id, question_count__gt=0).order_by('-question_count')[:limit]
+
+
+def tag_cloud(tags, sizes=5):
+    """Sort the tags of tag_cloud_queryset by name and give each a size from 1 to sizes, on a log scale"""
+    if not tags:
+        return []
+    low = math.log(min(tag.question_count for tag in tags))
+    high = math.log(max(tag.question_count for tag in tags))
+    for tag in tags:
+        tag.size = 1 + round((math.log(tag.question_count) - low) / (high - low) * (sizes - 1)) if high > low else 1
+    return sorted(tags, key=lambda tag: tag.name)
@@ -0,0 +1,31 @@
+from django import template
+
+from stackexchangeapp.fragments import render_fragment
+
+register = template.Library()
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, obj, name):
+        self.nodelist = nodelist
+        self.obj = obj
+        self.name = name
+
+    def render(self, context):
+        return render_fragment(self.obj.resolve(context), self.name.resolve(context), lambda: self.nodelist.render(context))
+
+
+@register.tag
+def fragment(parser, token):
+    """
+    {% fragment question 'card' %}...{% endfragment %}
+
+    Cache the enclosed markup per object version, see stackexchangeapp/fragments.py.
+    The block must only depend on the object, never on the current user.
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError("'fragment' takes an object and a fragment name")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
@@ -0,0 +1,25 @@
+"""
+Test runner of the project, see TEST_RUNNER.
+
+Runs the suite with QUERY_BUDGET_STRICT, so every request the tests make
+fails when it runs more queries than its view's query_budget, and without
+REPLICA_DATABASES: the configured replicas are mirrors of the test database
+(TEST MIRROR), which a TestCase may not query unless it declares them, so
+requests read from the primary. ReplicaRoutingTests sets up a replica of its
+own. Views are written as they are counted (VIEW_BUFFER_SIZE=1), so no test
+inherits the views another one left in the buffer of the process;
+ViewCountTests buffers them.
+"""
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(QUERY_BUDGET_STRICT=True, REPLICA_DATABASES=[], VIEW_BUFFER_SIZE=1)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1633 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, connections, router, transaction
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .importer import DumpImporter, post_text
+from .models import User, Stack, StackMembership, Question, Answer, Vote, Tag, ImportRun, ReputationEvent, ReputationDaily, Job, Notification, PendingView
+from .live import get_broker, question_channel
+from .jobs import Worker, claim, enqueue, finish, prune, queue_metrics, requeue_stale, run_jobs, task
+from .instrumentation import QueryBudgetExceeded, QueryBudgetTestMixin, fingerprint
+from .notifications import notify_answer, unread_count, unread_count_key
+from .pagination import InvalidCursor, KeysetPaginator
+from .benchmark import compare, targets
+from .directory import recount_stacks
+from .queryplans import capture_queries, check_plans, plan_issues, plan_scenarios, postgresql_issues, sqlite_issues
+from .ranking import decay_hot_scores, rebuild_hot_scores
+from .rendering import RENDERER_VERSION
+from .reputation import rebuild_reputation, record_events, replay_votes
+from .routing import PIN_COOKIE, copy_sqlite_database, replica_health
+from .search import search_questions
+from .viewcounts import ViewBuffer, flush_views, pending_views, view_buffer
+from .views import HomeView, UpDownVoteView, AcceptAnswerView
+
+
+def call_command_output(*args, **kwargs):
+    stdout = io.StringIO()
+    call_command(*args, stdout=stdout, **kwargs)
+    return stdout.getvalue()
+
+
+class VoteFixtureMixin:
+    def create_vote_fixture(self, voters=1):
+        self.owner = User.objects.create_user('owner', email='owner@example.com', password='pass')
+        self.stack = Stack.objects.create(title='Python', created_by=self.owner)
+        self.voters = [
+            User.objects.create_user(f'voter{i}', email=f'voter{i}@example.com', password='pass')
+            for i in range(voters)
+        ]
+        for user in [self.owner] + self.voters:
+            StackMembership.objects.create(user=user, stack=self.stack)
+        self.question = Question.objects.create(title='Question', description='...', asked_by=self.owner, stack=self.stack)
+        self.answer = Answer.objects.create(description='...', question=self.question, answered_by=self.owner)
+
+    def reputation(self, user):
+        return StackMembership.objects.get(user=user, stack=self.stack).reputation
+
+
+class UpDownVoteViewTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture()
+        self.voter = self.voters[0]
+        self.client.force_login(self.voter)
+
+    def vote(self, vote_type, answer=None):
+        if answer:
+            url = reverse('answer_vote', args=[self.stack.id, self.question.id, answer.id, vote_type])
+        else:
+            url = reverse('question_vote', args=[self.stack.id, self.question.id, vote_type])
+        return self.client.post(url)
+
+    def test_upvote_toggle_and_change(self):
+        self.vote('up')
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.score, self.question.upvotes), (1, 1))
+        self.assertEqual(self.reputation(self.owner), 10)
+
+        self.vote('down')
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.score, self.question.upvotes, self.question.downvotes), (-1, 0, 1))
+        self.assertEqual(self.reputation(self.owner), -2)
+
+        self.vote('down')
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.score, 0)
+        self.assertEqual(self.reputation(self.owner), 0)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_answer_downvote_costs_voter(self):
+        self.vote('down', self.answer)
+        self.answer.refresh_from_db()
+        self.assertEqual(self.answer.score, -1)
+        self.assertEqual(self.reputation(self.owner), -2)
+        self.assertEqual(self.reputation(self.voter), -1)
+
+    def test_cannot_vote_on_own_content(self):
+        self.client.force_login(self.owner)
+        self.vote('up')
+        self.assertFalse(Vote.objects.exists())
+
+    def test_unknown_vote_type(self):
+        self.assertEqual(self.vote('sideways').status_code, 404)
+
+    def test_bounded_queries(self):
+        view = UpDownVoteView()
+        for vote_type in ('up', 'down', 'down', 'up'):
+            with CaptureQueriesContext(connection) as queries:
+                view.cast_vote(self.voter, self.stack.id, self.question.id, vote_type, self.answer.id)
+            # 9 statements (11 with a reputation milestone), plus the SAVEPOINT/RELEASE pair TestCase wraps around atomic()
+            self.assertLessEqual(len(queries), 13)
+
+    def test_membership_required(self):
+        StackMembership.objects.filter(user=self.owner).delete()
+        self.vote('up')
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(self.client.post(reverse('question_vote_json', args=[self.stack.id, self.question.id, 'up'])).status_code, 403)
+
+    def test_interleaved_first_votes(self):
+        """
+        A double submit: the other request inserts the vote after this one
+        found none. Existing votes are read with a row lock, so this is the
+        only interleaving left to the two requests.
+        """
+        view = UpDownVoteView()
+        insert = view._insert_vote
+        concurrent = []
+
+        def insert_after_concurrent_request(*args):
+            if not concurrent:
+                concurrent.append(UpDownVoteView().cast_vote(self.voter, self.stack.id, self.question.id, 'up')['user_vote'])
+            return insert(*args)
+
+        view._insert_vote = insert_after_concurrent_request
+        with CaptureQueriesContext(connection) as queries:
+            # Its insert does nothing, then it finds the other request's vote: toggled off
+            self.assertIsNone(view.cast_vote(self.voter, self.stack.id, self.question.id, 'up')['user_vote'])
+        self.assertEqual(concurrent, ['up'])
+        self.assertFalse(Vote.objects.exists())
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.upvotes, self.question.downvotes, self.question.score), (0, 0, 0))
+        self.assertEqual(self.reputation(self.owner), 0)
+        if connection.features.has_select_for_update:
+            self.assertIn('FOR UPDATE', [q['sql'] for q in queries if 'FROM "stackexchangeapp_vote"' in q['sql']][0])
+
+
+class ReconcileScoresTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=2)
+        view = UpDownVoteView()
+        view.cast_vote(self.voters[0], self.stack.id, self.question.id, 'up')
+        view.cast_vote(self.voters[1], self.stack.id, self.question.id, 'up')
+        view.cast_vote(self.voters[0], self.stack.id, self.question.id, 'down', self.answer.id)
+        self.other = Question.objects.create(title='Other', description='...', asked_by=self.owner, stack=self.stack)
+        Answer.objects.create(description='...', question=self.question, answered_by=self.voters[0])
+        recount_stacks(self.stack.id)
+        call_command_output('reconcile_scores')
+
+    def counters(self):
+        return (
+            list(Question.objects.order_by('pk').values_list('score', 'upvotes', 'downvotes', 'answer_count')),
+            list(Answer.objects.order_by('pk').values_list('score', 'upvotes', 'downvotes')),
+            Stack.objects.values_list('question_count', 'answer_count').get(),
+        )
+
+    def test_drift_is_reported_then_repaired(self):
+        expected = self.counters()
+        self.assertEqual(expected, ([(2, 2, 0, 2), (0, 0, 0, 0)], [(-1, 0, 1), (0, 0, 0)], (2, 2)))
+        Question.objects.filter(pk=self.question.pk).update(score=7, upvotes=1, answer_count=0)
+        Question.objects.filter(pk=self.other.pk).update(downvotes=3)
+        Answer.objects.filter(pk=self.answer.pk).update(score=0, downvotes=0)
+        Stack.objects.update(answer_count=0)
+
+        output = call_command_output('reconcile_scores', '--check', '--chunk-size', '1').splitlines()
+        self.assertEqual(output, ["Question: 2 row(s) drifted", "Answer: 1 row(s) drifted", "Tag: 0 row(s) drifted", "Stack: 1 row(s) drifted"])
+        self.assertNotEqual(self.counters(), expected)
+
+        output = call_command_output('reconcile_scores', '--stack', self.stack.id, '--chunk-size', '1').splitlines()
+        self.assertEqual(output, ["Question: 2 row(s) fixed", "Answer: 1 row(s) fixed", "Tag: 0 row(s) fixed", "Stack: 1 row(s) fixed"])
+        self.assertEqual(self.counters(), expected)
+        self.assertIn("Question: 0 row(s) drifted", call_command_output('reconcile_scores', '--check'))
+
+
+class JsonEndpointTests(QueryBudgetTestMixin, VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture()
+        self.voter = self.voters[0]
+
+    def test_vote_returns_score_and_state(self):
+        self.client.force_login(self.voter)
+        url = reverse('answer_vote_json', args=[self.stack.id, self.question.id, self.answer.id, 'up'])
+        data = self.client.post(url).json()
+        self.assertEqual((data['target'], data['id'], data['score'], data['user_vote']), ('answer', self.answer.id, 1, 'up'))
+        self.assertIsNone(data['accepted_answer_id'])
+        self.assertIsNone(self.client.post(url).json()['user_vote'])
+
+    def test_vote_reads_nothing_after_the_write(self):
+        Question.objects.filter(pk=self.question.pk).update(accepted_answer=self.answer)
+        self.client.force_login(self.voter)
+        response = self.client.post(reverse('question_vote_json', args=[self.stack.id, self.question.id, 'down']))
+        self.assertWithinQueryBudget(response)
+        self.assertEqual(response.json(), {
+            'target': 'question',
+            'id': self.question.id,
+            'user_vote': 'down',
+            'score': -1,
+            'upvotes': 0,
+            'downvotes': 1,
+            'accepted_answer_id': self.answer.id,
+        })
+
+    def test_vote_on_own_post_is_forbidden(self):
+        self.client.force_login(self.owner)
+        response = self.client.post(reverse('question_vote_json', args=[self.stack.id, self.question.id, 'up']))
+        self.assertEqual(response.status_code, 403)
+
+    def test_accept_and_unaccept(self):
+        url = reverse('accept_answer_json', args=[self.stack.id, self.question.id, self.answer.id])
+        self.client.force_login(self.voter)
+        self.assertEqual(self.client.post(url, {'accept': 'True'}).status_code, 403)
+
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.post(url, {'accept': 'True'}).json(), {'accepted_answer_id': self.answer.id})
+        self.assertEqual(self.client.post(url, {'accept': 'False'}).json(), {'accepted_answer_id': None})
+
+
+class AcceptedAnswerTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=2)
+        self.first, self.second = [
+            Answer.objects.create(description='...', question=self.question, answered_by=voter) for voter in self.voters
+        ]
+        self.client.force_login(self.owner)
+
+    def accept(self, answer, accept='True'):
+        url = reverse('accept_answer_json', args=[self.stack.id, self.question.id, answer.id])
+        return self.client.post(url, {'accept': accept}).json()['accepted_answer_id']
+
+    def test_switch(self):
+        self.assertEqual(self.accept(self.first), self.first.id)
+        self.assertEqual(self.accept(self.second), self.second.id)
+        self.assertEqual(self.accept(self.first, 'False'), self.second.id)
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.accepted_answer_id, self.second.id)
+        self.assertEqual(list(Answer.objects.filter(is_accepted=True).values_list('pk', flat=True)), [self.second.id])
+
+        self.assertIsNone(self.accept(self.second, 'False'))
+        self.question.refresh_from_db()
+        self.assertIsNone(self.question.accepted_answer_id)
+
+    def test_one_accepted_answer_per_question(self):
+        self.accept(self.first)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Answer.objects.filter(pk=self.second.pk).update(is_accepted=True)
+
+    def test_answer_order_and_pages(self):
+        Answer.objects.filter(pk=self.answer.pk).update(score=5)
+        Answer.objects.filter(pk=self.second.pk).update(score=5)
+        self.accept(self.first)
+        url = reverse('question_detail', args=[self.stack.id, self.question.id])
+        with mock.patch('stackexchangeapp.views.QuestionDetailView.paginate_answers_by', 2):
+            first = self.client.get(url).context['answers']
+            second = self.client.get(url, {'cursor': first.next_cursor}).context['answers']
+        # Accepted first, then by score, oldest first
+        self.assertEqual([a.pk for a in list(first) + list(second)], [self.first.pk, self.answer.pk, self.second.pk])
+        self.assertFalse(second.has_next)
+        self.assertEqual(self.client.get(url, {'cursor': 'bogus'}).status_code, 404)
+
+
+class KeysetPaginatorTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture()
+        created_at = self.question.created_at
+        for score in (3, 1, 1, 1, 0):
+            Question.objects.create(title=f'Score {score}', description='...', asked_by=self.owner, stack=self.stack, score=score)
+        # Ties on the first column, broken by id
+        self.stack.questions.update(created_at=created_at)
+        self.questions = self.stack.questions.all()
+
+    def pages(self, ordering, per_page):
+        paginator = KeysetPaginator(self.questions, ordering, per_page)
+        pages = [paginator.page()]
+        while pages[-1].has_next:
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return pages
+
+    def test_pages_follow_the_ordering(self):
+        for ordering in (('-score', '-id'), ('score', 'id'), ('-created_at', '-id'), ('created_at', 'title', 'id')):
+            for per_page in (1, 2, 3, 6, 10):
+                with self.subTest(ordering=ordering, per_page=per_page):
+                    pages = self.pages(ordering, per_page)
+                    self.assertEqual([q.pk for page in pages for q in page], list(self.questions.order_by(*ordering).values_list('pk', flat=True)))
+                    self.assertEqual([len(page) for page in pages[:-1]], [per_page] * (len(pages) - 1))
+                    # A full last page has no next one
+                    self.assertIsNone(pages[-1].next_cursor)
+                    self.assertEqual(len(pages), -(-6 // per_page))
+
+    def test_cursor_round_trip(self):
+        paginator = KeysetPaginator(self.questions, ('-created_at', '-score', '-id'), 2)
+        question = Question.objects.first()
+        values = paginator.decode(paginator.encode(question))
+        # Microseconds included, or rows tied to the second would be skipped
+        self.assertEqual(values, [question.created_at, question.score, question.pk])
+        self.assertNotIn('=', paginator.encode(question))
+        self.assertEqual(paginator.decode(paginator.encode({'created_at': question.created_at, 'score': 1, 'id': 2}))[1:], [1, 2])
+
+    def test_invalid_cursors(self):
+        paginator = KeysetPaginator(self.questions, ('-score', '-id'), 2)
+        valid = paginator.page().next_cursor
+        # Garbage, truncated, then the encodings of null, [1,2,3], ["x",1] and {}
+        for cursor in ('bogus', '!!!', valid[:-2], 'bnVsbA', 'WzEsMiwzXQ', 'WyJ4IiwxXQ', 'e30'):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+
+
+class RenderingTests(VoteFixtureMixin, TestCase):
+    body = "Try this:\n\n```python\nprint('<hi>')\n```\n\n<script>alert(1)</script> [a link](javascript:alert(1)) and **more**"
+
+    def setUp(self):
+        cache.clear()
+        self.create_vote_fixture()
+        self.question_url = reverse('question_detail', args=[self.stack.id, self.question.id])
+        self.client.force_login(self.owner)
+
+    def test_rendered_and_sanitized_once(self):
+        self.client.post(reverse('ask_question', args=[self.stack.id]), {
+            'title': 'Markdown', 'description': self.body + ' word' * 40, 'tag_names': 'python',
+        })
+        question = Question.objects.get(title='Markdown')
+        self.client.post(self.question_url, {'description': self.body})
+        answer = Answer.objects.latest('pk')
+        for html in (question.description_html, answer.description_html):
+            self.assertIn('<pre><code class="language-python">print(\'&lt;hi&gt;\')', html)
+            self.assertIn('<strong>more</strong>', html)
+            self.assertNotIn('<script', html)
+            self.assertNotIn('javascript:', html)
+        self.assertEqual((question.render_version, answer.render_version), (RENDERER_VERSION, RENDERER_VERSION))
+        self.assertTrue(question.description_preview.startswith("Try this: print('<hi>') a link and more word"))
+        self.assertEqual(len(question.description_preview.split()), 31)
+
+        with mock.patch('stackexchangeapp.rendering.render_markdown') as render:
+            response = self.client.get(self.question_url)
+            self.client.get(reverse('stack', args=[self.stack.id, self.stack.slug]))
+        render.assert_not_called()
+        self.assertContains(response, '<strong>more</strong>', html=True)
+
+    def test_rerender_older_rows(self):
+        self.question.save(update_fields=['score'])
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.render_version, RENDERER_VERSION)
+        Question.objects.update(description='*new*', render_version=0)
+        # Unrendered rows show their source meanwhile
+        self.assertContains(self.client.get(self.question_url), '*new*')
+
+        self.assertIn("Question: 1 row(s) to render", call_command_output('rerender_bodies', '--check'))
+        with self.captureOnCommitCallbacks(execute=True):
+            output = call_command_output('rerender_bodies', '--chunk-size', '1')
+        self.assertIn("Question: 1 row(s) rendered", output)
+        self.assertIn("Answer: 0 row(s) rendered", output)
+        self.assertEqual(Question.objects.get().description_html, '<p><em>new</em></p>')
+        self.assertContains(self.client.get(self.question_url), '<em>new</em>', html=True)
+        self.assertIn("Answer: 1 row(s) rendered", call_command_output('rerender_bodies', '--force'))
+
+
+@override_settings(VIEW_BUFFER_SIZE=1000, VIEW_BUFFER_SECONDS=3600)
+class ViewCountTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        view_buffer.take()
+        self.addCleanup(view_buffer.take)
+        self.create_vote_fixture(voters=2)
+        self.question_url = reverse('question_detail', args=[self.stack.id, self.question.id])
+
+    def view(self, user, question=None):
+        self.client.force_login(user)
+        url = reverse('question_detail', args=[self.stack.id, question.id]) if question else self.question_url
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_views_are_buffered_then_flushed(self):
+        stack_url = reverse('stack', args=[self.stack.id, self.stack.slug])
+        # Caches the card of the question
+        self.client.force_login(self.owner)
+        self.assertContains(self.client.get(stack_url), '<span>0 views</span>')
+        for user in (self.owner, self.owner, self.voters[0]):
+            self.view(user)
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.view_count, pending_views(self.question.id)), (0, 2))
+        # Still in the buffer of the process: the page views wrote nothing
+        self.assertFalse(PendingView.objects.exists())
+
+        self.assertIn("Applied 2 view(s)", call_command_output('flush_view_counts'))
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.view_count, pending_views(self.question.id)), (2, 0))
+        # The count is outside the cached card, which the flush leaves alone
+        self.assertContains(self.client.get(stack_url), '<span>2 views</span>')
+
+        # Deduplicated per user, and a question viewed again is flushed again
+        self.view(self.voters[0])
+        self.view(self.voters[1])
+        self.assertEqual(flush_views(), 1)
+        self.assertEqual(flush_views(), 0)
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.view_count, 3)
+
+    def test_full_buffer_is_written_then_flushed_by_another_process(self):
+        other = Question.objects.create(title='Other', description='...', asked_by=self.owner, stack=self.stack)
+        with override_settings(VIEW_BUFFER_SIZE=3):
+            self.view(self.owner)
+            self.view(self.owner, other)
+            self.assertFalse(PendingView.objects.exists())
+            with CaptureQueriesContext(connection) as queries:
+                self.view(self.voters[0], other)
+        # One row per question, in one INSERT
+        self.assertEqual(sum(query['sql'].startswith('INSERT INTO "stackexchangeapp_pendingview"') for query in queries.captured_queries), 1)
+        self.assertEqual(sorted(PendingView.objects.values_list('question_id', 'count')), [(self.question.id, 1), (other.id, 2)])
+        # The command has a cache and a buffer of its own, e.g. a locmem one and an empty one
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'flush'}}), \
+                mock.patch('stackexchangeapp.viewcounts.view_buffer', ViewBuffer()):
+            self.assertEqual(flush_views(chunk_size=1), 3)
+        self.assertEqual(list(Question.objects.order_by('pk').values_list('view_count', flat=True)), [1, 2])
+        self.assertFalse(PendingView.objects.exists())
+
+    def test_most_viewed_sort(self):
+        other = Question.objects.create(title='Other', description='...', asked_by=self.owner, stack=self.stack)
+        self.view(self.owner, other)
+        flush_views()
+        response = self.client.get(reverse('stack', args=[self.stack.id, self.stack.slug]), {'sort': 'views'})
+        self.assertEqual([question.id for question in response.context['questions']], [other.id, self.question.id])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('asker', email='asker@example.com', password='pass')
+        self.stack = Stack.objects.create(title='Python', created_by=self.user)
+        other_stack = Stack.objects.create(title='Cooking', created_by=self.user)
+        self.title_match = self.ask(self.stack, 'Decorators explained', 'How do they work?')
+        self.title_match.tags.add(
+            Tag.objects.create(name='functions', stack=self.stack),
+            through_defaults={'created_at': self.title_match.created_at},
+        )
+        self.answer_match = self.ask(self.stack, 'Sorting lists', 'Sort a list of dicts')
+        self.ask(other_stack, 'Decorating cakes', 'Which decorators?')
+        # Indexed by the jobs queued with the writes
+        run_jobs()
+
+    def ask(self, stack, title, description):
+        return Question.objects.create(title=title, description=description, asked_by=self.user, stack=stack)
+
+    def test_search_is_scoped_and_ranked(self):
+        Answer.objects.create(description='Use a decorator with functools', question=self.answer_match, answered_by=self.user)
+        self.answer_match.save()
+        # Both writes reindex the question: queued once
+        self.assertEqual(Job.objects.filter(name='index_question', status='queued').count(), 1)
+        run_jobs()
+        self.assertEqual(search_questions(self.stack.id, 'decorators'), [self.title_match.id, self.answer_match.id])
+        self.assertEqual(search_questions(self.stack.id, 'functions'), [self.title_match.id])
+
+    def test_search_view(self):
+        StackMembership.objects.create(user=self.user, stack=self.stack)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('search', args=[self.stack.id]), {'q': 'sorting "lists'})
+        self.assertEqual([q.id for q in response.context['questions']], [self.answer_match.id])
+
+
+# Tasks for the job queue tests
+recorded_calls = []
+
+
+@task('test_record')
+def record_call(**kwargs):
+    recorded_calls.append(kwargs)
+
+
+@task('test_fail', max_attempts=2)
+def always_fail():
+    raise ValueError("Broken")
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        recorded_calls.clear()
+
+    def test_jobs_are_queued_with_the_write(self):
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                enqueue(record_call, n=1)
+                raise IntegrityError("Rolled back")
+        enqueue(record_call, n=2)
+        self.assertEqual(run_jobs(), 1)
+        self.assertEqual(recorded_calls, [{'n': 2}])
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), ('done', 1))
+
+    def test_dedupe_key(self):
+        for _ in range(3):
+            enqueue(record_call, dedupe_key='key', n=1)
+        self.assertEqual(Job.objects.count(), 1)
+
+        # Started, so queued again: it may have read the state before the last write
+        [job] = claim()
+        enqueue(record_call, dedupe_key='key', n=1)
+        self.assertEqual(Job.objects.filter(status='queued').count(), 1)
+        # Its retry is then left to the queued one
+        finish(job, 'Broken')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertIn('Superseded', job.last_error)
+
+    @override_settings(JOB_RETRY_DELAY_SECONDS=60)
+    def test_retries_with_backoff(self):
+        enqueue(always_fail)
+        with self.assertLogs('stackexchangeapp.jobs', 'ERROR'):
+            self.assertEqual(run_jobs(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('ValueError: Broken', job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(run_jobs(), 0)
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('stackexchangeapp.jobs', 'ERROR'):
+            run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    @override_settings(JOB_TIMEOUT_SECONDS=60)
+    def test_stale_jobs_are_retried(self):
+        enqueue(record_call, n=1)
+        [job] = claim()
+        self.assertEqual(requeue_stale(), 0)
+        Job.objects.update(started_at=timezone.now() - timedelta(seconds=61))
+        with self.assertLogs('stackexchangeapp.jobs', 'WARNING'):
+            self.assertEqual(requeue_stale(), 1)
+        # The worker that lost it can't record its outcome anymore
+        finish(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertIn('Timed out', job.last_error)
+
+    def test_metrics_and_pruning(self):
+        enqueue(record_call, n=1)
+        enqueue(record_call, n=2, delay=3600)
+        run_jobs()
+        metrics = queue_metrics()
+        self.assertEqual(metrics['depth'], {'queued': 1, 'running': 0, 'done': 1, 'failed': 0})
+        self.assertEqual(metrics['oldest_due_seconds'], 0)
+        self.assertEqual(metrics['tasks']['test_record']['done'], 1)
+        self.assertGreaterEqual(metrics['tasks']['test_record']['wait'], 0)
+
+        staff = User.objects.create_user('staff', email='staff@example.com', password='pass', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse('job_metrics')).json()['depth'], metrics['depth'])
+
+        self.assertEqual(prune(), 0)
+        Job.objects.filter(status='done').update(finished_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(prune(), 1)
+
+
+class RunWorkerTests(TransactionTestCase):
+    def setUp(self):
+        recorded_calls.clear()
+
+    def test_burst(self):
+        for n in range(6):
+            enqueue(record_call, n=n)
+        call_command_output('runworker', '--burst', '--concurrency', '3', '--poll-interval', '0.01')
+        self.assertEqual(sorted(call['n'] for call in recorded_calls), list(range(6)))
+        self.assertEqual(Job.objects.filter(status='done').count(), 6)
+        self.assertIn('"done": 6', call_command_output('runworker', '--stats'))
+
+    def test_timed_out_jobs_are_requeued_first(self):
+        # Claimed by a worker that died before recording the outcome
+        enqueue(record_call, n=1)
+        job, = claim()
+        Job.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        with override_settings(JOB_TIMEOUT_SECONDS=60, JOB_RETRY_DELAY_SECONDS=0), self.assertLogs('stackexchangeapp.jobs', 'WARNING'):
+            Worker(poll_interval=0.01, burst=True).run()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, recorded_calls), ('done', 2, [{'n': 1}]))
+
+    def test_database_errors(self):
+        for n in range(6):
+            enqueue(record_call, n=n)
+        failures = {'claim': 2, 'finish': 2}
+        lock = threading.Lock()
+
+        def failing(name, func):
+            def call(*args, **kwargs):
+                with lock:
+                    fail = failures[name] > 0
+                    failures[name] -= 1
+                if fail:
+                    raise OperationalError("database is locked")
+                return func(*args, **kwargs)
+            return call
+
+        with mock.patch('stackexchangeapp.jobs.claim', failing('claim', claim)), \
+                mock.patch('stackexchangeapp.jobs.finish', failing('finish', finish)), \
+                self.assertLogs('stackexchangeapp.jobs', 'WARNING') as logs:
+            Worker(concurrency=3, poll_interval=0.01, burst=True).run()
+        # Every job ran once, and its outcome was recorded despite the errors
+        self.assertEqual(sorted(call['n'] for call in recorded_calls), list(range(6)))
+        self.assertEqual(Job.objects.filter(status='done').count(), 6)
+        # At least the errors raised here; SQLite's in-memory test database also locks for real
+        self.assertGreaterEqual(len([line for line in logs.output if 'Database error' in line]), 4)
+
+
+class NotificationTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.create_vote_fixture(voters=3)
+        self.question_url = reverse('question_detail', args=[self.stack.id, self.question.id])
+
+    def post_answer(self, user):
+        self.client.force_login(user)
+        self.client.post(self.question_url, {'description': f'Answer by {user.username}'})
+        run_jobs()
+        return Answer.objects.filter(answered_by=user).latest('pk')
+
+    def inbox(self, user):
+        return list(Notification.objects.filter(recipient=user).order_by('pk').values_list('kind', 'actor__username'))
+
+    def test_new_answers_notify_the_asker_and_earlier_answerers(self):
+        self.post_answer(self.voters[0])
+        answer = self.post_answer(self.voters[1])
+        self.assertEqual(self.inbox(self.owner), [('answer', 'voter0'), ('answer', 'voter1')])
+        self.assertEqual(self.inbox(self.voters[0]), [('answer', 'voter1')])
+        self.assertEqual(self.inbox(self.voters[1]), [])
+        # A job run twice notifies once
+        notify_answer(answer.pk)
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_fan_out_is_batched(self):
+        for voter in self.voters:
+            Answer.objects.create(description='...', question=self.question, answered_by=voter)
+        latecomer = User.objects.create_user('latecomer', email='latecomer@example.com', password='pass')
+        answer = Answer.objects.create(description='...', question=self.question, answered_by=latecomer)
+        with mock.patch('stackexchangeapp.notifications.BATCH_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            notify_answer(answer.pk)
+        inserts = [query for query in queries if 'INTO "stackexchangeapp_notification"' in query['sql']]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(Notification.objects.filter(answer=answer).count(), 4)
+
+    def test_accept_and_milestones(self):
+        answer = self.post_answer(self.voters[0])
+        self.client.force_login(self.owner)
+        self.client.post(reverse('accept_answer', args=[self.stack.id, self.question.id, answer.id]), {'accept': 'True'})
+        self.assertEqual(self.inbox(self.voters[0]), [('accepted', 'owner')])
+
+        vote_url = reverse('answer_vote', args=[self.stack.id, self.question.id, answer.id, 'up'])
+        self.client.force_login(self.voters[1])
+        self.client.post(vote_url)
+        self.assertEqual(self.inbox(self.voters[0]), [('accepted', 'owner'), ('milestone', None)])
+        self.assertEqual(Notification.objects.get(kind='milestone').reputation, 10)
+
+        # Reached again after losing it: notified once
+        self.client.post(vote_url)
+        self.client.post(vote_url)
+        self.assertEqual(Notification.objects.filter(recipient=self.voters[0], kind='milestone').count(), 1)
+
+    def test_unread_count_is_cached(self):
+        self.post_answer(self.voters[0])
+        self.client.force_login(self.owner)
+        self.assertContains(self.client.get(reverse('inbox')), 'voter0 answered')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('home')).context['unread_notifications'], 1)
+        self.assertFalse([query for query in queries if 'stackexchangeapp_notification' in query['sql']])
+
+        self.post_answer(self.voters[1])
+        self.owner.refresh_from_db()
+        self.assertEqual(unread_count(self.owner), 2)
+        self.client.force_login(self.owner)
+        self.client.post(reverse('inbox'))
+        self.owner.refresh_from_db()
+        self.assertEqual(unread_count(self.owner), 0)
+
+    def test_counts_cached_by_another_process_are_not_served(self):
+        # What a worker notifying can't drop from the cache of a web process
+        cache.set(unread_count_key(self.owner), 0)
+        self.post_answer(self.voters[0])
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(reverse('home')).context['unread_notifications'], 1)
+
+    def test_notifications_change_etags(self):
+        self.client.force_login(self.owner)
+        etag = self.client.get(self.question_url)['ETag']
+        self.post_answer(self.voters[0])
+        self.client.force_login(self.owner)
+        response = self.client.get(self.question_url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['unread_notifications'], 1)
+
+        self.client.post(reverse('inbox'))
+        response = self.client.get(self.question_url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['unread_notifications'], 0)
+
+
+class LiveUpdateTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=1)
+        self.channel = question_channel(self.question.id)
+
+    def published(self, method, url, data=None):
+        self.client.force_login(self.voters[0] if 'vote' in url else self.owner)
+        with mock.patch.object(get_broker(), 'publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            getattr(self.client, method)(url, data)
+        return [event for channel, event in (call.args for call in publish.call_args_list) if channel == self.channel]
+
+    def test_writes_publish_events(self):
+        self.assertEqual(
+            self.published('post', reverse('answer_vote', args=[self.stack.id, self.question.id, self.answer.id, 'up'])),
+            [{'type': 'score', 'target': 'answer', 'id': self.answer.id, 'score': 1, 'upvotes': 1, 'downvotes': 0}],
+        )
+        self.assertEqual(
+            self.published('post', reverse('accept_answer', args=[self.stack.id, self.question.id, self.answer.id]), {'accept': 'True'}),
+            [{'type': 'accept', 'accepted_answer_id': self.answer.id}],
+        )
+        [event] = self.published('post', reverse('question_detail', args=[self.stack.id, self.question.id]), {'description': 'Another'})
+        self.assertEqual(event, {'type': 'answer', 'id': Answer.objects.latest('pk').id})
+
+    @override_settings(LIVE_HEARTBEAT_SECONDS=0.05)
+    async def test_event_stream(self):
+        await self.async_client.aforce_login(self.voters[0])
+        response = await self.async_client.get(reverse('question_events', args=[self.stack.id, self.question.id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        self.assertEqual(get_broker().subscriber_count(self.channel), 1)
+
+        # Published from a thread running a sync view
+        thread = threading.Thread(target=get_broker().publish, args=(self.channel, {'type': 'accept', 'accepted_answer_id': None}))
+        thread.start()
+        self.assertEqual(await anext(stream), b'event: accept\ndata: {"type": "accept", "accepted_answer_id": null}\n\n')
+        thread.join()
+        self.assertEqual(await anext(stream), b': keep-alive\n\n')
+
+        # The server cancels the stream when the client disconnects
+        waiting = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(get_broker().subscriber_count(self.channel), 0)
+
+    async def test_unknown_question(self):
+        await self.async_client.aforce_login(self.voters[0])
+        response = await self.async_client.get(reverse('question_events', args=[self.stack.id, self.question.id + 1]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_pages_subscribe_under_asgi(self):
+        await self.async_client.aforce_login(self.voters[0])
+        response = await self.async_client.get(reverse('question_detail', args=[self.stack.id, self.question.id]))
+        self.assertContains(response, 'new EventSource(')
+
+    def test_no_streams_under_wsgi(self):
+        # Each would hold a worker thread
+        self.client.force_login(self.voters[0])
+        self.assertNotContains(self.client.get(reverse('question_detail', args=[self.stack.id, self.question.id])), 'EventSource')
+        self.assertEqual(self.client.get(reverse('question_events', args=[self.stack.id, self.question.id])).status_code, 404)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, VoteFixtureMixin, TestCase):
+    def setUp(self):
+        # Budgets are for rendering from scratch
+        cache.clear()
+        self.create_vote_fixture(voters=3)
+        tags = [Tag.objects.create(name=f'tag{i}', stack=self.stack) for i in range(3)]
+        for i in range(10):
+            question = Question.objects.create(title=f'Question {i}', description='...', asked_by=self.voters[i % 3], stack=self.stack)
+            question.tags.add(*tags, through_defaults={'created_at': question.created_at})
+        for voter in self.voters:
+            Answer.objects.create(description='...', question=self.question, answered_by=voter)
+        self.client.force_login(self.voters[0])
+
+    def test_fingerprint_groups_parameters(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = \'x\' LIMIT 21'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s) AND name = \'y\'  LIMIT 1'),
+        )
+
+    def test_read_views(self):
+        for url in (
+            reverse('home'),
+            reverse('stack', args=[self.stack.id, self.stack.slug]),
+            reverse('stack', args=[self.stack.id, self.stack.slug]) + '?sort=votes',
+            reverse('stack', args=[self.stack.id, self.stack.slug]) + '?tag=tag0',
+            reverse('question_detail', args=[self.stack.id, self.question.id]),
+            reverse('search', args=[self.stack.id]) + '?q=question',
+        ):
+            with self.subTest(url=url):
+                self.assertWithinQueryBudget(self.client.get(url))
+
+    def test_write_views(self):
+        self.assertWithinQueryBudget(self.client.post(reverse('question_vote', args=[self.stack.id, self.question.id, 'up'])))
+        self.assertWithinQueryBudget(self.client.post(reverse('question_vote_json', args=[self.stack.id, self.question.id, 'down'])))
+
+    def test_over_budget_fails_the_tests(self):
+        with mock.patch.object(HomeView, 'query_budget', 1):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'GET home ran'):
+                self.client.get(reverse('home'))
+            with override_settings(QUERY_BUDGET_STRICT=False), self.assertLogs('stackexchangeapp.instrumentation', 'WARNING'):
+                self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+
+class QueryPlanTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=2)
+        tag = Tag.objects.create(name='python', stack=self.stack, question_count=1)
+        self.question.tags.add(tag, through_defaults={'created_at': self.question.created_at})
+        self.answer = Answer.objects.create(description='...', question=self.question, answered_by=self.voters[1])
+        recount_stacks(self.stack.id)
+
+    def test_sqlite_plans(self):
+        sql = 'SELECT * FROM "stackexchangeapp_answer" INNER JOIN "stackexchangeapp_vote" U0 ON ...'
+        rows = [
+            (2, 0, 0, 'SCAN stackexchangeapp_answer'),
+            (5, 0, 0, 'SEARCH U0 USING INDEX vote_answer_type_idx (answer_id=?)'),
+            (9, 0, 0, 'USE TEMP B-TREE FOR ORDER BY'),
+        ]
+        self.assertEqual(sqlite_issues(rows, sql), [('scan', 'stackexchangeapp_answer'), ('sort', 'stackexchangeapp_answer')])
+        rows = [
+            (3, 0, 0, 'SEARCH stackexchangeapp_answer USING INDEX answer_question_idx (question_id=?)'),
+            (8, 0, 0, 'CORRELATED SCALAR SUBQUERY 1'),
+            (9, 8, 0, 'SEARCH U0 USING INDEX unique_user_answer_vote (user_id=? AND answer_id=?)'),
+            (12, 8, 0, 'USE TEMP B-TREE FOR ORDER BY'),
+        ]
+        # The subquery sorts the one row of a unique lookup
+        self.assertEqual(sqlite_issues(rows, sql, {'unique_user_answer_vote': {'user_id', 'answer_id'}}), [])
+        self.assertEqual(sqlite_issues(rows, sql), [('sort', 'stackexchangeapp_vote')])
+
+    def test_postgresql_plans(self):
+        plan = [{'Plan': {'Node Type': 'Limit', 'Plan Rows': 31, 'Plans': [
+            {'Node Type': 'Sort', 'Plan Rows': 500, 'Plans': [
+                {'Node Type': 'Nested Loop', 'Plan Rows': 500, 'Plans': [
+                    {'Node Type': 'Seq Scan', 'Relation Name': 'stackexchangeapp_question', 'Plan Rows': 500},
+                    {'Node Type': 'Index Scan', 'Relation Name': 'stackexchangeapp_user', 'Plan Rows': 1},
+                ]},
+            ]},
+        ]}}]
+        self.assertEqual(postgresql_issues(plan), [('scan', 'stackexchangeapp_question'), ('sort', 'stackexchangeapp_question')])
+        plan = [{'Plan': {'Node Type': 'Sort', 'Plan Rows': 1, 'Plans': [
+            {'Node Type': 'Index Scan', 'Relation Name': 'stackexchangeapp_vote', 'Plan Rows': 1},
+        ]}}]
+        self.assertEqual(postgresql_issues(plan), [])
+
+    def test_min_rows(self):
+        with capture_queries() as queries:
+            list(Answer.objects.filter(description='...'))
+        self.assertEqual([issue.kind for issue in plan_issues(queries, min_rows=1, strict=True)], ['scan'])
+        self.assertEqual(plan_issues(queries, min_rows=1000, strict=True), [])
+
+    def test_views_use_indexes(self):
+        # Strict on PostgreSQL, whose plans of a tiny database would scan anyway
+        stack, question, answer, user = targets(self.stack.id)
+        self.client.force_login(user)
+        scenarios = plan_scenarios(stack, question, answer)
+        results = check_plans(self.client, scenarios, min_rows=1, strict=True)
+        self.assertEqual(len(results), len(scenarios))
+        for name, issues in results.items():
+            with self.subTest(scenario=name):
+                self.assertEqual(issues, [], '\n\n'.join(map(str, issues)))
+        self.assertEqual(Answer.objects.count(), 2)
+
+
+class BenchmarkTests(VoteFixtureMixin, TestCase):
+    def test_seed_data(self):
+        output = call_command_output('seed_data', '--stacks', 1, '--users', 6, '--questions', 4, '--tags', 3, '--days', 1)
+        self.assertIn("6 users", output)
+        self.assertEqual(Question.objects.count(), 4)
+        # The counters written with the rows match the rows
+        self.assertEqual(
+            call_command_output('reconcile_scores', '--check').splitlines(),
+            ["Question: 0 row(s) drifted", "Answer: 0 row(s) drifted", "Tag: 0 row(s) drifted", "Stack: 0 row(s) drifted"],
+        )
+        stack, question, answer, user = targets(None)
+        self.assertEqual(question.stack, stack)
+        self.assertNotEqual(user, question.asked_by)
+
+    def test_targets_of_empty_database(self):
+        with self.assertRaisesMessage(CommandError, "run seed_data first"):
+            targets(None)
+
+    def test_benchmark(self):
+        cache.clear()
+        self.create_vote_fixture(voters=1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchmark.json')
+            call_command_output('benchmark', '--requests', 1, '--warmup', 0, '--stack', self.stack.id, '--output', path)
+            with open(path) as f:
+                results = json.load(f)
+        self.assertEqual(
+            set(results['scenarios']),
+            {'home', 'stack_newest', 'stack_votes', 'question_detail', 'question_vote', 'ask_question'},
+        )
+        self.assertEqual(results['scenarios']['question_detail']['requests'], 1)
+        # Write scenarios are rolled back, and reads are not recorded as views
+        self.assertEqual((Question.objects.count(), Vote.objects.count()), (1, 0))
+        self.assertEqual(pending_views(self.question.id), 0)
+
+    def test_compare(self):
+        baseline = {'scenarios': {
+            'home': {'p50_ms': 10, 'p95_ms': 20, 'p99_ms': 30, 'peak_memory_kb': 100, 'max_queries': 5},
+            'gone': {'p50_ms': 10},
+        }}
+        results = {'scenarios': {
+            'home': {'p50_ms': 11, 'p95_ms': 25, 'p99_ms': 30, 'peak_memory_kb': 100, 'max_queries': 6},
+            'new': {'p50_ms': 99, 'p95_ms': 99, 'p99_ms': 99, 'peak_memory_kb': 99, 'max_queries': 99},
+        }}
+        self.assertEqual(compare(results, baseline), ["home: p95_ms 20 -> 25", "home: max_queries 5 -> 6"])
+        self.assertEqual(compare(results, baseline, threshold=0.5), ["home: max_queries 5 -> 6"])
+        self.assertEqual(compare(results, {}), [])
+
+
+class FragmentCacheTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.create_vote_fixture(voters=2)
+        self.stack_url = reverse('stack', args=[self.stack.id, self.stack.slug])
+        self.question_url = reverse('question_detail', args=[self.stack.id, self.question.id])
+
+    def vote(self, user, answer=None):
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            if answer:
+                self.client.post(reverse('answer_vote', args=[self.stack.id, self.question.id, answer.id, 'up']))
+            else:
+                self.client.post(reverse('question_vote', args=[self.stack.id, self.question.id, 'up']))
+
+    def test_fragments_are_shared_and_invalidated(self):
+        for backend in ('locmem.LocMemCache', 'filebased.FileBasedCache'):
+            with self.subTest(backend=backend), tempfile.TemporaryDirectory() as location, override_settings(CACHES={
+                'default': {'BACKEND': f'django.core.cache.backends.{backend}', 'LOCATION': location},
+            }):
+                Vote.objects.all().delete()
+                Question.objects.update(score=0, upvotes=0, downvotes=0)
+                self.client.force_login(self.voters[0])
+                cold = self.client.get(self.stack_url)
+                # Second time the card comes from the cache, without the tag query, and so does the unread count
+                self.assertEqual(self.client.get(self.stack_url).query_count, cold.query_count - 2)
+
+                self.vote(self.voters[0])
+                response = self.client.get(self.stack_url)
+                self.assertEqual(response.context['questions'].object_list[0].fragments['card'].count('>1<'), 1)
+
+    def test_user_vote_is_not_cached(self):
+        self.client.force_login(self.voters[0])
+        self.client.get(self.question_url)
+        self.vote(self.voters[0], self.answer)
+        self.assertContains(self.client.get(self.question_url), 'data-vote-for="answer-%d" data-vote-type="up"\n                                class="text-orange-500' % self.answer.id)
+        self.client.force_login(self.voters[1])
+        self.assertContains(self.client.get(self.question_url), 'data-vote-for="answer-%d" data-vote-type="up"\n                                class="text-gray-400' % self.answer.id)
+
+    def test_new_answer_invalidates_question(self):
+        self.client.force_login(self.voters[0])
+        self.client.get(self.stack_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.question_url, {'description': 'Another answer'})
+        card = self.client.get(self.stack_url).context['questions'].object_list[0].fragments['card']
+        self.assertRegex(card, r'>1</div>\s*<div class="text-xs">answers')
+
+
+class ConditionalGetTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=2)
+        self.stack_url = reverse('stack', args=[self.stack.id, self.stack.slug])
+        self.question_url = reverse('question_detail', args=[self.stack.id, self.question.id])
+        self.client.force_login(self.voters[0])
+
+    def test_not_modified_after_one_lookup(self):
+        for url in (self.stack_url, self.question_url):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                # Session, user, then the validators
+                with self.assertNumQueries(3):
+                    cached = self.client.get(url, headers={'If-None-Match': response['ETag']})
+                self.assertEqual(cached.status_code, 304)
+                cached = self.client.get(url, headers={'If-Modified-Since': response['Last-Modified']})
+                self.assertEqual(cached.status_code, 304)
+
+    def test_writes_change_validators(self):
+        etags = {url: self.client.get(url)['ETag'] for url in (self.stack_url, self.question_url)}
+        self.client.post(reverse('answer_vote', args=[self.stack.id, self.question.id, self.answer.id, 'up']))
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_decays_and_view_flushes_change_validators(self):
+        rebuild_hot_scores(self.stack.id)
+        etag = self.client.get(self.stack_url)['ETag']
+        decay_hot_scores(self.stack.id, now=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self.client.get(self.stack_url, headers={'If-None-Match': etag}).status_code, 200)
+
+        cache.clear()
+        etags = {url: self.client.get(url)['ETag'] for url in (self.stack_url, self.question_url)}
+        self.assertEqual(flush_views(), 1)
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_validators_vary_per_user(self):
+        response = self.client.get(self.question_url)
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(self.question_url, headers={'If-None-Match': response['ETag']}).status_code, 200)
+
+
+class AsyncViewTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=2)
+
+    async def test_async_pages(self):
+        await self.async_client.aforce_login(self.voters[0])
+        urls = [
+            reverse('home'),
+            reverse('stack', args=[self.stack.id, self.stack.slug]),
+            reverse('question_detail', args=[self.stack.id, self.question.id]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                if 'ETag' in response:
+                    cached = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+                    self.assertEqual(cached.status_code, 304)
+        self.assertContains(response, self.answer.description)
+
+    async def test_login_required(self):
+        response = await self.async_client.get(reverse('stack', args=[self.stack.id, self.stack.slug]))
+        self.assertEqual(response.status_code, 302)
+
+
+class ReputationLedgerTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=2)
+        self.accepted = Answer.objects.create(description='...', question=self.question, answered_by=self.voters[1])
+
+    def act(self):
+        view = UpDownVoteView()
+        view.cast_vote(self.voters[0], self.stack.id, self.question.id, 'up')
+        view.cast_vote(self.voters[0], self.stack.id, self.question.id, 'down')
+        view.cast_vote(self.voters[0], self.stack.id, self.question.id, 'down', self.answer.id)
+        view.cast_vote(self.voters[0], self.stack.id, self.question.id, 'up', self.accepted.id)
+
+    def totals(self):
+        return {user.username: self.reputation(user) for user in [self.owner] + self.voters}
+
+    def test_ledger_matches_totals(self):
+        self.act()
+        expected = {'owner': -2 - 2, 'voter0': -1, 'voter1': 10}
+        self.assertEqual(self.totals(), expected)
+        for user in [self.owner] + self.voters:
+            self.assertEqual(sum(ReputationEvent.objects.filter(user=user).values_list('delta', flat=True)), expected[user.username])
+
+        # Retracting a vote appends compensating events
+        UpDownVoteView().cast_vote(self.voters[0], self.stack.id, self.question.id, 'up', self.accepted.id)
+        self.assertEqual(self.totals(), dict(expected, voter1=0))
+        self.assertEqual(ReputationEvent.objects.filter(user=self.voters[1]).count(), 2)
+
+    def test_accepts_earn_nothing(self):
+        AcceptAnswerView().toggle_accept(self.owner, self.stack.id, self.question.id, self.accepted.id, 'True')
+        self.assertEqual(self.totals(), {'owner': 0, 'voter0': 0, 'voter1': 0})
+        self.assertFalse(ReputationEvent.objects.exists())
+
+    def test_only_members_earn_reputation(self):
+        self.act()
+        StackMembership.objects.filter(user=self.voters[1]).delete()
+        with transaction.atomic():
+            record_events(self.stack.id, [ReputationEvent(user=self.voters[1], delta=10, reason='upvote')])
+        self.assertEqual(ReputationEvent.objects.filter(user=self.voters[1]).count(), 1)
+        self.assertEqual(ReputationDaily.objects.get(user=self.voters[1]).delta, 10)
+
+        # Replayed by the same rule
+        expected = {user.username: self.reputation(user) for user in [self.owner, self.voters[0]]}
+        replay_votes(self.stack.id)
+        self.assertFalse(ReputationEvent.objects.filter(user=self.voters[1]).exists())
+        self.assertEqual({user.username: self.reputation(user) for user in [self.owner, self.voters[0]]}, expected)
+        self.assertEqual(rebuild_reputation(self.stack.id, check=True), 0)
+
+    def test_rebuild_and_replay(self):
+        self.act()
+        expected = self.totals()
+        StackMembership.objects.update(reputation=0)
+        self.assertEqual(rebuild_reputation(self.stack.id, chunk_size=2, check=True), 3)
+        self.assertEqual(rebuild_reputation(self.stack.id, chunk_size=2), 3)
+        self.assertEqual(self.totals(), expected)
+
+        ReputationEvent.objects.all().delete()
+        replay_votes(self.stack.id)
+        self.assertEqual(self.totals(), expected)
+
+    def test_history(self):
+        self.act()
+        self.client.force_login(self.voters[1])
+        history = self.client.get(reverse('reputation_history', args=[self.stack.id]), {'days': 30}).json()['history']
+        self.assertEqual([(row['change'], row['reputation']) for row in history], [(10, 10)])
+
+
+class TagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('asker', email='asker@example.com', password='pass')
+        self.stack = Stack.objects.create(title='Python', created_by=self.user)
+        StackMembership.objects.create(user=self.user, stack=self.stack)
+        Tag.objects.create(name='python', stack=self.stack)
+        self.client.force_login(self.user)
+
+    def ask(self, title, tag_names):
+        return self.client.post(reverse('ask_question', args=[self.stack.id]), {
+            'title': title, 'description': '...', 'tag_names': tag_names,
+        })
+
+    def test_tags_resolved_in_one_batch(self):
+        for tag_names in ('python, a', ' Python, django  ORM,python,, b, c, d'):
+            with self.subTest(tag_names=tag_names), CaptureQueriesContext(connection) as queries:
+                self.ask('Question', tag_names)
+            tag_queries = [q['sql'] for q in queries if 'stackexchangeapp_tag' in q['sql'] or 'question_tags' in q['sql']]
+            # Look up, create the missing, look them up, one add (look up, insert) and the counts
+            self.assertLessEqual(len(tag_queries), 6, tag_queries)
+
+        question = Question.objects.latest('pk')
+        self.assertEqual(sorted(question.tags.values_list('name', flat=True)), ['b', 'c', 'd', 'django-orm', 'python'])
+        counts = dict(Tag.objects.values_list('name', 'question_count'))
+        self.assertEqual(counts, {'python': 2, 'a': 1, 'django-orm': 1, 'b': 1, 'c': 1, 'd': 1})
+        self.assertIn("Tag: 0 row(s) drifted", call_command_output('reconcile_scores', check=True).splitlines())
+
+    def test_questions_are_saved_with_their_tags_or_not_at_all(self):
+        with mock.patch('stackexchangeapp.forms.tag_question', side_effect=IntegrityError), self.assertRaises(IntegrityError):
+            self.ask('Half asked', 'python, new-tag')
+        self.assertFalse(Question.objects.exists())
+        self.assertFalse(Tag.objects.filter(name='new-tag').exists())
+        self.assertEqual(Stack.objects.get(pk=self.stack.pk).question_count, 0)
+
+    def test_invalid_tags(self):
+        self.assertFormError(self.ask('Question', ' , ').context['form'], 'tag_names', "Enter at least one tag.")
+        self.assertFalse(Question.objects.exists())
+
+    def test_tag_listing_and_cloud(self):
+        for title, tag_names in (('First', 'python'), ('Second', 'python, orm'), ('Third', 'orm')):
+            self.ask(title, tag_names)
+        url = reverse('stack', args=[self.stack.id, self.stack.slug])
+        for params, titles in (
+            ({'tag': 'python'}, ['Second', 'First']),
+            ({'tag': 'python', 'sort': 'votes'}, ['Second', 'First']),
+            ({'tag': 'orm', 'sort': 'unanswered'}, ['Third', 'Second']),
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual([q.title for q in response.context['questions']], titles)
+        self.assertEqual([(tag.name, tag.question_count) for tag in response.context['tag_cloud']], [('orm', 2), ('python', 2)])
+        self.assertEqual(self.client.get(url, {'tag': 'missing'}).status_code, 404)
+
+    def test_tag_listing_pages(self):
+        for i in range(3):
+            self.ask(f'Question {i}', 'python')
+        url = reverse('stack', args=[self.stack.id, self.stack.slug])
+        with mock.patch('stackexchangeapp.views.StackDetailView.paginate_by', 2):
+            first = self.client.get(url, {'tag': 'python'}).context['page']
+            second = self.client.get(url, {'tag': 'python', 'cursor': first.next_cursor}).context['page']
+        self.assertEqual([q.title for q in list(first) + list(second)], ['Question 2', 'Question 1', 'Question 0'])
+        self.assertFalse(second.has_next)
+
+
+class StackDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('member', email='member@example.com', password='pass')
+        self.client.force_login(self.user)
+
+    def create_stacks(self, count):
+        now = timezone.now()
+        Stack.objects.bulk_create([
+            Stack(title=f'Stack {i}', slug=f'stack-{i}', member_count=i, last_activity_at=now - timedelta(minutes=i))
+            for i in range(Stack.objects.count(), Stack.objects.count() + count)
+        ])
+
+    def test_counters(self):
+        self.client.post(reverse('create_stack'), {'title': 'Python', 'description': '...'})
+        stack = Stack.objects.get()
+        other = User.objects.create_user('other', email='other@example.com', password='pass')
+        self.client.force_login(other)
+        self.client.post(reverse('join_stack', args=[stack.id]))
+        self.client.post(reverse('join_stack', args=[stack.id]))
+        self.client.post(reverse('ask_question', args=[stack.id]), {'title': 'Question', 'description': '...', 'tag_names': 'python'})
+        question = Question.objects.get()
+        self.client.post(reverse('question_detail', args=[stack.id, question.id]), {'description': '...'})
+        stack.refresh_from_db()
+        self.assertEqual((stack.member_count, stack.question_count, stack.answer_count), (2, 1, 1))
+
+        self.client.post(reverse('leave_stack', args=[stack.id]))
+        self.client.post(reverse('leave_stack', args=[stack.id]))
+        stack.refresh_from_db()
+        self.assertEqual(stack.member_count, 1)
+        self.assertIn("Stack: 0 row(s) drifted", call_command_output('reconcile_scores', check=True).splitlines())
+
+    def test_constant_queries(self):
+        self.create_stacks(5)
+        self.client.get(reverse('home'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('home'))
+        self.create_stacks(100)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('home'))
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.context['stacks']), HomeView.paginate_by)
+        self.assertTrue(response.context['page'].has_next)
+
+    def test_sort_search_and_pages(self):
+        self.create_stacks(5)
+        url = reverse('home')
+        for params, titles in (
+            ({}, ['Stack 0', 'Stack 1', 'Stack 2', 'Stack 3', 'Stack 4']),
+            ({'sort': 'size'}, ['Stack 4', 'Stack 3', 'Stack 2', 'Stack 1', 'Stack 0']),
+            ({'q': 'stack 3'}, ['Stack 3']),
+        ):
+            with self.subTest(params=params):
+                self.assertEqual([stack.title for stack in self.client.get(url, params).context['stacks']], titles)
+        with mock.patch('stackexchangeapp.views.HomeView.paginate_by', 3):
+            first = self.client.get(url, {'sort': 'size'}).context['page']
+            second = self.client.get(url, {'sort': 'size', 'cursor': first.next_cursor}).context['page']
+        self.assertEqual([stack.title for stack in second], ['Stack 1', 'Stack 0'])
+        self.assertEqual(self.client.get(url, {'cursor': 'bogus'}).status_code, 404)
+
+    def test_joined_stacks_cached_until_join_or_leave(self):
+        self.create_stacks(2)
+        stack = Stack.objects.get(title='Stack 1')
+        url = reverse('home')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).context['joined_stacks_ids'], set())
+        self.assertFalse([q for q in queries if 'stackmembership' in q['sql']])
+
+        self.client.post(reverse('join_stack', args=[stack.id]))
+        self.assertEqual(self.client.get(url).context['joined_stacks_ids'], {stack.id})
+        self.client.post(reverse('leave_stack', args=[stack.id]))
+        self.assertEqual(self.client.get(url).context['joined_stacks_ids'], set())
+        # The entries of older versions are left to expire, and never read again
+        self.assertEqual(cache.get(f'joined-stacks:{self.user.pk}:0'), [])
+        self.assertEqual(cache.get(f'joined-stacks:{self.user.pk}:1'), [stack.id])
+
+    def test_search_titles(self):
+        self.create_stacks(3)
+        Stack.objects.create(title='Cooking & baking', created_by=self.user)
+        Stack.objects.filter(title='Stack 2').update(title='Python help')
+
+        def search(query):
+            return sorted(stack.title for stack in self.client.get(reverse('home'), {'q': query}).context['stacks'])
+
+        self.assertEqual(search('stac'), ['Stack 0', 'Stack 1'])
+        self.assertEqual(search('bake cook'), ['Cooking & baking'])
+        self.assertEqual(search('python'), ['Python help'])
+        self.assertEqual(search('stack 2'), [])
+        self.assertEqual(search('"&*'), [])
+        Stack.objects.filter(title='Python help').delete()
+        self.assertEqual(search('python'), [])
+
+
+class ApiTests(QueryBudgetTestMixin, VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=2)
+        self.tags = [Tag.objects.create(name=f'tag{i}', stack=self.stack) for i in range(3)]
+        self.questions = [self.question]
+        for i in range(6):
+            question = Question.objects.create(title=f'Question {i}', description='...', asked_by=self.voters[i % 2], stack=self.stack)
+            question.tags.add(*self.tags[:i % 3 + 1], through_defaults={'created_at': question.created_at})
+            Answer.objects.create(description='...', question=question, answered_by=self.owner)
+            self.questions.append(question)
+        self.client.force_login(self.voters[0])
+
+    def get(self, name, *args, **params):
+        response = self.client.get(reverse(name, args=args), params)
+        self.assertWithinQueryBudget(response)
+        return response
+
+    def test_fields_and_pagination(self):
+        url_args = ('api_questions', self.stack.id)
+        page = self.get(*url_args, fields='title,score', limit=4).json()
+        self.assertEqual(page['results'][0], {'title': 'Question 5', 'score': 0})
+        seen = [row['title'] for row in page['results']]
+        while page['next_cursor']:
+            page = self.get(*url_args, fields='title', limit=4, cursor=page['next_cursor']).json()
+            seen += [row['title'] for row in page['results']]
+        self.assertEqual(seen, [q.title for q in reversed(self.questions)])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get(*url_args, fields='title', limit=4)
+        page_sql = [q['sql'] for q in queries if 'FROM "stackexchangeapp_question"' in q['sql']][-1]
+        self.assertNotIn('description', page_sql)
+
+    def test_embeds_in_fixed_queries(self):
+        counts = []
+        for limit in (2, 7):
+            with CaptureQueriesContext(connection) as queries:
+                results = self.get('api_questions', self.stack.id, embed='asked_by,tags', limit=limit).json()['results']
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(results[0]['asked_by'], {'id': self.voters[1].id, 'username': 'voter1'})
+        self.assertEqual(results[0]['tags'], [{'id': tag.id, 'name': tag.name} for tag in self.tags])
+
+        answers = self.get('api_question_answers', self.stack.id, self.questions[1].id, embed='answered_by').json()['results']
+        self.assertEqual([answer['answered_by']['username'] for answer in answers], ['owner'])
+
+    def test_resources(self):
+        self.assertEqual(self.get('api_stack', self.stack.id, fields='title').json(), {'title': 'Python'})
+        self.assertEqual(len(self.get('api_stacks').json()['results']), 1)
+        self.assertEqual(self.get('api_question', self.stack.id, self.question.id, fields='id').json(), {'id': self.question.id})
+        self.assertEqual(self.get('api_answer', self.stack.id, self.answer.id, fields='question').json(), {'question': self.question.id})
+        tags = self.get('api_tags', self.stack.id, fields='name').json()['results']
+        self.assertEqual(len(tags), 3)
+        members = self.get('api_members', self.stack.id, embed='user').json()['results']
+        self.assertEqual({m['user']['username'] for m in members}, {'owner', 'voter0', 'voter1'})
+        memberships = self.get('api_memberships', embed='stack').json()['results']
+        self.assertEqual([m['stack']['title'] for m in memberships], ['Python'])
+
+        tagged = self.get('api_questions', self.stack.id, tag='tag2', fields='title').json()['results']
+        self.assertEqual([q['title'] for q in tagged], ['Question 5', 'Question 2'])
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(reverse('api_questions', args=[self.stack.id]), {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_questions', args=[self.stack.id]), {'cursor': 'junk'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_questions', args=[self.stack.id]), {'limit': 1000}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_question', args=[self.stack.id, 0])).status_code, 404)
+        other = Stack.objects.create(title='Other', created_by=self.owner)
+        self.assertEqual(self.client.get(reverse('api_tags', args=[other.id])).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_stacks')).status_code, 403)
+
+
+class ExportTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=2)
+        UpDownVoteView().cast_vote(self.voters[0], self.stack.id, self.question.id, 'up')
+        UpDownVoteView().cast_vote(self.voters[1], self.stack.id, self.question.id, 'down', self.answer.id)
+        self.question.tags.add(Tag.objects.create(name='python', stack=self.stack), through_defaults={'created_at': self.question.created_at})
+        self.staff = User.objects.create_user('staff', email='staff@example.com', password='pass', is_staff=True)
+        self.url = reverse('export_stack', args=[self.stack.id])
+
+    def test_jsonl(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        tables = [row['table'] for row in rows]
+        self.assertEqual(tables, ['questions', 'answers', 'votes', 'votes', 'tags', 'question_tags'] + ['memberships'] * 3)
+        self.assertEqual(rows[0]['title'], 'Question')
+        self.assertEqual({row['vote_type'] for row in rows if row['table'] == 'votes'}, {'up', 'down'})
+
+    def test_csv_gzip(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, {'format': 'csv', 'table': 'memberships', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        text = gzip.decompress(b''.join(response.streaming_content)).decode()
+        rows = list(csv.DictReader(io.StringIO(text)))
+        self.assertEqual({row['user__username'] for row in rows}, {'owner', 'voter0', 'voter1'})
+        self.assertEqual(self.client.get(self.url, {'format': 'csv'}).status_code, 400)
+
+    async def test_streamed_under_asgi(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(self.url, {'table': 'answers'})
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(json.loads(content)['id'], self.answer.id)
+
+    def test_staff_only(self):
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('export_stack', self.stack.id, format='csv', output=directory, gzip=True, chunk_size=1, stderr=io.StringIO())
+            with gzip.open(os.path.join(directory, 'votes.csv.gz'), 'rt') as f:
+                self.assertEqual(len(list(csv.DictReader(f))), 2)
+        jsonl = call_command_output('export_stack', self.stack.id, table='tags')
+        self.assertEqual(json.loads(jsonl)['name'], 'python')
+
+
+class HotScoreTests(VoteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_vote_fixture(voters=2)
+        self.client.force_login(self.voters[0])
+
+    def hot_score(self, question=None):
+        return Question.objects.get(pk=(question or self.question).pk).hot_score
+
+    def test_writes_add_points(self):
+        self.client.post(reverse('question_vote', args=[self.stack.id, self.question.id, 'up']))
+        self.assertEqual(self.hot_score(), 1)
+        self.client.post(reverse('question_vote', args=[self.stack.id, self.question.id, 'down']))
+        self.assertEqual(self.hot_score(), -1)
+        self.client.post(reverse('question_detail', args=[self.stack.id, self.question.id]), {'description': 'An answer'})
+        self.assertEqual(self.hot_score(), 1)
+
+    @override_settings(HOT_HALF_LIFE_HOURS=1)
+    def test_decay_and_rebuild(self):
+        now = timezone.now()
+        Question.objects.filter(pk=self.question.pk).update(created_at=now - timedelta(hours=2))
+        Answer.objects.filter(pk=self.answer.pk).update(created_at=now - timedelta(hours=1))
+        Vote.objects.create(user=self.voters[0], question=self.question, vote_type='up', created_at=now)
+        cold = Question.objects.create(title='Cold', description='...', asked_by=self.owner, stack=self.stack)
+        Question.objects.filter(pk=cold.pk).update(created_at=now - timedelta(hours=6))
+
+        self.assertIsNone(decay_hot_scores(self.stack.id, now=now))
+        rebuild_hot_scores(self.stack.id, chunk_size=1, now=now)
+        self.assertAlmostEqual(self.hot_score(), 0.25 + 1 + 1)
+        self.assertAlmostEqual(self.hot_score(cold), 2 ** -6)
+
+        # One half-life later the warm question is halved and the cold one floored and left alone
+        self.assertEqual(decay_hot_scores(self.stack.id, now=now + timedelta(hours=1)), 2)
+        self.assertAlmostEqual(self.hot_score(), 1.125)
+        self.assertEqual(self.hot_score(cold), 0)
+        self.assertEqual(decay_hot_scores(self.stack.id, now=now + timedelta(hours=2)), 1)
+
+    def test_hot_listing(self):
+        hot = Question.objects.create(title='Hot', description='...', asked_by=self.owner, stack=self.stack, hot_score=5)
+        response = self.client.get(reverse('stack', args=[self.stack.id, self.stack.slug]), {'sort': 'hot'})
+        self.assertEqual([q.pk for q in response.context['questions']], [hot.pk, self.question.pk])
+
+
+class ImporterTests(TestCase):
+    dump = {
+        'Tags.xml': ['<row Id="1" TagName="python" />'],
+        'Users.xml': [
+            '<row Id="5" DisplayName="Alice Smith" CreationDate="2010-01-02T00:00:00.000" />',
+            '<row Id="7" DisplayName="Bob" CreationDate="2010-01-03T00:00:00.000" />',
+        ],
+        'Posts.xml': [
+            '<row Id="10" PostTypeId="1" AcceptedAnswerId="12" CreationDate="2011-01-01T10:00:00.000" Title="Why &amp; how?"'
+            ' Body="&lt;p&gt;Fish &amp;amp; chips&lt;/p&gt;" OwnerUserId="5" Tags="&lt;python&gt;&lt;new-tag&gt;" />',
+            '<row Id="11" PostTypeId="2" ParentId="10" CreationDate="2011-01-02T10:00:00.000" Body="first" OwnerUserId="7" />',
+            '<row Id="12" PostTypeId="2" ParentId="10" CreationDate="2011-01-03T10:00:00.000" Body="second" />',
+            '<row Id="13" PostTypeId="2" ParentId="99" CreationDate="2011-01-03T10:00:00.000" Body="orphan" />',
+        ],
+        'Votes.xml': [
+            '<row Id="1" PostId="10" VoteTypeId="2" CreationDate="2011-01-05T00:00:00.000" />',
+            '<row Id="2" PostId="10" VoteTypeId="2" CreationDate="2011-01-05T00:00:00.000" />',
+            '<row Id="3" PostId="11" VoteTypeId="3" CreationDate="2011-01-05T00:00:00.000" />',
+            '<row Id="4" PostId="12" VoteTypeId="1" CreationDate="2011-01-05T00:00:00.000" />',
+            '<row Id="5" PostId="10" VoteTypeId="3" CreationDate="2011-01-05T00:00:00.000" />',
+        ],
+    }
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        for filename, rows in self.dump.items():
+            with open(os.path.join(self.directory.name, filename), 'w') as f:
+                f.write('<?xml version="1.0" encoding="utf-8"?>\n<rows>\n%s\n</rows>\n' % '\n'.join(rows))
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+
+    def test_import(self):
+        call_command('import_stackexchange', self.directory.name, batch_size=2, stdout=io.StringIO())
+        question = Question.objects.get()
+        self.assertEqual((question.title, question.description), ('Why & how?', 'Fish & chips'))
+        self.assertEqual(question.asked_by.first_name, 'Alice Smith')
+        self.assertEqual(sorted(question.tags.values_list('name', flat=True)), ['new-tag', 'python'])
+        self.assertEqual((question.upvotes, question.downvotes, question.score, question.answer_count), (2, 1, 1, 2))
+        self.assertEqual(list(question.answer_set.order_by('created_at').values_list('is_accepted', 'score')), [(False, -1), (True, 0)])
+
+        stack = question.stack
+        self.assertEqual(stack.title, os.path.basename(self.directory.name)[:30])
+        reputation = dict(StackMembership.objects.filter(stack=stack).values_list('user__first_name', 'reputation'))
+        self.assertEqual(reputation, {'Alice Smith': 18, 'Bob': -2})
+
+    def test_post_text_keeps_code(self):
+        body = (
+            '<p>Compare with <code>a &lt; b</code>, or <code>`b`</code>:</p>\n\n'
+            '<pre class="lang-py"><code>if a &lt; b:\n    print("&lt;p&gt;")\n</code></pre>\n\n<p>Fish &amp;amp; chips</p>'
+        )
+        self.assertEqual(
+            post_text(body),
+            'Compare with `a < b`, or `` `b` ``:\n\n```\nif a < b:\n    print("<p>")\n```\n\nFish &amp; chips',
+        )
+        self.assertEqual(post_text('<pre><code>```\n</code></pre>'), '````\n```\n````')
+
+    def test_resume_after_interruption(self):
+        run = ImportRun.objects.create(source=self.directory.name, stack=Stack.objects.create(title='Dump', created_by=self.admin))
+        voter = DumpImporter.voter
+        calls = []
+
+        def interrupt(importer, ordinal):
+            calls.append(ordinal)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            return voter(importer, ordinal)
+
+        with mock.patch.object(DumpImporter, 'voter', interrupt), self.assertRaises(KeyboardInterrupt):
+            DumpImporter(run, self.directory.name, batch_size=2).run_all()
+        run.refresh_from_db()
+        self.assertEqual((run.phase, run.position, Vote.objects.count()), ('votes', 2, 2))
+
+        DumpImporter(run, self.directory.name, batch_size=2).run_all()
+        self.assertEqual(run.phase, 'done')
+        # The third vote on the question went to a third voter
+        self.assertEqual(Vote.objects.filter(question__isnull=False).values('user').distinct().count(), 3)
+        self.assertEqual(Question.objects.get().score, 1)
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class ConcurrentVoteTests(VoteFixtureMixin, TransactionTestCase):
+    threads = 8
+    toggles_per_thread = 250
+
+    def test_concurrent_toggles_keep_totals_exact(self):
+        self.create_vote_fixture(voters=4)
+        view = UpDownVoteView()
+        errors = []
+
+        def toggle(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.toggles_per_thread):
+                    answer_id = self.answer.id if rng.random() < 0.5 else None
+                    view.cast_vote(rng.choice(self.voters), self.stack.id, self.question.id, rng.choice(['up', 'down']), answer_id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=toggle, args=(seed,)) for seed in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+        expected_owner = 0
+        for target, votes in ((self.question, Vote.objects.filter(question=self.question)),
+                              (self.answer, Vote.objects.filter(answer=self.answer))):
+            ups = votes.filter(vote_type='up').count()
+            downs = votes.filter(vote_type='down').count()
+            target.refresh_from_db()
+            self.assertEqual((target.upvotes, target.downvotes, target.score), (ups, downs, ups - downs))
+            expected_owner += 10 * ups - 2 * downs
+
+        self.assertEqual(self.reputation(self.owner), expected_owner)
+        for voter in self.voters:
+            answer_downvotes = Vote.objects.filter(user=voter, answer=self.answer, vote_type='down').count()
+            self.assertEqual(self.reputation(voter), -answer_downvotes)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Replicates by copying the SQLite database")
+@override_settings(REPLICA_DATABASES=['test_replica'])
+class ReplicaRoutingTests(VoteFixtureMixin, TransactionTestCase):
+    # Including the replica, which only exists while the class runs
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # A second SQLite file, copied from the test database by setUp, under an alias of its
+        # own: a replica configured in DATABASES is a mirror of the test database
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings['test_replica'] = {
+            **connections['default'].settings_dict,
+            'NAME': os.path.join(cls.directory.name, 'test_replica.sqlite3'),
+            'TEST': {'MIRROR': 'default'},
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['test_replica'].close()
+        del connections['test_replica']
+        del connections.settings['test_replica']
+        cls.directory.cleanup()
+
+    def setUp(self):
+        replica_health.reset()
+        self.addCleanup(replica_health.reset)
+        cache.clear()
+
+        self.create_vote_fixture()
+        self.stack_url = reverse('stack', args=[self.stack.id, self.stack.slug])
+        self.question_url = reverse('question_detail', args=[self.stack.id, self.question.id])
+        self.client.force_login(self.voters[0])
+        copy_sqlite_database('test_replica')
+
+    def get(self, url):
+        """The response, and the databases it read from"""
+        with capture_queries(['default', 'test_replica']) as queries:
+            response = self.client.get(url)
+        return response, {alias for alias, sql, params in queries if sql.lstrip().upper().startswith('SELECT')}
+
+    def test_reads_go_to_the_replica(self):
+        response, aliases = self.get(self.question_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(aliases, {'test_replica'})
+        # The view is written to the primary, without pinning the client to it
+        self.assertEqual(PendingView.objects.using('default').count(), 1)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertFalse(router.allow_migrate('test_replica', 'stackexchangeapp'))
+        self.assertTrue(router.allow_migrate('default', 'stackexchangeapp'))
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        with capture_queries(['default', 'test_replica']) as queries:
+            response = self.client.post(self.question_url, {'description': 'A fresh answer'})
+        self.assertEqual({alias for alias, sql, params in queries}, {'default'})
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        response, aliases = self.get(self.question_url)
+        self.assertEqual(aliases, {'default'})
+        self.assertContains(response, 'A fresh answer')
+
+        # Once the window is over, back to the replica, which doesn't have the answer yet
+        self.client.cookies[PIN_COOKIE] = str(time.time() - 1)
+        response, aliases = self.get(self.question_url)
+        self.assertEqual(aliases, {'test_replica'})
+        self.assertNotContains(response, 'A fresh answer')
+
+        # Cards rendered from the stale replica aren't cached under the new version
+        answers = r'>%d</div>\s*<div class="text-xs">answers'
+        card = self.get(self.stack_url)[0].context['questions'].object_list[0].fragments['card']
+        self.assertNotRegex(card, answers % Question.objects.get().answer_count)
+        copy_sqlite_database('test_replica')
+        card = self.get(self.stack_url)[0].context['questions'].object_list[0].fragments['card']
+        self.assertRegex(card, answers % Question.objects.get().answer_count)
+
+    def test_missing_rows_are_read_from_the_primary(self):
+        question = Question.objects.create(title='Just asked', description='...', asked_by=self.owner, stack=self.stack)
+        response, aliases = self.get(reverse('question_detail', args=[self.stack.id, question.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(aliases, {'test_replica', 'default'})
+
+    def test_lagging_replica_is_left_out(self):
+        with mock.patch('stackexchangeapp.routing.replica_lag', return_value=60):
+            self.assertEqual(self.get(self.question_url)[1], {'default'})
+        # Until REPLICA_RETRY_SECONDS pass
+        self.assertEqual(self.get(self.question_url)[1], {'default'})
+        replica_health.reset()
+        self.assertEqual(self.get(self.question_url)[1], {'test_replica'})
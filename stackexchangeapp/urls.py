@@ -1,5 +1,6 @@
 from django.urls import path, include
 from .views import *
+from .api import StackApiView, QuestionApiView, AnswerApiView, TagApiView, MembershipApiView
 from django.contrib.auth.decorators import login_required
 from django.conf.urls import handler404
 
@@ -7,15 +8,34 @@ urlpatterns = [
     path('', HomeView.as_view(), name="home"),
     path('accounts/signup/', SignUpView.as_view(), name="signup"),
     path('accounts/', include("django.contrib.auth.urls")),
+    path('inbox/', InboxView.as_view(), name="inbox"),
     path('create-stack/', StackCreationView.as_view(), name="create_stack"),
+    path('staff/queries/', QueryReportView.as_view(), name="query_report"),
+    path('staff/jobs/', JobMetricsView.as_view(), name="job_metrics"),
+    path('staff/export/<int:stack_id>', StackExportView.as_view(), name="export_stack"),
     path('join-stack/<int:stack_id>', JoinStackView.as_view(), name="join_stack"),
     path('leave-stack/<int:stack_id>', LeaveStackView.as_view(), name="leave_stack"),
     path('stack/<int:stack_id>/ask', AskQuestionView.as_view(),name="ask_question"),
+    path('stack/<int:stack_id>/search', SearchView.as_view(), name="search"),
+    path('stack/<int:stack_id>/reputation/json', ReputationHistoryView.as_view(), name="reputation_history"),
     path('stack/<int:stack_id>/<slug:stack_slug>', StackDetailView.as_view(),name="stack"),
     path('stack/<int:stack_id>/question/<int:question_id>', QuestionDetailView.as_view(), name="question_detail"),
+    path('stack/<int:stack_id>/question/<int:question_id>/events', QuestionEventsView.as_view(), name='question_events'),
     path('stack/<int:stack_id>/question/<int:question_id>/<str:vote_type>', UpDownVoteView.as_view(), name='question_vote'),
     path('stack/<int:stack_id>/answer/<int:question_id>/<int:answer_id>/vote/<str:vote_type>', UpDownVoteView.as_view(), name='answer_vote'),
-    path('stack/<int:stack_id>/answer/<int:question_id>/<int:answer_id>/accept', AcceptAnswerView.as_view(), name='accept_answer')
+    path('stack/<int:stack_id>/answer/<int:question_id>/<int:answer_id>/accept', AcceptAnswerView.as_view(), name='accept_answer'),
+    path('stack/<int:stack_id>/question/<int:question_id>/<str:vote_type>/json', UpDownVoteJsonView.as_view(), name='question_vote_json'),
+    path('stack/<int:stack_id>/answer/<int:question_id>/<int:answer_id>/vote/<str:vote_type>/json', UpDownVoteJsonView.as_view(), name='answer_vote_json'),
+    path('stack/<int:stack_id>/answer/<int:question_id>/<int:answer_id>/accept/json', AcceptAnswerJsonView.as_view(), name='accept_answer_json'),
+    path('api/stacks', StackApiView.as_view(), name='api_stacks'),
+    path('api/stacks/<int:stack_id>', StackApiView.as_view(), name='api_stack'),
+    path('api/stacks/<int:stack_id>/questions', QuestionApiView.as_view(), name='api_questions'),
+    path('api/stacks/<int:stack_id>/questions/<int:question_id>', QuestionApiView.as_view(), name='api_question'),
+    path('api/stacks/<int:stack_id>/questions/<int:question_id>/answers', AnswerApiView.as_view(), name='api_question_answers'),
+    path('api/stacks/<int:stack_id>/answers/<int:answer_id>', AnswerApiView.as_view(), name='api_answer'),
+    path('api/stacks/<int:stack_id>/tags', TagApiView.as_view(), name='api_tags'),
+    path('api/stacks/<int:stack_id>/members', MembershipApiView.as_view(), name='api_members'),
+    path('api/memberships', MembershipApiView.as_view(), name='api_memberships'),
 ]
 
 handler404 = 'stackexchangeapp.views.ErrorView'
\ No newline at end of file
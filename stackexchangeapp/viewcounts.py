@@ -0,0 +1,141 @@
+"""
+Write-behind view counts of questions.
+
+Viewing a question page doesn't update the question: a view is counted once
+per user per VIEW_DEDUPE_SECONDS (cache.add of a "seen" key) and added to the
+ViewBuffer of the process, in memory. Once it holds VIEW_BUFFER_SIZE views
+or is VIEW_BUFFER_SECONDS old, the view filling it writes them all to the
+PendingView table, one row per question in a single INSERT that locks
+nothing the pages read. flush_views (the flush_view_counts command, run
+every minute or so) takes the pending views a chunk at a time, deletes them
+and adds them to Question.view_count in the same transaction, so every
+written view is applied exactly once, whichever process recorded it, and
+concurrent flushes skip the rows another one holds.
+
+The buffers are per process, so this works with any cache, at the cost of
+the views still buffered when a process stops. The cache only deduplicates
+the views of a user, and does so across processes when it's shared
+(VIEW_COUNT_CACHE_ALIAS): with a per-process cache, a user may be counted
+once per process. Counts are eventually consistent: the stack and question
+pages show them as of the last flush.
+"""
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from .models import Stack, Question, PendingView
+from .routing import PRIMARY
+
+
+class ViewBuffer:
+    """The views counted by this process and not written yet"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # {question id: views}
+        self.counts = Counter()
+        self.views = 0
+        self.started = time.monotonic()
+
+    def take_locked(self):
+        counts = self.counts
+        self.reset()
+        return counts
+
+    def take(self):
+        """Empty the buffer. Returns its views."""
+        with self.lock:
+            return self.take_locked()
+
+    def add(self, question_id):
+        """Buffer a view. Returns the views to write once the buffer is full or old enough, else None."""
+        with self.lock:
+            self.counts[question_id] += 1
+            self.views += 1
+            if (self.views < getattr(settings, 'VIEW_BUFFER_SIZE', 1000)
+                    and time.monotonic() - self.started < getattr(settings, 'VIEW_BUFFER_SECONDS', 10)):
+                return None
+            return self.take_locked()
+
+    def get(self, question_id):
+        with self.lock:
+            return self.counts[question_id]
+
+
+view_buffer = ViewBuffer()
+
+
+def get_cache():
+    return caches[getattr(settings, 'VIEW_COUNT_CACHE_ALIAS', 'default')]
+
+
+def seen_key(question_id, user_id):
+    return f'views:seen:{question_id}:{user_id}'
+
+
+def write_views(counts):
+    """Append views, {question id: views}, to PendingView in one INSERT"""
+    if not counts:
+        return
+    # On the primary without going through the router, which would pin the client to it
+    pending = PendingView.objects.using(PRIMARY)
+    try:
+        pending.bulk_create([PendingView(question_id=question_id, count=count) for question_id, count in counts.items()])
+    except IntegrityError:
+        # A question was deleted since its views were buffered
+        existing = set(Question.objects.using(PRIMARY).filter(pk__in=counts).values_list('pk', flat=True))
+        pending.bulk_create([PendingView(question_id=question_id, count=count)
+                             for question_id, count in counts.items() if question_id in existing])
+
+
+async def arecord_view(question_id, user_id):
+    """Buffer a view of a question by a user. Returns whether it counted."""
+    if not getattr(settings, 'RECORD_VIEWS', True):
+        return False
+    if not await get_cache().aadd(seen_key(question_id, user_id), 1, getattr(settings, 'VIEW_DEDUPE_SECONDS', 1800)):
+        return False
+    counts = view_buffer.add(question_id)
+    if counts is not None:
+        await sync_to_async(write_views)(counts)
+    return True
+
+
+def pending_views(question_id):
+    """The views of a question not applied yet, written or still buffered by this process"""
+    written = PendingView.objects.filter(question_id=question_id).aggregate(views=Sum('count'))['views']
+    return (written or 0) + view_buffer.get(question_id)
+
+
+def flush_views(chunk_size=1000):
+    """Apply the buffered views to the questions, this process' first. Returns the number of views applied."""
+    write_views(view_buffer.take())
+    applied = 0
+    while True:
+        with transaction.atomic():
+            pending = PendingView.objects.order_by('pk')
+            if connection.features.has_select_for_update_skip_locked:
+                pending = pending.select_for_update(skip_locked=True)
+            rows = list(pending.values_list('pk', 'question_id', 'count')[:chunk_size])
+            if not rows:
+                return applied
+            PendingView.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+            counts = Counter()
+            for _, question_id, count in rows:
+                counts[question_id] += count
+            Question.objects.filter(pk__in=counts).update(view_count=F('view_count') + Case(
+                *[When(pk=question_id, then=Value(count)) for question_id, count in counts.items()],
+                default=Value(0),
+            ))
+            # Changes the views sort of the stacks, see StackDetailView.aget_validators
+            Stack.objects.filter(questions__pk__in=counts).update(views_flushed_at=timezone.now())
+        applied += counts.total()
@@ -1,13 +1,105 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.core.exceptions import PermissionDenied
 from .forms import UserCreationFormStackApp, StackCreationForm, QuestionForm, AnswerForm
 from django.urls import reverse_lazy, reverse
 from django.views.generic import CreateView, TemplateView, View, DetailView
 from django.views.generic.edit import FormMixin
 from .models import *
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q, Count
+from .pagination import KeysetPaginator, InvalidCursor
+from .search import search_questions
+from .fragments import load_fragments, invalidate_fragments
+from .reputation import VOTE_DELTAS, record_events, vote_events, reputation_history
+from .ranking import HOT_WEIGHTS, hot_vote_change
+from .tags import tag_cloud, tag_cloud_queryset
+from .directory import DIRECTORY_SORTS, ajoined_stack_ids, directory_queryset, invalidate_joined_stacks
+from .instrumentation import endpoint_stats
+from .export import FORMATS, TABLES, encode, export_stack, aiterate
+from .viewcounts import arecord_view
+from .jobs import queue_metrics
+from .notifications import mark_read, notify_accepted
+from .live import event_stream, live_updates, publish_on_commit, question_channel
+from django.contrib.auth.mixins import AccessMixin, LoginRequiredMixin, UserPassesTestMixin
+from django.db.models import F, Exists, OuterRef, Subquery, prefetch_related_objects, aprefetch_related_objects
+from django.db import connection, transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+import asyncio
+import hashlib
 # Create your views here.
 
+async def alist(queryset):
+    return [obj async for obj in queryset]
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """LoginRequiredMixin for async views: loads the user without blocking the event loop"""
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+class ConditionalGetMixin:
+    """
+    Answer If-None-Match / If-Modified-Since with a 304 before the view runs.
+
+    get_validators() returns (last activity, per-user etag parts) from one cheap
+    lookup, or None to let the view handle the request (e.g. with a 404). Pages
+    show per-user state, so the user and their last login are always part of
+    the validators: logging in as someone else invalidates both.
+    Async views override aget_validators() instead.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self.adispatch(request, *args, **kwargs)
+        validators = self.get_validators(request, **kwargs)
+        if validators is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        etag, last_modified = self.get_etag(request, *validators)
+        response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return self.patch_response(response, etag, last_modified)
+
+    async def adispatch(self, request, *args, **kwargs):
+        validators = await self.aget_validators(request, **kwargs)
+        if validators is None:
+            return await super().dispatch(request, *args, **kwargs)
+
+        etag, last_modified = self.get_etag(request, *validators)
+        response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+        if response is None:
+            response = await super().dispatch(request, *args, **kwargs)
+        return self.patch_response(response, etag, last_modified)
+
+    def get_etag(self, request, last_activity, user_parts):
+        last_modified = max(filter(None, [last_activity, request.user.last_login]))
+        # The unread notifications badge is on every page
+        key = repr((request.user.pk, request.user.last_login, request.user.notifications_version, last_activity, user_parts))
+        return quote_etag(hashlib.md5(key.encode()).hexdigest()), last_modified
+
+    def patch_response(self, response, etag, last_modified):
+        if response.status_code in (200, 304):
+            response.headers.setdefault('ETag', etag)
+            response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+            # Always revalidate, and never from a cache shared between users
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Cookie'])
+        return response
+
+    def get_validators(self, request, **kwargs):
+        raise NotImplementedError
+
+    async def aget_validators(self, request, **kwargs):
+        raise NotImplementedError
+
 class ErrorView():
     def get(request):
         return render(request, '404.html')
@@ -17,44 +109,169 @@ class SignUpView(CreateView):
     success_url = reverse_lazy("login")
     template_name = "registration/signup.html"
 
-class HomeView(LoginRequiredMixin, TemplateView):
+class HomeView(AsyncLoginRequiredMixin, TemplateView):
     template_name = "home.html"
-    def get(self, request, *args, **kwargs):
-        stacks = Stack.objects.all()
-        joined_stacks_ids = StackMembership.objects.filter(user=request.user).values_list('stack_id', flat=True)
-        context = {"user": request.user, "stacks": stacks, 'joined_stacks_ids':joined_stacks_ids}
-        return render(request, self.template_name, context)
+    paginate_by = 30
+    # Session, user, the page of stacks, and the joined stacks and unread count when they aren't cached
+    query_budget = 5
+    async def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '').strip()
+        sort = request.GET.get('sort')
+        if sort not in DIRECTORY_SORTS:
+            sort = 'active'
+        paginator = KeysetPaginator(directory_queryset(query), DIRECTORY_SORTS[sort], self.paginate_by)
+        try:
+            page, joined_stacks_ids = await asyncio.gather(
+                paginator.apage(request.GET.get('cursor')),
+                ajoined_stack_ids(request.user),
+            )
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        context = {
+            "user": request.user,
+            "stacks": page,
+            "page": page,
+            "query": query,
+            "sort": sort,
+            "sort_modes": list(DIRECTORY_SORTS),
+            'joined_stacks_ids': joined_stacks_ids,
+        }
+        # A TemplateResponse is rendered by Django in a worker thread, off the event loop
+        return TemplateResponse(request, self.template_name, context)
 
 class StackCreationView(LoginRequiredMixin, CreateView):
     template_name = "stack_creation.html"
     form_class = StackCreationForm
     success_url = reverse_lazy("home")
+    @transaction.atomic
     def form_valid(self, form):
         form.instance.created_by = self.request.user
+        # The creator is the first member
+        form.instance.member_count = 1
         response = super().form_valid(form)
         StackMembership.objects.create(user=self.request.user, stack=form.instance, reputation = 0)
+        invalidate_joined_stacks(self.request.user.pk)
         return response
     
 class JoinStackView(LoginRequiredMixin, CreateView):
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         stack_id = kwargs['stack_id']
         stack = get_object_or_404(Stack, pk=stack_id)
-        StackMembership.objects.get_or_create(user=request.user, stack=stack, defaults={'reputation':0})
+        membership, created = StackMembership.objects.get_or_create(user=request.user, stack=stack, defaults={'reputation':0})
+        if created:
+            Stack.objects.filter(pk=stack.pk).update(member_count=F('member_count') + 1)
+            invalidate_joined_stacks(request.user.pk)
         return redirect('home')
     
 class LeaveStackView(LoginRequiredMixin, CreateView):
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         stack_id = kwargs['stack_id']
         stack = get_object_or_404(Stack, pk=stack_id)
-        StackMembership.objects.filter(user=request.user, stack=stack).delete()
+        deleted, _ = StackMembership.objects.filter(user=request.user, stack=stack).delete()
+        if deleted:
+            Stack.objects.filter(pk=stack.pk).update(member_count=F('member_count') - deleted)
+            invalidate_joined_stacks(request.user.pk)
         return redirect('home')
     
-class StackDetailView(LoginRequiredMixin, View):
+class StackDetailView(AsyncLoginRequiredMixin, ConditionalGetMixin, View):
+    paginate_by = 30
+    query_budget = 9
+    # Each ordering is served by one of the Question indexes, see Question.Meta
+    sort_orderings = {
+        'newest': ('-created_at', '-id'),
+        'votes': ('-score', '-id'),
+        'active': ('-last_activity_at', '-id'),
+        'hot': ('-hot_score', '-id'),
+        'views': ('-view_count', '-id'),
+        'unanswered': ('-created_at', '-id'),
+    }
+
+    async def aget_validators(self, request, **kwargs):
+        # The page also shows the user's reputation in the stack
+        memberships = StackMembership.objects.filter(user=request.user, stack_id=kwargs['stack_id']).values_list(
+            'stack__last_activity_at', 'stack__hot_decayed_at', 'stack__views_flushed_at', 'reputation'
+        )
+        # At most one row: sliced rather than afirst(), which would sort it by pk
+        async for last_activity_at, hot_decayed_at, views_flushed_at, reputation in memberships[:1]:
+            # Decays and view count flushes reorder the hot and views sorts without any activity
+            last_modified = max(filter(None, [last_activity_at, hot_decayed_at, views_flushed_at]))
+            return last_modified, (reputation, hot_decayed_at, views_flushed_at)
+
+    async def get(self, request, *args, **kwargs):
+        stack, membership, tag, cloud = await asyncio.gather(
+            aget_object_or_404(Stack, pk=kwargs['stack_id']),
+            aget_object_or_404(StackMembership, user=request.user, stack_id=kwargs['stack_id']),
+            self.get_tag(kwargs['stack_id'], request.GET.get('tag')),
+            alist(tag_cloud_queryset(kwargs['stack_id'])),
+        )
+        sort = request.GET.get('sort')
+        if sort not in self.sort_orderings:
+            sort = 'newest'
+
+        paginator = self.get_paginator(stack, tag, sort)
+        try:
+            page = await paginator.apage(request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        if tag is not None and sort in ('newest', 'unanswered'):
+            page.object_list = [row.question for row in page.object_list]
+        # Tags are only needed to render the cards that aren't cached
+        uncached = await sync_to_async(load_fragments)(page, 'question', ['card'])
+        await aprefetch_related_objects(uncached, 'tags')
+
+        context = {
+            'stack': stack,
+            'questions': page,
+            'page': page,
+            'sort': sort,
+            'sort_modes': list(self.sort_orderings),
+            'membership': membership,
+            'tag': tag,
+            'tag_cloud': tag_cloud(cloud),
+        }
+        return TemplateResponse(request, 'stack.html', context)
+
+    async def get_tag(self, stack_id, name):
+        if name:
+            return await aget_object_or_404(Tag, stack_id=stack_id, name=name)
+
+    def get_paginator(self, stack, tag, sort):
+        if tag is not None and sort in ('newest', 'unanswered'):
+            # Newest questions with the tag, from the (tag, -created_at, -question) index of QuestionTag
+            rows = QuestionTag.objects.filter(tag=tag).select_related('question__asked_by').defer('question__description_html')
+            if sort == 'unanswered':
+                rows = rows.filter(question__answer_count=0)
+            return KeysetPaginator(rows, ('-created_at', '-question_id'), self.paginate_by)
+
+        # Cards show the preview, not the body
+        questions = stack.questions.select_related('asked_by').defer('description_html')
+        if tag is not None:
+            questions = questions.filter(tags=tag)
+        if sort == 'unanswered':
+            questions = questions.filter(answer_count=0)
+        return KeysetPaginator(questions, self.sort_orderings[sort], self.paginate_by)
+
+class SearchView(LoginRequiredMixin, View):
+    results_limit = 50
+    query_budget = 7
+
     def get(self, request, *args, **kwargs):
-        stack = Stack.objects.get(pk=kwargs['stack_id'])
+        stack = get_object_or_404(Stack, pk=kwargs['stack_id'])
         membership = get_object_or_404(StackMembership, user=request.user, stack=stack)
-        context = {'stack': stack, 'questions':stack.questions.all(), 'membership':membership}
-        return render(request, 'stack.html', context)
+        query = request.GET.get('q', '')
+        question_ids = search_questions(stack.id, query, limit=self.results_limit)
+        questions = Question.objects.select_related('asked_by').defer('description_html').in_bulk(question_ids)
+        questions = [questions[pk] for pk in question_ids if pk in questions]
+        prefetch_related_objects(load_fragments(questions, 'question', ['card']), 'tags')
+        context = {
+            'stack': stack,
+            'membership': membership,
+            'query': query,
+            'questions': questions,
+        }
+        return render(request, 'search.html', context)
 
 class AskQuestionView(LoginRequiredMixin, CreateView):
     form_class = QuestionForm
@@ -76,25 +293,77 @@ class AskQuestionView(LoginRequiredMixin, CreateView):
             'stack_slug': self.object.stack.slug,
         })
     
-class QuestionDetailView(LoginRequiredMixin, DetailView, FormMixin):
+class QuestionDetailView(AsyncLoginRequiredMixin, ConditionalGetMixin, DetailView, FormMixin):
     template_name = "question_detail.html"
     model = Question
     context_object_name = 'question'
     pk_url_kwarg = 'question_id'
     form_class = AnswerForm
+    # Session, user, validators, question, answers, the user's vote, tags when the body
+    # fragment isn't cached, the unread count when it isn't, and now and then the INSERT
+    # writing the views buffered by the process. Posting an answer: session, user, question, the answer, the
+    # two jobs it enqueues, the question and stack counters, and the
+    # SAVEPOINT/RELEASE pair inside a test's transaction
+    query_budget = 10
+    paginate_answers_by = 30
+    # Accepted first, then by score, oldest first: served by answer_question_order_idx
+    answer_ordering = ('-is_accepted', '-score', 'created_at', 'id')
+
+    async def aget_validators(self, request, **kwargs):
+        # The asker sees accept buttons; the user's own votes bump last_activity_at.
+        # The view count is flushed without any activity.
+        question = Question.objects.filter(pk=kwargs['question_id'], stack_id=kwargs['stack_id'])
+        validators = await question.values_list('last_activity_at', 'asked_by_id', 'view_count').afirst()
+        if validators is not None:
+            last_activity_at, asked_by_id, view_count = validators
+            return last_activity_at, (asked_by_id == request.user.pk, view_count)
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('stack', 'asked_by')
+
+    def get_answers(self):
+        # The current user's vote, so the page and the JSON endpoints agree on vote state.
+        # question__isnull matches the condition of the (user, answer) unique index.
+        user_votes = Vote.objects.filter(user=self.request.user, question__isnull=True)
+        answers = self.object.answer_set.select_related('answered_by').annotate(
+            user_vote=Subquery(user_votes.filter(answer=OuterRef('pk')).values('vote_type')[:1])
+        )
+        return KeysetPaginator(answers, self.answer_ordering, self.paginate_answers_by)
+
+    def get_question_vote(self):
+        return Vote.objects.filter(user=self.request.user, question=self.object, answer__isnull=True).values_list('vote_type', flat=True)
+
+    async def get(self, request, *args, **kwargs):
+        self.object = await aget_object_or_404(self.get_queryset(), pk=kwargs[self.pk_url_kwarg])
+        # Only buffered, written in batches and flushed to view_count by flush_view_counts
+        await arecord_view(self.object.pk, request.user.pk)
+        try:
+            answers, question_user_vote = await asyncio.gather(
+                self.get_answers().apage(request.GET.get('cursor')),
+                self.get_question_vote().afirst(),
+            )
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        context = await sync_to_async(self.get_context_data)(answers=answers, question_user_vote=question_user_vote)
+        return self.render_to_response(context)
 
     def get_context_data(self, **kwargs):
+        if 'answers' not in kwargs:
+            # Re-rendering the answer form: the first page
+            kwargs['answers'] = self.get_answers().page()
+            kwargs['question_user_vote'] = self.get_question_vote().first()
         context = super().get_context_data(**kwargs)
-        answers = self.object.answer_set.annotate(
-            vote_score=Count('vote', filter=Q(vote__vote_type=True)) -
-                        Count('vote', filter=Q(vote__vote_type=False))
-        ).order_by('-vote_score')
-        context['answers'] = answers
+        load_fragments([self.object], 'question', ['body'])
+        load_fragments(context['answers'], 'answer', ['body'])
         if 'form' not in context:
             context['form'] = self.get_form()
+        context['live_updates'] = live_updates(self.request)
         return context
-    
-    def post(self, request, *args, **kwargs):
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(self.post_answer)(request, *args, **kwargs)
+
+    def post_answer(self, request, *args, **kwargs):
         self.object = self.get_object()
         form = self.get_form()
 
@@ -103,11 +372,16 @@ class QuestionDetailView(LoginRequiredMixin, DetailView, FormMixin):
         else:
             return self.form_invalid(form)
         
+    @transaction.atomic
     def form_valid(self, form):
         answer = form.save(commit=False)
         answer.question = self.object
         answer.answered_by = self.request.user
         answer.save()
+        record_activity(self.object.stack_id, self.object.pk, answer.created_at,
+                        stack_changes={'answer_count': F('answer_count') + 1},
+                        answer_count=F('answer_count') + 1, hot_score=F('hot_score') + HOT_WEIGHTS['answer'])
+        invalidate_fragments('question', self.object.pk)
 
         return super().form_valid(form)
     
@@ -117,126 +391,329 @@ class QuestionDetailView(LoginRequiredMixin, DetailView, FormMixin):
             'question_id':self.object.id,
         })
 
-class AcceptAnswerView(View):
+class AcceptAnswerView(LoginRequiredMixin, View):
+    # Session, user, answer, then switching from another answer: the locked question, both answers,
+    # the notification of the answerer with the bump of their notifications version, the question
+    # and stack activity, and the SAVEPOINT/RELEASE pair inside a test's transaction
+    query_budget = 12
     def post(self, request, stack_id, question_id, answer_id):
-        answer = get_object_or_404(Answer, id=answer_id)
-        accepted_answer = Answer.objects.filter(question=answer.question, is_accepted=True).first()
-        accept = request.POST.get('accept', '')
-        if accepted_answer:
-            accepted_answer.is_accepted = False
-            answer.is_accepted = True
-            answer.save()
-            accepted_answer.save()
-        else:
-            if accept == "True":
-                answer.is_accepted=True
-                answer.save()
-            elif accept == "False":
-                answer.is_accepted=False
-                answer.save()
+        try:
+            self.toggle_accept(request.user, stack_id, question_id, answer_id, request.POST.get('accept', ''))
+        except PermissionDenied:
+            pass
         return redirect('question_detail', stack_id=stack_id, question_id=question_id)
 
+    def toggle_accept(self, user, stack_id, question_id, answer_id, accept):
+        """
+        Accept (accept == "True") or unaccept (accept == "False") an answer.
+        Only the asker may do this. Returns the id of the accepted answer afterwards.
+        """
+        answer = get_object_or_404(
+            Answer.objects.select_related('question'),
+            id=answer_id, question_id=question_id, question__stack_id=stack_id,
+        )
+        if answer.question.asked_by_id != user.pk:
+            raise PermissionDenied("Only the asker can accept an answer")
+
+        with transaction.atomic():
+            # The locked pointer serializes concurrent accepts; unique_accepted_answer backs it up
+            previous = Question.objects.select_for_update().filter(pk=question_id).values_list('accepted_answer_id', flat=True).get()
+            if accept == "True":
+                accepted = answer.pk
+            elif accept == "False" and previous == answer.pk:
+                accepted = None
+            else:
+                accepted = previous
+            if accepted == previous:
+                return accepted
+
+            if previous is not None:
+                Answer.objects.filter(pk=previous).update(is_accepted=False)
+                invalidate_fragments('answer', previous)
+            if accepted is not None:
+                Answer.objects.filter(pk=accepted).update(is_accepted=True)
+                notify_accepted(answer, user.pk)
+                invalidate_fragments('answer', accepted)
+            record_activity(stack_id, question_id, accepted_answer_id=accepted)
+            invalidate_fragments('question', question_id)
+            publish_on_commit(question_id, {'type': 'accept', 'accepted_answer_id': accepted})
+        return accepted
+
+class AcceptAnswerJsonView(AcceptAnswerView):
+    raise_exception = True
+
+    def post(self, request, stack_id, question_id, answer_id):
+        try:
+            accepted_answer_id = self.toggle_accept(request.user, stack_id, question_id, answer_id, request.POST.get('accept', ''))
+        except PermissionDenied as e:
+            return JsonResponse({'error': str(e)}, status=403)
+        return JsonResponse({'accepted_answer_id': accepted_answer_id})
+
 class UpDownVoteView(LoginRequiredMixin, View):
+    # Session, user, then cast_vote: 9 statements, 11 when the owner reaches a reputation milestone
+    # (the notification and the bump of their notifications version), and the SAVEPOINT/RELEASE
+    # pair its atomic() becomes inside a test's transaction
+    query_budget = 15
+    # (owner delta, voter delta) for a vote, keyed by (vote_type, is_answer)
+    REPUTATION_DELTAS = VOTE_DELTAS
+    UPDATE_SCORE = '''
+        UPDATE {table} SET upvotes = upvotes + %s, downvotes = downvotes + %s, score = score + %s
+        WHERE id = %s RETURNING score, upvotes, downvotes
+    '''
+    # A no-op when a concurrent request inserted the user's vote first, see unique_user_question_vote
+    INSERT_VOTE = '''
+        INSERT INTO {table} (user_id, question_id, answer_id, vote_type, created_at) VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT DO NOTHING RETURNING id
+    '''
+
     def post(self, request, stack_id, question_id, vote_type, answer_id=None):
-        # Get objects
-        stack = get_object_or_404(Stack, pk=stack_id)
-        question = get_object_or_404(Question, pk=question_id)
-        answer = get_object_or_404(Answer, pk=answer_id) if answer_id else None
-        
-        # Determine what we're voting on
-        if answer:
-            target_object = answer
-            content_owner = answer.answered_by
-            vote_filter = {'user': request.user, 'answer': answer}
-            vote_create = {'answer': answer}
+        if vote_type not in ('up', 'down'):
+            raise Http404("Unknown vote type")
+        try:
+            self.cast_vote(request.user, stack_id, question_id, vote_type, answer_id)
+        except PermissionDenied:
+            pass
+        return redirect('question_detail', stack_id=stack_id, question_id=question_id)
+
+    def cast_vote(self, user, stack_id, question_id, vote_type, answer_id=None):
+        """
+        Toggle/change/create the user's vote and apply its score and reputation
+        changes in one transaction. Returns the user's vote type after the call
+        (None when the vote was toggled off), the target's new score, upvotes
+        and downvotes, and the question's accepted answer, as a dict. Raises
+        PermissionDenied when the user may not vote on the target.
+        """
+        if answer_id:
+            target_model = Answer
+            target = Answer.objects.filter(pk=answer_id, question_id=question_id, question__stack_id=stack_id)
+            owner_field = 'answered_by_id'
+            accepted_field = 'question__accepted_answer_id'
+            vote_filter = {'user_id': user.pk, 'answer_id': answer_id}
         else:
-            target_object = question
-            content_owner = question.asked_by
-            vote_filter = {'user': request.user, 'question': question}
-            vote_create = {'question': question}
-        
-        # Can't vote on your own content
-        if request.user == content_owner:
-            return redirect('question_detail', stack_id=stack_id, question_id=question_id)
-        
-        # Get memberships
-        owner_membership = StackMembership.objects.filter(
-            user=content_owner, 
-            stack=stack
-        ).first()
-        
-        voter_membership = StackMembership.objects.filter(
-            user=request.user, 
-            stack=stack
-        ).first()
-        
-        # Check memberships exist
-        if not owner_membership or not voter_membership:
-            return redirect('question_detail', stack_id=stack_id, question_id=question_id)
-        
-        # Check for existing vote
-        existing_vote = Vote.objects.filter(**vote_filter).first()
-        
-        if existing_vote:
-            # Undo old vote reputation
-            self._undo_reputation(
-                existing_vote.vote_type, 
-                owner_membership, 
-                voter_membership,
-                is_answer=bool(answer)
-            )
-            
-            if existing_vote.vote_type == vote_type:
-                # Toggle off - just delete
-                existing_vote.delete()
+            target_model = Question
+            target = Question.objects.filter(pk=question_id, stack_id=stack_id)
+            owner_field = 'asked_by_id'
+            accepted_field = 'accepted_answer_id'
+            vote_filter = {'user_id': user.pk, 'question_id': question_id}
+
+        # The owner, whether both users are members of the stack and the accepted answer, in one query
+        members = StackMembership.objects.filter(stack_id=stack_id)
+        owner_id, owner_is_member, voter_is_member, accepted_answer_id = get_object_or_404(target.values_list(
+            owner_field,
+            Exists(members.filter(user_id=OuterRef(owner_field))),
+            Exists(members.filter(user_id=user.pk)),
+            accepted_field,
+        ))
+        # Can't vote on your own content, and both users must be stack members
+        if owner_id is None or owner_id == user.pk:
+            raise PermissionDenied("You can't vote on your own post")
+        if not (owner_is_member and voter_is_member):
+            raise PermissionDenied("Both users must be members of the stack")
+
+        with transaction.atomic():
+            old_vote_type, new_vote_type = self._write_vote(vote_filter, vote_type)
+            target_pk = answer_id or question_id
+            score, upvotes, downvotes = self._update_score(target_model, target_pk, old_vote_type, new_vote_type)
+            self._update_reputation(stack_id, owner_id, user.pk, old_vote_type, new_vote_type, question_id, answer_id)
+            if answer_id:
+                record_activity(stack_id, question_id)
             else:
-                # Change vote
-                existing_vote.vote_type = vote_type
-                existing_vote.save()
-                
-                # Apply new vote reputation
-                self._apply_reputation(
-                    vote_type, 
-                    owner_membership, 
-                    voter_membership,
-                    is_answer=bool(answer)
-                )
-        else:
-            # Create new vote
-            Vote.objects.create(
-                user=request.user,
-                vote_type=vote_type,
-                **vote_create
-            )
-            
-            # Apply reputation
-            self._apply_reputation(
-                vote_type, 
-                owner_membership, 
-                voter_membership,
-                is_answer=bool(answer)
+                record_activity(stack_id, question_id, hot_score=hot_vote_change(old_vote_type, new_vote_type))
+            invalidate_fragments('answer' if answer_id else 'question', target_pk)
+            publish_on_commit(question_id, {
+                'type': 'score',
+                'target': 'answer' if answer_id else 'question',
+                'id': target_pk,
+                'score': score,
+                'upvotes': upvotes,
+                'downvotes': downvotes,
+            })
+        return {
+            'user_vote': new_vote_type,
+            'score': score,
+            'upvotes': upvotes,
+            'downvotes': downvotes,
+            'accepted_answer_id': accepted_answer_id,
+        }
+
+    def _write_vote(self, vote_filter, vote_type):
+        """
+        Apply the vote to the user's current one, read with a row lock so
+        concurrent requests can't both act on the same stale read. With no
+        current vote there is no row to lock: an insert losing to a concurrent
+        one does nothing, and the vote is read again.
+        Returns (old vote type, new vote type).
+        """
+        votes = Vote.objects.filter(**vote_filter)
+        while True:
+            current = votes.select_for_update().values_list('pk', 'vote_type').first()
+            if current is None:
+                if self._insert_vote(vote_filter, vote_type):
+                    return None, vote_type
+                continue
+            pk, old_vote_type = current
+            if old_vote_type == vote_type:
+                # Same vote again: toggle off
+                Vote.objects.filter(pk=pk).delete()
+                return vote_type, None
+            # Opposite vote: change it
+            Vote.objects.filter(pk=pk).update(vote_type=vote_type)
+            return old_vote_type, vote_type
+
+    def _insert_vote(self, vote_filter, vote_type):
+        """Insert the vote, unless the user's vote on the target exists. Returns whether it was inserted."""
+        with connection.cursor() as cursor:
+            cursor.execute(self.INSERT_VOTE.format(table=Vote._meta.db_table), [
+                vote_filter['user_id'],
+                vote_filter.get('question_id'),
+                vote_filter.get('answer_id'),
+                vote_type,
+                connection.ops.adapt_datetimefield_value(timezone.now()),
+            ])
+            return cursor.fetchone() is not None
+
+    def _update_score(self, target_model, target_pk, old_vote_type, new_vote_type):
+        """
+        Move the stored vote counters of a question/answer from old_vote_type to
+        new_vote_type. Returns the new (score, upvotes, downvotes), from the UPDATE itself.
+        """
+        changes = {'up': 0, 'down': 0}
+        if old_vote_type in changes:
+            changes[old_vote_type] -= 1
+        if new_vote_type in changes:
+            changes[new_vote_type] += 1
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self.UPDATE_SCORE.format(table=target_model._meta.db_table),
+                [changes['up'], changes['down'], changes['up'] - changes['down'], target_pk],
             )
-        
-        # Save memberships
-        owner_membership.save()
-        voter_membership.save()
-        
-        return redirect('question_detail', stack_id=stack_id, question_id=question_id)
-    
-    def _apply_reputation(self, vote_type, owner_membership, voter_membership, is_answer):
-        """Apply reputation changes for a vote"""
-        if vote_type == 'up':
-            owner_membership.reputation += 10
-        else:  # downvote
-            owner_membership.reputation -= 2
-            if is_answer:
-                voter_membership.reputation -= 1  # Cost to downvote answer
-    
-    def _undo_reputation(self, vote_type, owner_membership, voter_membership, is_answer):
-        """Undo reputation changes when removing/changing a vote"""
-        if vote_type == 'up':
-            owner_membership.reputation -= 10
-        else:  # downvote
-            owner_membership.reputation += 2
-            if is_answer:
-                voter_membership.reputation += 1  # Refund downvote cost
\ No newline at end of file
+            return cursor.fetchone()
+
+    def _update_reputation(self, stack_id, owner_id, voter_id, old_vote_type, new_vote_type, question_id, answer_id):
+        """Record the reputation of retracting the old vote and casting the new one"""
+        events = []
+        for vote_type, sign in ((old_vote_type, -1), (new_vote_type, 1)):
+            if vote_type:
+                events += vote_events(vote_type, bool(answer_id), owner_id, voter_id, sign,
+                                      question_id=question_id, answer_id=answer_id)
+        record_events(stack_id, events)
+
+class UpDownVoteJsonView(UpDownVoteView):
+    raise_exception = True
+    # cast_vote returns everything the response needs: no reads after it
+    query_budget = UpDownVoteView.query_budget
+
+    def post(self, request, stack_id, question_id, vote_type, answer_id=None):
+        if vote_type not in ('up', 'down'):
+            return JsonResponse({'error': "Unknown vote type"}, status=400)
+        try:
+            result = self.cast_vote(request.user, stack_id, question_id, vote_type, answer_id)
+        except PermissionDenied as e:
+            return JsonResponse({'error': str(e)}, status=403)
+
+        return JsonResponse({
+            'target': 'answer' if answer_id else 'question',
+            'id': answer_id or question_id,
+            **result,
+        })
+
+class QuestionEventsView(AsyncLoginRequiredMixin, View):
+    """Server-Sent Events of a question page: new scores, answers and accepts, see live.py"""
+    raise_exception = True
+
+    async def get(self, request, stack_id, question_id):
+        if not live_updates(request):
+            # Under WSGI, the endless stream would hold a worker thread
+            raise Http404("No live updates")
+        if not await Question.objects.filter(pk=question_id, stack_id=stack_id).aexists():
+            raise Http404("No such question")
+        response = StreamingHttpResponse(event_stream(question_channel(question_id)), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Or nginx buffers the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+class InboxView(LoginRequiredMixin, View):
+    """The user's notifications, newest first, see notifications.py"""
+    paginate_by = 30
+    # Session, user, then the page and the unread count, or mark_read's two UPDATEs and the
+    # SAVEPOINT/RELEASE pair its atomic() becomes inside a test's transaction
+    query_budget = 6
+
+    def get(self, request):
+        notifications = request.user.notifications.select_related('stack', 'question', 'actor').defer(
+            'question__description', 'question__description_html', 'question__description_preview',
+        )
+        paginator = KeysetPaginator(notifications, ('-created_at', '-id'), self.paginate_by)
+        try:
+            page = paginator.page(request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        return render(request, 'inbox.html', {'notifications': page, 'page': page})
+
+    def post(self, request):
+        mark_read(request.user.pk)
+        return redirect('inbox')
+
+class ReputationHistoryView(LoginRequiredMixin, View):
+    """The user's reputation in a stack at the end of every day it changed, from the daily rollups"""
+    raise_exception = True
+    query_budget = 5
+
+    def get(self, request, stack_id):
+        get_object_or_404(StackMembership, user=request.user, stack_id=stack_id)
+        try:
+            days = int(request.GET['days']) if 'days' in request.GET else None
+        except ValueError:
+            return JsonResponse({'error': "days must be a number"}, status=400)
+        history = reputation_history(stack_id, request.user.pk, days)
+        return JsonResponse({'history': [
+            {'day': day, 'change': change, 'reputation': reputation} for day, change, reputation in history
+        ]})
+
+class QueryReportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Staff-only report of the endpoints running the most queries in this process"""
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        return render(request, 'query_report.html', {'endpoints': endpoint_stats.report()})
+
+    def post(self, request):
+        endpoint_stats.reset()
+        return redirect('query_report')
+
+class JobMetricsView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Staff-only queue depth and job latency, as JSON for monitoring"""
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        return JsonResponse(queue_metrics())
+
+class StackExportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Staff-only download of a stack, streamed as it is read, see export.py"""
+    content_types = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, stack_id):
+        stack = get_object_or_404(Stack, pk=stack_id)
+        fmt = request.GET.get('format', 'jsonl')
+        table = request.GET.get('table') or None
+        compress = request.GET.get('gzip') == '1'
+        if fmt not in FORMATS:
+            return JsonResponse({'error': f"format must be one of {', '.join(FORMATS)}"}, status=400)
+        if table is not None and table not in TABLES:
+            return JsonResponse({'error': f"table must be one of {', '.join(TABLES)}"}, status=400)
+        if fmt == 'csv' and table is None:
+            return JsonResponse({'error': "CSV exports one table at a time, pass table"}, status=400)
+
+        chunks = encode(export_stack(stack.pk, fmt, table), compress)
+        if isinstance(request, ASGIRequest):
+            chunks = aiterate(chunks)
+        response = StreamingHttpResponse(chunks, content_type='application/gzip' if compress else self.content_types[fmt])
+        filename = f"{stack.slug or stack.pk}-{table or 'all'}.{fmt}" + ('.gz' if compress else '')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response